@@ -0,0 +1,231 @@
+# tg_ubot/app/bulk_ingest.py
+
+"""
+Массовая запись бэкфилла в Postgres: страница сообщений копируется
+(COPY ... FROM STDIN, CSV) во временную staging-таблицу и вливается
+в партиционированную messages_<suffix> одним INSERT ... SELECT ... ON CONFLICT.
+
+Схема целевой таблицы принадлежит mirco_services_data_management, поэтому
+план вставки строится по каталогу Postgres (столбцы, уникальные индексы)
+и кешируется на таблицу:
+  - data (jsonb) — сериализованное сообщение целиком;
+  - прочие столбцы (кроме generated) заполняются из одноимённых ключей data;
+  - конфликт — по уникальному индексу из простых столбцов; если такого нет,
+    обновление существующих строк по (chat_id, message_id) и вставка
+    остальных делаются одним запросом с CTE (по tg_chat_id/tg_message_id,
+    если в таблице есть типизированные столбцы, иначе по data).
+Родительскую таблицу и партиции месяцев создаёт сама библиотека: первая
+строка каждого нового month_part пишется через upsert_partitioned_record.
+"""
+
+import csv
+import io
+import json
+import logging
+import os
+import threading
+
+from psycopg2 import sql
+
+from mirco_services_data_management.db import (
+    ensure_partitioned_parent_table,
+    get_connection,
+    upsert_partitioned_record,
+)
+
+from app.migrations import ensure_typed_columns
+
+logger = logging.getLogger("bulk_ingest")
+
+STAGE_TABLE = "tg_ubot_copy_stage"
+MESSAGE_KEY = ("(s.data->>'chat_id')", "(s.data->>'message_id')")
+
+
+class CopyBackfillSink:
+    def __init__(self, schema: str = None, connect=None, upsert_record=None, ensure_table=None):
+        self.schema = schema or os.getenv("TG_UBOT_SCHEMA", "public")
+        self.connect = connect or get_connection
+        self.upsert_record = upsert_record or upsert_partitioned_record
+        self.ensure_table = ensure_table or self._ensure_table
+        self.conn = None
+        # write() вызывается из потоков (asyncio.to_thread) параллельными шардами/сессиями;
+        # соединение и TEMP staging-таблица общие, поэтому страница пишется целиком под замком
+        self._lock = threading.Lock()
+        self._plans = {}
+        self._tables = set()
+        self._months = set()
+
+    @staticmethod
+    def _ensure_table(table_name: str):
+        ensure_partitioned_parent_table(table_name)
+        ensure_typed_columns(table_name)
+
+    def _connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = self.connect()
+        return self.conn
+
+    def close(self):
+        if self.conn is not None and not self.conn.closed:
+            self.conn.close()
+        self.conn = None
+
+    # --- план вставки по каталогу ---
+    def _columns(self, cur, table_name: str) -> list:
+        cur.execute(
+            """
+            SELECT a.attnum, a.attname, format_type(a.atttypid, a.atttypmod),
+                   a.attnotnull, a.atthasdef, a.attgenerated <> ''
+            FROM pg_attribute a
+            JOIN pg_class c ON c.oid = a.attrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+            """,
+            (self.schema, table_name),
+        )
+        return cur.fetchall()
+
+    def _unique_keys(self, cur, table_name: str) -> list:
+        cur.execute(
+            """
+            SELECT i.indkey::text
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = %s AND c.relname = %s AND i.indisunique
+              AND i.indexprs IS NULL AND i.indpred IS NULL
+            ORDER BY i.indisprimary DESC
+            """,
+            (self.schema, table_name),
+        )
+        return [[int(attnum) for attnum in row[0].split()] for row in cur.fetchall()]
+
+    def _plan(self, cur, table_name: str, sample: dict) -> sql.Composed:
+        if table_name in self._plans:
+            return self._plans[table_name]
+
+        columns = self._columns(cur, table_name)
+        if not columns:
+            raise RuntimeError(f"table {self.schema}.{table_name} not found")
+        names, values, by_attnum, generated_names = [], [], {}, set()
+        for attnum, name, col_type, not_null, has_default, generated in columns:
+            if generated:
+                generated_names.add(name)
+                continue
+            if name == "data":
+                names.append(name)
+                values.append(sql.SQL("s.data AS data"))
+            elif name in sample:
+                names.append(name)
+                # col_type — из format_type() каталога, не из данных
+                values.append(sql.SQL("(s.data->>{key})::{type} AS {name}").format(
+                    key=sql.Literal(name), type=sql.SQL(col_type), name=sql.Identifier(name),
+                ))
+            elif not_null and not has_default:
+                raise RuntimeError(f"column {table_name}.{name} cannot be filled from message data")
+            else:
+                continue
+            by_attnum[attnum] = name
+        if "data" not in names:
+            raise RuntimeError(f"table {self.schema}.{table_name} has no data column")
+
+        target = sql.Identifier(self.schema, table_name)
+        columns_sql = sql.SQL(", ").join(map(sql.Identifier, names))
+        source = sql.SQL("SELECT DISTINCT ON ({key}) {values} FROM {stage} s").format(
+            key=sql.SQL(", ".join(MESSAGE_KEY)),
+            values=sql.SQL(", ").join(values),
+            stage=sql.Identifier(STAGE_TABLE),
+        )
+        conflict = next(
+            ([by_attnum[a] for a in key] for key in self._unique_keys(cur, table_name)
+             if all(a in by_attnum for a in key)),
+            None,
+        )
+        if conflict is not None:
+            updates = [
+                sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(n)) for n in names if n not in conflict
+            ]
+            action = (
+                sql.SQL("DO UPDATE SET {}").format(sql.SQL(", ").join(updates)) if updates
+                else sql.SQL("DO NOTHING")
+            )
+            plan = sql.SQL("INSERT INTO {target} ({columns}) {source} ON CONFLICT ({conflict}) {action}").format(
+                target=target, columns=columns_sql, source=source,
+                conflict=sql.SQL(", ").join(map(sql.Identifier, conflict)), action=action,
+            )
+        else:
+            if {"tg_chat_id", "tg_message_id"} <= generated_names:
+                match = sql.SQL(
+                    "p.tg_chat_id = (src.data->>'chat_id')::bigint "
+                    "AND p.tg_message_id = (src.data->>'message_id')::bigint "
+                )
+            else:
+                match = sql.SQL(
+                    "p.data->>'chat_id' = src.data->>'chat_id' "
+                    "AND p.data->>'message_id' = src.data->>'message_id' "
+                )
+            plan = sql.SQL(
+                "WITH src AS ({source}), "
+                "upd AS (UPDATE {target} p SET data = src.data FROM src WHERE {match}"
+                "RETURNING p.data->>'chat_id' AS chat_id, p.data->>'message_id' AS message_id) "
+                "INSERT INTO {target} ({columns}) SELECT {columns} FROM src "
+                "WHERE NOT EXISTS (SELECT 1 FROM upd WHERE upd.chat_id = src.data->>'chat_id' "
+                "AND upd.message_id = src.data->>'message_id')"
+            ).format(source=source, target=target, match=match, columns=columns_sql)
+        logger.debug(f"[CopySink] plan for {self.schema}.{table_name}: {'upsert' if conflict else 'update+insert'}")
+        self._plans[table_name] = plan
+        return plan
+
+    # --- запись ---
+    def write(self, table_name: str, rows: list) -> int:
+        """
+        Синхронно (вызывать через asyncio.to_thread): пишет страницу сообщений в table_name.
+        """
+        rows = [data for data in rows if data]
+        if not rows:
+            return 0
+        with self._lock:
+            return self._write(table_name, rows)
+
+    def _write(self, table_name: str, rows: list) -> int:
+        if table_name not in self._tables:
+            self.ensure_table(table_name)
+            self._tables.add(table_name)
+        rest = []
+        for data in rows:
+            key = (table_name, data.get("month_part"))
+            if key in self._months:
+                rest.append(data)
+                continue
+            # первая строка месяца — через библиотеку, она же создаёт партицию
+            self.upsert_record(table_name, data)
+            self._months.add(key)
+        if not rest:
+            return len(rows)
+
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        for data in rest:
+            writer.writerow([json.dumps(data, ensure_ascii=False, default=str)])
+        buf.seek(0)
+
+        conn = self._connection()
+        try:
+            with conn.cursor() as cur:
+                plan = self._plan(cur, table_name, rest[0])
+                cur.execute(sql.SQL(
+                    "CREATE TEMP TABLE IF NOT EXISTS {} (data jsonb) ON COMMIT DELETE ROWS"
+                ).format(sql.Identifier(STAGE_TABLE)))
+                copy_sql = sql.SQL("COPY {} (data) FROM STDIN WITH (FORMAT csv)").format(sql.Identifier(STAGE_TABLE))
+                cur.copy_expert(copy_sql.as_string(conn), buf)
+                cur.execute(plan)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            self._plans.pop(table_name, None)
+            raise
+        return len(rows)
+
+
+copy_sink = CopyBackfillSink()
@@ -1,5 +1,5 @@
 import os
-from typing import Optional, List
+from typing import Optional, List, Dict
 from pydantic import BaseSettings, Field
 from mirco_services_data_management.config import BaseConfig
 
@@ -10,6 +10,11 @@ class TGUBotSettings(BaseSettings, BaseConfig):
     UBOT_PRODUCE_TOPIC: str = os.getenv("KAFKA_UBOT_OUTPUT_TOPIC", "tg_ubot_output")
     KAFKA_GAP_SCAN_TOPIC: str = os.getenv("KAFKA_GAP_SCAN_TOPIC", "gap_scan_request")
     KAFKA_GAP_SCAN_RESPONSE_TOPIC: str = os.getenv("KAFKA_GAP_SCAN_RESPONSE_TOPIC", "gap_scan_response")
+    # Ключ "<chat_id>:<message_id>" и партиционирование по chat_id
+    KAFKA_KEYED_PRODUCE: bool = True
+    # Compacted-топик с последней версией каждого сообщения ("" — выключено)
+    KAFKA_LATEST_STATE_TOPIC: str = os.getenv("KAFKA_LATEST_STATE_TOPIC", "")
+    KAFKA_LATEST_STATE_PARTITIONS: int = 12
 
     EXCLUDED_CHAT_IDS: Optional[List[int]] = []
     EXCLUDED_USERNAMES: Optional[List[str]] = []
@@ -32,19 +37,129 @@ class TGUBotSettings(BaseSettings, BaseConfig):
     TELEGRAM_TARGET_IDS: Optional[List[int]] = []
 
     SESSION_FILE: str = os.getenv("SESSION_FILE", "userbot.session")
+    # Дополнительные сессии (multi-account): файлы сессий; содержимое можно передать
+    # через SESSION_FILE_BASE64_1, SESSION_FILE_BASE64_2, ... (по порядку)
+    EXTRA_SESSION_FILES: List[str] = []
+    # FloodWait (сек.), начиная с которого чаты сессии переезжают к другим сессиям
+    SESSION_REBALANCE_FLOOD_WAIT: int = 300
+
+    # Несколько реплик: владение чатами через consumer group, чекпойнты в compacted-топике
+    COORDINATION_ENABLED: bool = False
+    COORD_GROUP_ID: str = "tg_ubot_coord"
+    COORD_ASSIGN_TOPIC: str = "tg_ubot_chat_assignment"
+    COORD_STATE_TOPIC: str = "tg_ubot_chat_state"
+    # Число партиций топика назначений = предел параллелизма реплик
+    COORD_PARTITIONS: int = 32
+    COORD_CHECKPOINT_INTERVAL: int = 30
+    # Сколько live-событие ждёт назначения партиций; не дождавшись, реплика обрабатывает его сама
+    COORD_HOLD_TIMEOUT: float = 30
+
+    # Остановка: общий дедлайн на дренаж очередей; недоставленное — в spool-файл
+    SHUTDOWN_DEADLINE: int = 30
+    # Live-доставка в Kafka: попыток на сообщение и базовая пауза между ними (удваивается);
+    # после последней неудачи сообщение уходит в spool-файл
+    LIVE_PRODUCE_RETRIES: int = 5
+    LIVE_PRODUCE_BACKOFF: float = 0.5
+
+    # Догон после рестарта: сообщения новее last_seen_id до включения live-режима
+    CATCHUP_ENABLED: bool = True
+    CATCHUP_CONCURRENCY: int = 4
+    # запросов к Telegram в секунду на весь догон
+    CATCHUP_RATE: float = 5.0
+    CATCHUP_MAX_MESSAGES: int = 5000
+    CATCHUP_TIMEOUT: int = 120
+
+    # Планировщик полос (app.scheduler): одновременных единиц работы и веса фоновых полос
+    # (live всегда вне очереди)
+    SCHEDULER_SLOTS: int = 4
+    SCHEDULER_WEIGHTS: Dict[str, float] = {"post": 4.0, "gap": 2.0, "backfill": 1.0}
+    SPOOL_PATH: str = "/app/data/spool.ndjson"
 
     UBOT_LOG_LEVEL: str = Field("INFO", alias="LOG_LEVEL")
+    # text | json
+    LOG_FORMAT: str = "text"
+    # Ограничение частоты INFO/DEBUG-записей (записей/сек) для "горячих" логгеров
+    LOG_RATE_LIMITS: Dict[str, float] = {
+        "unified_handler": 5.0,
+        "kafka_producer": 5.0,
+        "backfill_manager": 5.0,
+        "process_messages": 5.0,
+    }
 
     BACKFILL_MAX_DAYS: int = 0
+    # Кол-во параллельных интервалов по дате для бэкфилла нового чата (при BACKFILL_MAX_DAYS > 0)
+    BACKFILL_DATE_SHARDS: int = 4
+    # Куда пишется история: kafka (как раньше) | copy (сразу в Postgres через COPY) | both
+    BACKFILL_SINK: str = "kafka"
+    # Live-нагрузка (сообщений/сек), при которой бэкфилл полностью уступает live-трафику;
+    # при меньшей нагрузке бэкфилл притормаживает пропорционально.
+    BACKFILL_LIVE_RATE_LIMIT: float = 0.5
+
+    # Gap finder: частые проходы только по "грязным" чатам + редкий полный проход
+    GAP_DIRTY_SCAN_INTERVAL: int = 60
+    GAP_FULL_SWEEP_INTERVAL: int = 1800
+    # Проверка дыр через get_messages(ids=[...]): сколько ID проверять за проход на чат
+    GAP_VERIFY_MAX_IDS: int = 2000
 
     KAFKA_CONSUMER_HEARTBEAT_INTERVAL_MS: int = 3000
     KAFKA_CONSUMER_SESSION_TIMEOUT_MS: int = 10000
 
     ENABLE_KAFKA_CONSUMER: bool = True
 
+    # Эндпоинт метрик Prometheus (/metrics)
+    METRICS_ENABLED: bool = True
+    METRICS_HOST: str = "0.0.0.0"
+    METRICS_PORT: int = 9108
+    # Уведомления в Saved Messages каждые 100 сообщений (тратят лимиты Telegram)
+    SAVED_MESSAGES_NOTIFY: bool = True
+
+    # Загрузка медиа (опционально): пул воркеров, фильтры по типу/размеру
+    MEDIA_ENABLED: bool = False
+    MEDIA_DIR: str = "/app/media"
+    MEDIA_WORKERS: int = 2
+    MEDIA_QUEUE_SIZE: int = 1000
+    # незавершённые загрузки, переживающие перезапуск (старейшие вытесняются)
+    MEDIA_PENDING_LIMIT: int = 10000
+    MEDIA_MAX_BYTES: int = 50 * 1024 * 1024
+    MEDIA_TYPES: List[str] = ["photo", "video", "document", "audio", "voice"]
+
+    # Кэш отправителей (LRU + TTL, сохраняется в файл)
+    SENDER_CACHE_SIZE: int = 50000
+    SENDER_CACHE_TTL: float = 86400
+    SENDER_CACHE_PATH: str = "/app/data/sender_cache.json"
+
+    # Подавление повторных отправок (LRU; фильтр Блума — только если задан путь)
+    DEDUP_ENABLED: bool = True
+    DEDUP_MAX_ENTRIES: int = 100000
+    DEDUP_BLOOM_PATH: str = ""
+    DEDUP_BLOOM_CAPACITY: int = 1000000
+
+    # Дельты для edited_message (изменившиеся поля + version) и периодические полные снимки
+    DELTA_EDITS_ENABLED: bool = False
+    DELTA_CACHE_SIZE: int = 100000
+    DELTA_SNAPSHOT_EVERY: int = 10
+    DELTA_SNAPSHOT_INTERVAL: float = 3600
+
+    # Трассировка задержек конвейера (0 — выключено)
+    TRACE_SAMPLE_RATE: float = 0.0
+    TRACE_FILE: str = "/app/logs/traces.jsonl"
+
+    # Профилирование: постоянный монитор задержки event loop + профили по команде из Kafka
+    LOOP_LAG_MONITOR_ENABLED: bool = True
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_LAG_WARN_SECONDS: float = 0.25
+    PROFILE_DIR: str = "/app/logs/profiles"
+    PROFILE_MAX_SECONDS: float = 300
+
     # Новые поля для команды на постинг через Kafka
     PUBLISH_CHANNEL: str = Field(..., env="PUBLISH_CHANNEL")
     ADMIN_USERNAME: str = Field(..., env="ADMIN_USERNAME")
+    # ID администратора для команды "push" (0 — сверять по ADMIN_USERNAME у свежеполученного отправителя)
+    ADMIN_USER_ID: int = 0
+    # Команда "push": top-K сообщений по реакции за окно
+    PUSH_REACTION_EMOTICON: str = "🤡"
+    PUSH_TOP_K: int = 5
+    REACTION_WINDOW_HOURS: float = 24
     kafka_broker: str = Field(default="kafka:9092", alias="KAFKA_BROKER", env="KAFKA_BROKER")
 
     class Config:
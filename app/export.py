@@ -0,0 +1,232 @@
+# tg_ubot/app/export.py
+
+"""
+Массовая выгрузка истории чата, независимо от основного цикла userbot-а.
+
+Пример:
+    python -m app.export --chat @some_channel --since 2024-01-01 --output /app/data/export.ndjson
+    python -m app.export --chat -1001234567890 --since 2024-01-01 --output kafka
+
+Выгрузка работает в своей сессии Telethon (по умолчанию <SESSION_FILE>_export.session,
+при первом запуске нужен вход): общий с live-ботом файл сессии дал бы "database is locked"
+в SQLite и общее состояние апдейтов, поэтому сессии live-бота не принимаются.
+
+Сообщения читаются через iter_messages (по 100 за запрос, темп задаёт wait_time),
+прогресс (последний выгруженный ID) сохраняется в StateManager после каждого чекпоинта,
+поэтому повторный запуск продолжает с места остановки.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import struct
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from telethon import TelegramClient
+
+from app.config import settings
+from app.logger import setup_logging
+from app.kafka.producer import KafkaMessageProducer
+from app.process_messages import serialize_message
+from app.telegram.chat_info import build_chat_info
+from app.telegram.state_manager import StateManager
+
+logger = logging.getLogger("export")
+
+
+class NDJSONFileSink:
+    """
+    Одно JSON-сообщение на строку (дописывается в конец файла).
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, "a", encoding="utf-8")
+
+    async def write(self, data: dict):
+        self.f.write(json.dumps(data, ensure_ascii=False))
+        self.f.write("\n")
+
+    async def flush(self):
+        self.f.flush()
+
+    async def close(self):
+        self.f.close()
+
+
+class BinaryFileSink:
+    """
+    Бинарные кадры: 4 байта длины (big-endian) + JSON в UTF-8.
+    """
+
+    def __init__(self, path: str):
+        self.f = open(path, "ab")
+
+    async def write(self, data: dict):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.f.write(struct.pack(">I", len(payload)))
+        self.f.write(payload)
+
+    async def flush(self):
+        self.f.flush()
+
+    async def close(self):
+        self.f.close()
+
+
+class KafkaSink:
+    """
+    Отправка в Kafka без ожидания каждого подтверждения; flush() дожидается всех
+    и поднимает ошибку доставки, чтобы чекпоинт не ушёл дальше потерянных сообщений.
+    """
+
+    def __init__(self, topic: str):
+        self.topic = topic
+        self.producer = KafkaMessageProducer()
+        self.pending = []
+
+    async def start(self):
+        await self.producer.initialize()
+
+    async def write(self, data: dict):
+        self.pending.append(await self.producer.enqueue(self.topic, data))
+
+    async def flush(self):
+        await self.producer.flush()
+        pending, self.pending = self.pending, []
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        errors = [r for r in results if isinstance(r, BaseException)]
+        if errors:
+            raise RuntimeError(f"{len(errors)} of {len(pending)} messages were not delivered: {errors[0]!r}")
+
+    async def close(self):
+        await self.producer.close()
+
+
+async def export_chat(client, chat, since, sink, state_mgr, checkpoint_every=1000, wait_time=1.0):
+    """
+    Выгружает историю chat (от since, по возрастанию ID) в sink.
+    Возвращает количество выгруженных сообщений.
+    """
+    entity = await client.get_entity(chat)
+    chat_info = build_chat_info(entity)
+    if chat_info is None:
+        raise ValueError(f"Unsupported chat entity: {chat}")
+    chat_id = chat_info.target_id
+
+    last_id = state_mgr.get_export_last_id(chat_id)
+    logger.info(f"[export] Chat {chat_id} ({chat_info.name_uname}): since={since}, resume after id={last_id}")
+
+    count = 0
+    async for m in client.iter_messages(
+        entity,
+        limit=None,
+        reverse=True,
+        min_id=last_id,
+        offset_date=None if last_id else since,
+        wait_time=wait_time
+    ):
+        data = serialize_message(m, "export_message", chat_info)
+        if data:
+            await sink.write(data)
+        last_id = m.id
+        count += 1
+        if count % checkpoint_every == 0:
+            await sink.flush()
+            state_mgr.update_export_last_id(chat_id, last_id)
+            logger.info(f"[export] Chat {chat_id}: {count} messages, checkpoint id={last_id}")
+
+    await sink.flush()
+    if last_id:
+        state_mgr.update_export_last_id(chat_id, last_id)
+    logger.info(f"[export] Chat {chat_id}: done, {count} messages exported, last id={last_id}")
+    return count
+
+
+def _parse_chat(value: str):
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _parse_since(value: str):
+    date = datetime.fromisoformat(value)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=ZoneInfo("Europe/Moscow"))
+    return date
+
+
+def _session_path(name: str) -> str:
+    # Telethon дописывает .session к имени без расширения
+    if not name.endswith(".session"):
+        name += ".session"
+    return os.path.abspath(name)
+
+
+def default_export_session() -> str:
+    base = settings.SESSION_FILE
+    if base.endswith(".session"):
+        base = base[: -len(".session")]
+    return f"{base}_export.session"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.export", description="Bulk export of a chat history.")
+    parser.add_argument("--chat", required=True, type=_parse_chat, help="chat id or @username")
+    parser.add_argument("--since", type=_parse_since, default=None, help="ISO date/datetime (Moscow time if naive)")
+    parser.add_argument("--output", default="kafka", help="'kafka' or a file path")
+    parser.add_argument("--topic", default=settings.UBOT_PRODUCE_TOPIC, help="Kafka topic for --output kafka")
+    parser.add_argument("--format", choices=("ndjson", "binary"), default="ndjson", help="file format")
+    parser.add_argument("--session", default=default_export_session(),
+                        help="Telethon session file (must differ from the live bot's sessions)")
+    parser.add_argument("--state", default="/app/data/export_state.json", help="checkpoint state file")
+    parser.add_argument("--checkpoint-every", type=int, default=1000)
+    parser.add_argument("--wait-time", type=float, default=1.0, help="pause between 100-message requests, s")
+    args = parser.parse_args(argv)
+    live_sessions = {_session_path(name) for name in [settings.SESSION_FILE, *settings.EXTRA_SESSION_FILES]}
+    if _session_path(args.session) in live_sessions:
+        parser.error(f"--session {args.session} is used by the live userbot; pass a separate session file")
+    return args
+
+
+async def run_export(args):
+    setup_logging()
+
+    if args.output == "kafka":
+        sink = KafkaSink(args.topic)
+        await sink.start()
+    elif args.format == "binary":
+        sink = BinaryFileSink(args.output)
+    else:
+        sink = NDJSONFileSink(args.output)
+
+    client = TelegramClient(args.session, settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH)
+    await client.start()
+    try:
+        if not await client.is_user_authorized():
+            logger.error("Telegram client not authorized (session invalid or expired). Exiting.")
+            return
+        state_mgr = StateManager(args.state)
+        await export_chat(
+            client,
+            args.chat,
+            args.since,
+            sink,
+            state_mgr,
+            checkpoint_every=args.checkpoint_every,
+            wait_time=args.wait_time
+        )
+    finally:
+        await sink.close()
+        await client.disconnect()
+
+
+def main(argv=None):
+    asyncio.run(run_export(parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main()
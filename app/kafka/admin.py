@@ -0,0 +1,30 @@
+# tg_ubot/app/kafka/admin.py
+
+import logging
+
+from aiokafka.admin import AIOKafkaAdminClient, NewTopic
+from aiokafka.errors import TopicAlreadyExistsError
+
+from app.config import settings
+
+logger = logging.getLogger("kafka_admin")
+
+
+async def ensure_topics(topics):
+    """
+    Создаёт недостающие топики; topics — [(name, partitions, configs), ...].
+    Уже существующие не трогаются (число партиций и настройки не меняются).
+    """
+    admin = AIOKafkaAdminClient(bootstrap_servers=settings.KAFKA_BROKER)
+    await admin.start()
+    try:
+        for name, partitions, configs in topics:
+            try:
+                await admin.create_topics([
+                    NewTopic(name, num_partitions=partitions, replication_factor=1, topic_configs=configs or {})
+                ])
+                logger.info(f"Created topic {name} (partitions={partitions}, configs={configs})")
+            except TopicAlreadyExistsError:
+                pass
+    finally:
+        await admin.close()
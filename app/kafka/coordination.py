@@ -0,0 +1,217 @@
+# tg_ubot/app/kafka/coordination.py
+
+"""
+Координация нескольких реплик tg_ubot через Kafka.
+
+  - Владение чатами: реплики состоят в одной consumer group на топике
+    назначений (COORD_ASSIGN_TOPIC). Чат принадлежит партиции
+    crc32(chat_id) % число_партиций, реплика владеет чатами назначенных
+    ей партиций. Ребалансировка при появлении/уходе реплик — штатная
+    ребалансировка consumer group.
+  - Чекпойнты: состояние чата (backfill_from_id, missing_ranges, tombstones, ...)
+    публикуется в compacted-топик COORD_STATE_TOPIC с ключом chat_id.
+    Перед отдачей партиций реплика публикует их чекпойнты, новая владелица
+    перечитывает топик и продолжает с того же места.
+"""
+
+import asyncio
+import json
+import logging
+import zlib
+
+from aiokafka import AIOKafkaConsumer, AIOKafkaProducer, ConsumerRebalanceListener, TopicPartition
+from app.config import settings
+from app.kafka.admin import ensure_topics
+
+logger = logging.getLogger("coordination")
+
+
+class _OwnershipListener(ConsumerRebalanceListener):
+    def __init__(self, coordinator):
+        self.coordinator = coordinator
+
+    async def on_partitions_revoked(self, revoked):
+        await self.coordinator.release({tp.partition for tp in revoked})
+
+    async def on_partitions_assigned(self, assigned):
+        await self.coordinator.acquire({tp.partition for tp in assigned})
+
+
+class KafkaCoordinator:
+    def __init__(self, state_mgr, chat_id_to_data, assign_topic=None, state_topic=None,
+                 group_id=None, partitions=None, checkpoint_interval=None):
+        self.state_mgr = state_mgr
+        self.chat_id_to_data = chat_id_to_data
+        self.assign_topic = assign_topic or settings.COORD_ASSIGN_TOPIC
+        self.state_topic = state_topic or settings.COORD_STATE_TOPIC
+        self.group_id = group_id or settings.COORD_GROUP_ID
+        self.partitions = partitions or settings.COORD_PARTITIONS
+        self.checkpoint_interval = checkpoint_interval or settings.COORD_CHECKPOINT_INTERVAL
+
+        self.owned_partitions = set()
+        # назначение партиций получено и не идёт ребалансировка
+        self.settled = asyncio.Event()
+        self.published = {}
+        self.consumer = None
+        self.producer = None
+        self._task = None
+
+    # --- владение ---
+    def partition_for(self, chat_id: int) -> int:
+        return zlib.crc32(str(chat_id).encode("ascii")) % self.partitions
+
+    def owns(self, chat_id: int) -> bool:
+        return self.partition_for(chat_id) in self.owned_partitions
+
+    def chats_in(self, partitions: set) -> list:
+        return [cid for cid in self.chat_id_to_data if self.partition_for(cid) in partitions]
+
+    async def wait_settled(self, timeout: float = None) -> bool:
+        """
+        Ждёт назначения партиций (до первого назначения и во время ребалансировки
+        owns() ещё не отражает владение). False — не дождались за timeout.
+        """
+        timeout = settings.COORD_HOLD_TIMEOUT if timeout is None else timeout
+        if self.settled.is_set():
+            return True
+        try:
+            await asyncio.wait_for(self.settled.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def acquire(self, partitions: set):
+        restored = 0
+        try:
+            checkpoints = await self._read_checkpoints()
+            for chat_id in self.chats_in(partitions):
+                chat_state = checkpoints.get(chat_id)
+                if chat_state is not None:
+                    self.state_mgr.import_chat_state(chat_id, chat_state)
+                    self.published[chat_id] = chat_state
+                    restored += 1
+                # новый владелец сразу проверяет чат на пропуски
+                self.state_mgr.mark_chat_dirty(chat_id)
+        finally:
+            self.owned_partitions |= partitions
+            self.settled.set()
+        logger.info(
+            f"[Coordinator] assigned partitions {sorted(partitions)}: "
+            f"{len(self.chats_in(partitions))} chats, {restored} restored from checkpoints"
+        )
+
+    async def release(self, partitions: set):
+        self.settled.clear()
+        await self.checkpoint(self.chats_in(partitions))
+        self.owned_partitions -= partitions
+        logger.info(f"[Coordinator] revoked partitions {sorted(partitions)}")
+
+    # --- чекпойнты ---
+    async def checkpoint(self, chat_ids=None):
+        """
+        Публикует изменившиеся с прошлого раза состояния чатов (по умолчанию — всех своих).
+        """
+        if self.producer is None:
+            return 0
+        if chat_ids is None:
+            chat_ids = self.chats_in(self.owned_partitions)
+        sent = 0
+        for chat_id in chat_ids:
+            chat_state = self.state_mgr.export_chat_state(chat_id)
+            if not chat_state or self.published.get(chat_id) == chat_state:
+                continue
+            await self.producer.send(self.state_topic, key=str(chat_id).encode("ascii"), value=chat_state)
+            self.published[chat_id] = chat_state
+            sent += 1
+        await self.producer.flush()
+        if sent:
+            logger.debug(f"[Coordinator] published {sent} chat checkpoints")
+        return sent
+
+    async def _read_checkpoints(self) -> dict:
+        """
+        Читает compacted-топик состояний до текущего конца (последнее значение по ключу).
+        """
+        reader = AIOKafkaConsumer(
+            bootstrap_servers=settings.KAFKA_BROKER,
+            enable_auto_commit=False,
+            value_deserializer=lambda m: json.loads(m.decode("utf-8")) if m is not None else None,
+        )
+        await reader.start()
+        checkpoints = {}
+        try:
+            await reader.topics()  # подтягиваем метаданные кластера
+            partitions = reader.partitions_for_topic(self.state_topic) or set()
+            tps = [TopicPartition(self.state_topic, p) for p in partitions]
+            if not tps:
+                return checkpoints
+            reader.assign(tps)
+            await reader.seek_to_beginning(*tps)
+            end_offsets = await reader.end_offsets(tps)
+            pending = {tp for tp in tps if end_offsets[tp] > 0}
+            while pending:
+                batch = await reader.getmany(*pending, timeout_ms=1000)
+                for tp, records in batch.items():
+                    for record in records:
+                        chat_id = int(record.key.decode("ascii"))
+                        if record.value is None:
+                            checkpoints.pop(chat_id, None)
+                        else:
+                            checkpoints[chat_id] = record.value
+                for tp in list(pending):
+                    if await reader.position(tp) >= end_offsets[tp]:
+                        pending.discard(tp)
+        finally:
+            await reader.stop()
+        return checkpoints
+
+    # --- жизненный цикл ---
+    async def start(self):
+        await ensure_topics([
+            (self.assign_topic, self.partitions, None),
+            (self.state_topic, 1, {"cleanup.policy": "compact"}),
+        ])
+        self.producer = AIOKafkaProducer(
+            bootstrap_servers=settings.KAFKA_BROKER,
+            value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        )
+        await self.producer.start()
+        self.consumer = AIOKafkaConsumer(
+            bootstrap_servers=settings.KAFKA_BROKER,
+            group_id=self.group_id,
+            enable_auto_commit=False,
+            heartbeat_interval_ms=settings.KAFKA_CONSUMER_HEARTBEAT_INTERVAL_MS,
+            session_timeout_ms=settings.KAFKA_CONSUMER_SESSION_TIMEOUT_MS,
+        )
+        await self.consumer.start()
+        self.consumer.subscribe([self.assign_topic], listener=_OwnershipListener(self))
+        self._task = asyncio.create_task(self._run(), name="kafka_coordinator")
+        logger.info(f"[Coordinator] joined group {self.group_id} on {self.assign_topic}")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_checkpoint = loop.time() + self.checkpoint_interval
+        try:
+            while True:
+                # getmany поддерживает членство в группе и вызывает rebalance listener
+                await self.consumer.getmany(timeout_ms=1000)
+                if loop.time() >= next_checkpoint:
+                    await self.checkpoint()
+                    next_checkpoint = loop.time() + self.checkpoint_interval
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception(f"[Coordinator] error: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        if self.producer is not None:
+            await self.checkpoint()
+        if self.consumer is not None:
+            await self.consumer.stop()
+        if self.producer is not None:
+            await self.producer.stop()
+        self.owned_partitions = set()
+        logger.info("[Coordinator] stopped.")
@@ -0,0 +1,103 @@
+# tg_ubot/app/kafka/delivery.py
+
+"""
+Доставка live-сообщений в Kafka: обработчики кладут (topic, data, trace)
+в message_buffer, LiveDelivery забирает их по одному и отправляет через
+send (message_callback) в полосе live планировщика.
+
+Строка в БД к этому моменту уже записана, поэтому gap finder сообщение
+не перешлёт: неудачная отправка повторяется (LIVE_PRODUCE_RETRIES,
+экспоненциальная пауза), а после последней попытки сообщение
+дописывается в spool-файл и уходит при следующем старте. Элемент,
+отправка которого прервана остановкой (отмена задачи), тоже спулится.
+"""
+
+import asyncio
+import logging
+
+from app import metrics
+from app.config import settings
+from app.scheduler import scheduler
+from app.shutdown import finish_spool_replay, spool_items
+from app.telegram.dedup import dedup_index
+
+logger = logging.getLogger("live_delivery")
+
+
+class LiveDelivery:
+    def __init__(self, queue, send, retries: int = None, backoff: float = None, spool_path: str = None):
+        self.queue = queue
+        # send(data, trace=None) — корутина отправки (message_callback)
+        self.send = send
+        self.retries = max(1, settings.LIVE_PRODUCE_RETRIES if retries is None else retries)
+        self.backoff = settings.LIVE_PRODUCE_BACKOFF if backoff is None else backoff
+        self.spool_path = spool_path
+
+    async def run(self):
+        while True:
+            item = await self.queue.get()
+            try:
+                await self.deliver(item)
+            except asyncio.CancelledError:
+                self._spool_interrupted(item)
+                raise
+            finally:
+                self.queue.task_done()
+
+    async def replay(self, items):
+        """
+        Повторная отправка заспуленного при прошлой остановке; spool-копия
+        удаляется только когда все элементы доставлены или заспулены заново.
+        """
+        for i, (topic, data) in enumerate(items):
+            try:
+                await self.deliver((topic, data, None))
+            except asyncio.CancelledError:
+                # остаток (и прерванный элемент) останется в .replay-файле до следующего старта
+                logger.warning(f"[LiveDelivery] spool replay interrupted, {len(items) - i} left for next start")
+                raise
+        finish_spool_replay(self.spool_path)
+        logger.info(f"[LiveDelivery] replayed {len(items)} spooled messages")
+
+    def _spool_interrupted(self, item):
+        topic, data, _trace = item
+        try:
+            spool_items([(topic, data)], self.spool_path)
+            logger.warning(
+                f"[LiveDelivery] delivery interrupted, spooled chat_id={data.get('chat_id')} "
+                f"msg_id={data.get('message_id')}"
+            )
+        except OSError as e:
+            logger.exception(f"[LiveDelivery] could not spool interrupted message: {e}")
+
+    async def deliver(self, item) -> bool:
+        topic, data, trace = item
+        for attempt in range(1, self.retries + 1):
+            try:
+                async with scheduler.slot("live"):
+                    await self.send(data, trace=trace)
+                return True
+            except Exception as e:
+                logger.warning(
+                    f"[LiveDelivery] produce failed (attempt {attempt}/{self.retries}) "
+                    f"chat_id={data.get('chat_id')} msg_id={data.get('message_id')}: {e}"
+                )
+            # трасса освобождается отправкой при первой попытке
+            trace = None
+            if attempt < self.retries:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+        # отправка не состоялась: повторы того же сообщения из бэкфилла/gap finder не подавлять
+        dedup_index.forget_id(data.get("chat_id"), data.get("message_id"))
+        self.spool(topic, data)
+        return False
+
+    def spool(self, topic, data):
+        try:
+            spool_items([(topic, data)], self.spool_path)
+            metrics.LIVE_SPOOLED.inc()
+            logger.error(
+                f"[LiveDelivery] spooled undelivered message chat_id={data.get('chat_id')} "
+                f"msg_id={data.get('message_id')}"
+            )
+        except OSError as e:
+            logger.exception(f"[LiveDelivery] could not spool message, it is lost: {e}")
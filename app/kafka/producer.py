@@ -4,13 +4,41 @@ import json
 import logging
 from aiokafka import AIOKafkaProducer
 from aiokafka.errors import KafkaError
+from aiokafka.partitioner import DefaultPartitioner
 from app.config import settings
 
 logger = logging.getLogger("kafka_producer")
 
+_default_partitioner = DefaultPartitioner()
+
+
+def message_key(message: dict):
+    """
+    Ключ сообщения "<chat_id>:<message_id>" (None, если полей нет): правки и повторы
+    одного сообщения получают один ключ, что позволяет компакцию.
+    """
+    chat_id = message.get("chat_id")
+    message_id = message.get("message_id")
+    if chat_id is None or message_id is None:
+        return None
+    return f"{chat_id}:{message_id}".encode("ascii")
+
+
+def chat_partitioner(key, all_partitions, available):
+    """
+    Партиция по chat_id (часть ключа до ':'), murmur2 как в DefaultPartitioner:
+    все сообщения чата попадают в одну партицию и идут по порядку, а внешний
+    продюсер с ключом "<chat_id>" получит ту же партицию.
+    """
+    if key is not None:
+        key = key.split(b":", 1)[0]
+    return _default_partitioner(key, all_partitions, available)
+
 class KafkaMessageProducer:
     """
     Асинхронный KafkaProducer (aiokafka).
+    При KAFKA_KEYED_PRODUCE сообщения с chat_id/message_id отправляются с ключом
+    message_key() и партиционируются по chat_id (chat_partitioner).
     """
 
     def __init__(self):
@@ -20,7 +48,8 @@ class KafkaMessageProducer:
         try:
             self.producer = AIOKafkaProducer(
                 bootstrap_servers=settings.KAFKA_BROKER,
-                value_serializer=lambda v: json.dumps(v).encode('utf-8')
+                value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+                partitioner=chat_partitioner
             )
             await self.producer.start()
             logger.info("AIOKafkaProducer started.")
@@ -28,18 +57,38 @@ class KafkaMessageProducer:
             logger.error(f"Error creating AIOKafkaProducer: {e}")
             raise
 
-    async def send_message(self, topic: str, message: dict):
+    def _key(self, message: dict, key):
+        if key is None and settings.KAFKA_KEYED_PRODUCE:
+            return message_key(message)
+        return key
+
+    async def send_message(self, topic: str, message: dict, headers=None, key=None):
         if not self.producer:
             raise Exception("Kafka producer not initialized.")
         try:
-            await self.producer.send_and_wait(topic, message)
-            name_uname = message.get("name_uname", "Unknown")
-            month_part = message.get("month_part", "N/A")
-            logger.info(f"Sent message to {topic}. name_uname={name_uname}, month_part={month_part}.")
+            await self.producer.send_and_wait(topic, message, key=self._key(message, key), headers=headers)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info(
+                    "Sent message to %s. name_uname=%s, month_part=%s.",
+                    topic, message.get("name_uname", "Unknown"), message.get("month_part", "N/A")
+                )
         except KafkaError as e:
-            logger.error(f"Error sending message: {e}")
+            logger.error("Error sending message: %s", e)
             raise
 
+    async def enqueue(self, topic: str, message: dict, key=None):
+        """
+        Кладёт сообщение в батч продюсера без ожидания подтверждения брокера
+        (для массовой выгрузки; подтверждения — через flush()).
+        """
+        if not self.producer:
+            raise Exception("Kafka producer not initialized.")
+        return await self.producer.send(topic, message, key=self._key(message, key))
+
+    async def flush(self):
+        if self.producer:
+            await self.producer.flush()
+
     async def close(self):
         if self.producer:
             await self.producer.stop()
@@ -1,18 +1,156 @@
 # app/logger.py
 
+import json
 import logging
+import logging.handlers
+import queue
+import threading
+import time
+
 from .config import settings
 
+_listener = None
+
+
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    В отличие от стандартного QueueHandler не форматирует сообщение в потоке
+    вызывающего кода: msg % args вычисляется уже в потоке QueueListener.
+    Лениво — только для неизменяемых аргументов (строки, числа): словари,
+    сообщения Telethon и прочие объекты event loop может изменить раньше,
+    чем до записи дойдёт очередь, поэтому с ними сообщение форматируется сразу.
+    """
+
+    def prepare(self, record):
+        if record.args and not (
+            isinstance(record.msg, str)
+            and isinstance(record.args, tuple)
+            and all(isinstance(arg, _IMMUTABLE_ARGS) for arg in record.args)
+        ):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info and not record.exc_text:
+            # traceback форматируем сразу, пока фреймы ещё актуальны
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Ограничение частоты записей ниже WARNING по категориям (имени логгера):
+    token bucket на rate записей/сек. Сколько записей отброшено, сообщается
+    в поле suppressed следующей пропущенной записи.
+    """
+
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = dict(rates)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        if rate is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last, suppressed = self.buckets.get(record.name, (rate, now, 0))
+            tokens = min(rate, tokens + (now - last) * rate)
+            if tokens < 1:
+                self.buckets[record.name] = (tokens, now, suppressed + 1)
+                return False
+            self.buckets[record.name] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" [+{suppressed} suppressed]"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-запись на строку; поля из extra={...} попадают в запись как есть.
+    """
+
+    _reserved = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in self._reserved:
+                data[key] = value
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
 def setup_logging():
+    """
+    Логи пишутся через очередь (QueueHandler -> QueueListener в отдельном потоке),
+    частые категории сэмплируются (LOG_RATE_LIMITS), формат — LOG_FORMAT (text | json).
+    """
+    global _listener
+
     # Берём поле UBOT_LOG_LEVEL, которое мы только что переименовали
     level_name = settings.UBOT_LOG_LEVEL.upper()
     level = getattr(logging, level_name, logging.INFO)
 
-    logging.basicConfig(
-        level=level,
-        format='%(asctime)s %(levelname)s [%(name)s]: %(message)s',
-        handlers=[logging.StreamHandler()]
-    )
+    stream_handler = logging.StreamHandler()
+    if settings.LOG_FORMAT.lower() == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(TextFormatter('%(asctime)s %(levelname)s [%(name)s]: %(message)s'))
+
+    queue_handler = LazyQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(SamplingFilter(settings.LOG_RATE_LIMITS))
+
+    if _listener is not None:
+        _listener.stop()
+    _listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    logging.basicConfig(level=level, handlers=[queue_handler], force=True)
     logger = logging.getLogger("tg_ubot")
-    logger.info(f"Logging configured for tg_ubot at level={level_name}")
+    logger.info("Logging configured for tg_ubot at level=%s format=%s", level_name, settings.LOG_FORMAT)
     return logger
+
+
+def set_log_level(level_name: str, logger_name: str = None) -> bool:
+    """
+    Меняет уровень логирования на лету (всего приложения или одного логгера).
+    """
+    level = getattr(logging, str(level_name).upper(), None)
+    if not isinstance(level, int):
+        logging.getLogger("tg_ubot").warning("Unknown log level: %s", level_name)
+        return False
+    logging.getLogger(logger_name).setLevel(level)
+    logging.getLogger("tg_ubot").warning("Log level for %s set to %s", logger_name or "root", level_name.upper())
+    return True
+
+
+def stop_logging():
+    """
+    Дописывает оставшиеся в очереди записи (вызывать при завершении).
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
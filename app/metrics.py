@@ -0,0 +1,223 @@
+# tg_ubot/app/metrics.py
+
+"""
+Встроенные метрики в формате Prometheus (text exposition 0.0.4) и
+HTTP-эндпоинт /metrics, работающий в том же asyncio-цикле, что и userbot.
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("metrics")
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in pairs
+    )
+    return "{" + body + "}"
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+
+    def collect(self) -> list:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.collect())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def collect(self):
+        return [f"{self.name}{_format_labels(k)} {v}" for k, v in self.values.items()]
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def __init__(self, name, documentation):
+        super().__init__(name, documentation)
+        self.values = {}
+        self.functions = {}
+
+    def set(self, value: float, **labels):
+        self.values[_label_key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """
+        Значение вычисляется при каждом scrape (например, размер очереди).
+        """
+        self.functions[_label_key(labels)] = fn
+
+    def collect(self):
+        lines = [f"{self.name}{_format_labels(k)} {v}" for k, v in self.values.items()]
+        for k, fn in self.functions.items():
+            try:
+                lines.append(f"{self.name}{_format_labels(k)} {fn()}")
+            except Exception as e:
+                logger.debug(f"Gauge {self.name} callback failed: {e}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        lines = []
+        for key, (counts, total, n) in self.series.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f"{self.name}_bucket{_format_labels(key, (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, (('le', '+Inf'),))} {n}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self) -> str:
+        return "\n".join(m.expose() for m in self.metrics) + "\n"
+
+
+registry = Registry()
+
+MESSAGES_TOTAL = registry.register(Counter(
+    "tg_ubot_messages_total", "Serialized messages by event_type."))
+SERIALIZE_SECONDS = registry.register(Histogram(
+    "tg_ubot_serialize_seconds", "serialize_message latency."))
+KAFKA_PRODUCE_SECONDS = registry.register(Histogram(
+    "tg_ubot_kafka_produce_seconds", "Kafka produce latency (until broker ack)."))
+KAFKA_PRODUCE_ERRORS = registry.register(Counter(
+    "tg_ubot_kafka_produce_errors_total", "Failed Kafka produce calls."))
+DB_UPSERT_SECONDS = registry.register(Histogram(
+    "tg_ubot_db_upsert_seconds", "DB upsert latency."))
+QUEUE_DEPTH = registry.register(Gauge(
+    "tg_ubot_queue_depth", "Items waiting in in-process queues."))
+BACKFILL_FROM_ID = registry.register(Gauge(
+    "tg_ubot_backfill_from_id", "Current backfill offset per chat (1 = done)."))
+FLOOD_WAIT_SECONDS = registry.register(Counter(
+    "tg_ubot_flood_wait_seconds_total", "Seconds requested by Telegram FloodWait errors."))
+GAP_MISSING_MESSAGES = registry.register(Gauge(
+    "tg_ubot_gap_missing_messages", "Missing message IDs found by LocalGapsManager per chat."))
+GAP_TOMBSTONED_IDS = registry.register(Counter(
+    "tg_ubot_gap_tombstoned_ids_total", "Gap IDs confirmed absent in Telegram."))
+DEDUP_SUPPRESSED = registry.register(Counter(
+    "tg_ubot_dedup_suppressed_total", "Re-emits suppressed by the dedup index, by event_type."))
+MEDIA_DOWNLOADS = registry.register(Counter(
+    "tg_ubot_media_downloads_total", "Media downloads by status."))
+MEDIA_BYTES = registry.register(Counter(
+    "tg_ubot_media_bytes_total", "Downloaded media bytes."))
+EVENT_LOOP_LAG_SECONDS = registry.register(Gauge(
+    "tg_ubot_event_loop_lag_seconds", "Last measured asyncio event loop lag."))
+DB_COPY_ROWS = registry.register(Counter(
+    "tg_ubot_db_copy_rows_total", "Rows written by the COPY backfill sink, by table."))
+DB_COPY_SECONDS = registry.register(Histogram(
+    "tg_ubot_db_copy_seconds", "COPY backfill sink latency per page."))
+SCHEDULER_WAIT_SECONDS = registry.register(Histogram(
+    "tg_ubot_scheduler_wait_seconds", "Time spent waiting for a scheduler slot, by lane."))
+LIVE_SPOOLED = registry.register(Counter(
+    "tg_ubot_live_spooled_total", "Live messages spooled after exhausting produce retries."))
+
+
+async def _handle_http(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, просто дочитываем их
+        while True:
+            line = await reader.readline()
+            if not line or line in (b"\r\n", b"\n"):
+                break
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = registry.expose().encode("utf-8")
+            status = "200 OK"
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body = b"not found\n"
+            status = "404 Not Found"
+            content_type = "text/plain"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.debug(f"metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host: str, port: int):
+    server = await asyncio.start_server(_handle_http, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
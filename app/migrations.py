@@ -0,0 +1,163 @@
+# tg_ubot/app/migrations.py
+
+"""
+Типизированные столбцы идентификаторов в таблицах messages_*.
+
+К родительской (партиционированной) таблице добавляются generated-столбцы
+    tg_chat_id    = (data->>'chat_id')::bigint
+    tg_message_id = (data->>'message_id')::bigint
+и btree-индекс (tg_chat_id, tg_message_id). Столбцы вычисляет Postgres,
+поэтому они заполнены для любых писателей (live-обработчик, COPY-синк,
+downstream-консьюмеры Kafka), а выборка ID чата для gap finder становится
+index-only scan вместо разбора JSONB по всей таблице.
+
+Новые (пустые) таблицы получают столбцы сразу — в точках вызова
+ensure_partitioned_parent_table. Существующие таблицы с данными мигрируются
+отдельно (ADD COLUMN ... STORED переписывает таблицу под эксклюзивной блокировкой):
+
+    python -m app.migrations              # все messages_* в TG_UBOT_SCHEMA
+    python -m app.migrations --table messages_some_channel --dry-run
+"""
+
+import argparse
+import logging
+import os
+
+from psycopg2 import sql
+
+from mirco_services_data_management.db import get_connection
+
+logger = logging.getLogger("migrations")
+
+TYPED_COLUMNS = {
+    "tg_chat_id": "(data->>'chat_id')::bigint",
+    "tg_message_id": "(data->>'message_id')::bigint",
+}
+
+# Таблицы, уже проверенные в этом процессе: table -> есть ли типизированные столбцы
+_checked = {}
+
+
+def _schema() -> str:
+    return os.getenv("TG_UBOT_SCHEMA", "public")
+
+
+def _existing_columns(cur, schema: str, table_name: str) -> set:
+    cur.execute(
+        """
+        SELECT a.attname
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = %s AND c.relname = %s AND a.attnum > 0 AND NOT a.attisdropped
+        """,
+        (schema, table_name),
+    )
+    return {row[0] for row in cur.fetchall()}
+
+
+def migration_sql(schema: str, table_name: str, existing: set) -> list:
+    table = sql.Identifier(schema, table_name)
+    statements = [
+        sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} bigint GENERATED ALWAYS AS ({}) STORED").format(
+            table, sql.Identifier(name), sql.SQL(expr)
+        )
+        for name, expr in TYPED_COLUMNS.items()
+        if name not in existing
+    ]
+    statements.append(
+        sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (tg_chat_id, tg_message_id)").format(
+            sql.Identifier(f"{table_name}_tg_ids_idx"), table
+        )
+    )
+    return statements
+
+
+def ensure_typed_columns(table_name: str, migrate_existing: bool = False, dry_run: bool = False) -> bool:
+    """
+    Добавляет типизированные столбцы и индекс. Без migrate_existing непустая
+    таблица не переписывается (только предупреждение). Возвращает, есть ли столбцы.
+    """
+    if table_name in _checked and not migrate_existing:
+        return _checked[table_name]
+
+    schema = _schema()
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            existing = _existing_columns(cur, schema, table_name)
+            if not existing:
+                logger.warning(f"[Migrations] table {schema}.{table_name} not found")
+                return False
+            if all(name in existing for name in TYPED_COLUMNS) and not migrate_existing:
+                _checked[table_name] = True
+                return True
+            if not migrate_existing:
+                cur.execute(
+                    sql.SQL("SELECT EXISTS (SELECT 1 FROM {} LIMIT 1)").format(sql.Identifier(schema, table_name))
+                )
+                if cur.fetchone()[0]:
+                    logger.warning(
+                        f"[Migrations] {schema}.{table_name} has rows but no typed id columns; "
+                        f"run `python -m app.migrations --table {table_name}`"
+                    )
+                    _checked[table_name] = False
+                    return False
+            for statement in migration_sql(schema, table_name, existing):
+                if dry_run:
+                    print(statement.as_string(conn) + ";")
+                else:
+                    logger.info(f"[Migrations] {statement.as_string(conn)}")
+                    cur.execute(statement)
+        if not dry_run:
+            conn.commit()
+            _checked[table_name] = True
+        return not dry_run
+    except Exception as e:
+        conn.rollback()
+        logger.exception(f"[Migrations] failed for {schema}.{table_name}: {e}")
+        _checked[table_name] = False
+        return False
+    finally:
+        conn.close()
+
+
+def list_message_tables(schema: str = None) -> list:
+    """
+    Родительские таблицы messages_* (без партиций).
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT c.relname
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = %s
+                  AND c.relkind IN ('r', 'p')
+                  AND NOT c.relispartition
+                  AND c.relname LIKE 'messages_%%'
+                ORDER BY c.relname
+                """,
+                (schema or _schema(),),
+            )
+            return [row[0] for row in cur.fetchall()]
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.migrations", description="Add typed id columns to messages_* tables.")
+    parser.add_argument("--table", action="append", help="table name (default: all messages_* tables)")
+    parser.add_argument("--dry-run", action="store_true", help="print SQL instead of executing it")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+
+    tables = args.table or list_message_tables()
+    done = sum(ensure_typed_columns(t, migrate_existing=True, dry_run=args.dry_run) for t in tables)
+    logger.info(f"[Migrations] {done}/{len(tables)} tables have typed id columns")
+
+
+if __name__ == "__main__":
+    main()
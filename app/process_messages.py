@@ -5,10 +5,16 @@
 """
 
 import logging
+import time
 from datetime import datetime
 from telethon.tl.types import Message, MessageEntityUrl, MessageEntityTextUrl, MessageReactions
 from zoneinfo import ZoneInfo
 
+from app import metrics
+from app.telegram.media import describe_media
+from app.telegram.entity_cache import sender_cache
+from app.telegram.chat_info import ChatInfo
+
 logger = logging.getLogger("process_messages")
 
 def build_markdown_and_links(raw_text: str, entities: list):
@@ -74,22 +80,16 @@ def parse_reactions(msg: Message) -> dict:
     }
 
 
-def serialize_message(msg: Message, event_type: str, chat_info: dict) -> dict:
+def serialize_message(msg: Message, event_type: str, chat_info: ChatInfo) -> dict:
     """
     Serializes Telethon Message -> dict with date in Moscow time, includes reaction data.
     """
+    started = time.perf_counter()
     try:
         moscow_tz = ZoneInfo("Europe/Moscow")
         date_moscow = msg.date.astimezone(moscow_tz)
 
-        sender_info = {}
-        if msg.sender:
-            sender_info = {
-                "sender_id": getattr(msg.sender, "id", None),
-                "sender_username": getattr(msg.sender, "username", ""),
-                "sender_first_name": getattr(msg.sender, "first_name", ""),
-                "sender_last_name": getattr(msg.sender, "last_name", ""),
-            }
+        sender_info = sender_cache.sender_info(msg)
 
         raw_text = msg.raw_text or ""
         text_markdown, links = build_markdown_and_links(raw_text, msg.entities or [])
@@ -107,13 +107,16 @@ def serialize_message(msg: Message, event_type: str, chat_info: dict) -> dict:
             "links": links,
             "sender": sender_info,
             "chat_id": msg.chat_id,
-            "chat_title": chat_info.get("chat_title", ""),
-            "target_id": chat_info.get("target_id", ""),
-            "name_uname": chat_info.get("name_uname", "Unknown"),
+            "chat_title": chat_info.chat_title,
+            "target_id": chat_info.target_id,
+            "name_uname": chat_info.name_uname,
             "month_part": date_moscow.strftime("%Y-%m"),
             "reactions": reaction_data,  # total_reactions + per-emoticon counts
+            "media": describe_media(msg),  # type/mime/size + path, if media download is enabled
         }
+        metrics.SERIALIZE_SECONDS.observe(time.perf_counter() - started, event_type=event_type)
+        metrics.MESSAGES_TOTAL.inc(event_type=event_type)
         return data
     except Exception as e:
-        logger.exception(f"[serialize_message] Error: {e}")
+        logger.exception("[serialize_message] Error for msg_id=%s: %s", getattr(msg, "id", None), e)
         return {}
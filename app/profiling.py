@@ -0,0 +1,209 @@
+# tg_ubot/app/profiling.py
+
+"""
+Профилирование "на лету", без подключения внешних профайлеров к контейнеру:
+  - LoopLagMonitor: постоянный дешёвый замер задержки event loop; если цикл
+    заблокирован дольше порога, сторожевой поток логирует стек и имя задачи,
+    которая его держит;
+  - Profiler: по команде из Kafka снимает cProfile или сэмплирующий профиль
+    на N секунд, дамп asyncio-задач и задержку цикла и кладёт артефакты в PROFILE_DIR.
+"""
+
+import asyncio
+import collections
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+
+from app import metrics
+from app.config import settings
+from app.utils import ensure_dir
+
+logger = logging.getLogger("profiling")
+
+
+def _describe_task(task) -> str:
+    if task is None:
+        return "<no task>"
+    coro = task.get_coro()
+    return f"{task.get_name()} ({getattr(coro, '__qualname__', coro)})"
+
+
+class LoopLagMonitor:
+    """
+    Каждые interval сек. замеряет, насколько позже запланированного проснулся цикл.
+    Сторожевой поток замечает блокировку, пока она ещё идёт, и логирует
+    стек потока цикла + текущую asyncio-задачу (т.е. виновный обработчик).
+    """
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.25, history: int = 1200):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.samples = collections.deque(maxlen=history)
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat = time.monotonic()
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run(), name="loop_lag_monitor")
+        self._watchdog = threading.Thread(target=self._watch, name="loop_lag_watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        try:
+            while True:
+                expected = time.monotonic() + self.interval
+                self._heartbeat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, time.monotonic() - expected)
+                self.samples.append((time.time(), lag))
+                metrics.EVENT_LOOP_LAG_SECONDS.set(lag)
+                if lag >= self.warn_threshold:
+                    logger.warning(f"[LoopLagMonitor] event loop lag {lag * 1000:.0f} ms")
+        except asyncio.CancelledError:
+            pass
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.warn_threshold):
+            stalled = time.monotonic() - self._heartbeat - self.interval
+            if stalled < self.warn_threshold:
+                reported = None
+                continue
+            if reported == self._heartbeat:
+                continue
+            reported = self._heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            task = asyncio.current_task(self._loop)
+            stack = "".join(traceback.format_stack(frame, limit=8)) if frame else "<no frame>"
+            logger.warning(
+                f"[LoopLagMonitor] event loop blocked for {stalled * 1000:.0f}+ ms "
+                f"in task {_describe_task(task)}:\n{stack}"
+            )
+
+    def lag_stats(self, since: float = 0.0) -> dict:
+        lags = [lag for ts, lag in self.samples if ts >= since]
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "max_ms": round(max(lags) * 1000, 3),
+            "avg_ms": round(sum(lags) / len(lags) * 1000, 3),
+        }
+
+
+class Profiler:
+    """
+    Одна сессия профилирования за раз. Режимы: "cprofile" и "sampling".
+    """
+
+    def __init__(self, out_dir: str, lag_monitor: LoopLagMonitor = None, max_seconds: float = 300):
+        self.out_dir = out_dir
+        self.lag_monitor = lag_monitor
+        self.max_seconds = max_seconds
+        self._task = None
+
+    def request(self, seconds: float = 30, mode: str = "cprofile") -> bool:
+        """
+        Запускает профилирование в фоне. False, если сессия уже идёт или режим неизвестен.
+        """
+        if self._task and not self._task.done():
+            logger.warning("[Profiler] profiling already in progress, request ignored.")
+            return False
+        if mode not in ("cprofile", "sampling"):
+            logger.warning(f"[Profiler] unknown mode: {mode}")
+            return False
+        seconds = max(1.0, min(float(seconds), self.max_seconds))
+        self._task = asyncio.create_task(self.capture(seconds, mode), name="profiler_capture")
+        return True
+
+    async def capture(self, seconds: float, mode: str) -> str:
+        ensure_dir(self.out_dir)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        prefix = os.path.join(self.out_dir, f"{stamp}-{mode}")
+        started = time.time()
+        logger.info(f"[Profiler] {mode} profile for {seconds:.0f}s => {prefix}.*")
+
+        self._dump_tasks(prefix + "-tasks-start.txt")
+        if mode == "cprofile":
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            profile.dump_stats(prefix + ".prof")
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(60)
+            with open(prefix + ".txt", "w", encoding="utf-8") as f:
+                f.write(out.getvalue())
+        else:
+            stacks = await asyncio.to_thread(self._sample_stacks, threading.get_ident(), seconds)
+            with open(prefix + ".folded", "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        self._dump_tasks(prefix + "-tasks-end.txt")
+
+        summary = {"mode": mode, "seconds": seconds, "started_at": started}
+        if self.lag_monitor is not None:
+            summary["loop_lag"] = self.lag_monitor.lag_stats(since=started)
+        with open(prefix + "-summary.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(f"[Profiler] profile written: {prefix}.*")
+        return prefix
+
+    @staticmethod
+    def _sample_stacks(thread_id: int, seconds: float, period: float = 0.01) -> collections.Counter:
+        """
+        Сэмплирует стек потока event loop; результат — "свёрнутые" стеки (формат flamegraph).
+        """
+        stacks = collections.Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if names:
+                stacks[";".join(reversed(names))] += 1
+            time.sleep(period)
+        return stacks
+
+    @staticmethod
+    def _dump_tasks(path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for task in asyncio.all_tasks():
+                f.write(f"=== {_describe_task(task)} done={task.done()}\n")
+                task.print_stack(limit=10, file=f)
+                f.write("\n")
+
+
+lag_monitor = LoopLagMonitor(settings.LOOP_LAG_INTERVAL, settings.LOOP_LAG_WARN_SECONDS)
+profiler = Profiler(settings.PROFILE_DIR, lag_monitor, settings.PROFILE_MAX_SECONDS)
+
+
+def handle_profile_command(data: dict) -> bool:
+    """
+    Команда {"seconds": N, "mode": "cprofile" | "sampling"} из Kafka.
+    """
+    return profiler.request(data.get("seconds", 30), data.get("mode", "cprofile"))
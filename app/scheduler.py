@@ -0,0 +1,103 @@
+# tg_ubot/app/scheduler.py
+
+"""
+Общий планировщик работы с клиентом Telegram / продюсером / БД по полосам:
+
+  - live     — обработка новых/отредактированных сообщений (строгий приоритет);
+  - post     — исходящие публикации (push, команды post_message);
+  - gap      — проверка и заполнение пропусков, догон после рестарта;
+  - backfill — история.
+
+Единица работы — одна страница бэкфилла / один RPC / одно сообщение:
+слот берётся на неё и отдаётся сразу после, поэтому live-нагрузка
+вытесняет фоновые полосы на ближайшей границе страницы. Между
+нелайвовыми полосами слоты делятся по весам (SCHEDULER_WEIGHTS)
+по схеме взвешенной справедливой очереди (виртуальное время полосы).
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections import defaultdict, deque
+
+from app import metrics
+from app.config import settings
+
+logger = logging.getLogger("scheduler")
+
+LIVE = "live"
+
+
+class PriorityScheduler:
+    def __init__(self, slots: int = None, weights: dict = None):
+        self.slots = slots or settings.SCHEDULER_SLOTS
+        self.weights = dict(settings.SCHEDULER_WEIGHTS if weights is None else weights)
+        self.busy = 0
+        self.waiters = defaultdict(deque)
+        self.vtime = defaultdict(float)
+        self.clock = 0.0
+
+    @contextlib.asynccontextmanager
+    async def slot(self, lane: str):
+        await self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def waiting(self, lane: str = None) -> int:
+        if lane is not None:
+            return len(self.waiters[lane])
+        return sum(len(q) for q in self.waiters.values())
+
+    async def acquire(self, lane: str):
+        started = time.perf_counter()
+        if self.busy < self.slots and not self.waiting():
+            self._grant(lane)
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self.waiters[lane].append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # слот уже выдан, но задача отменена — возвращаем его
+                    self.release()
+                elif fut in self.waiters[lane]:
+                    # release() мог уже вынуть отменённый future из очереди
+                    self.waiters[lane].remove(fut)
+                raise
+        metrics.SCHEDULER_WAIT_SECONDS.observe(time.perf_counter() - started, lane=lane)
+
+    def release(self):
+        self.busy -= 1
+        while self.busy < self.slots:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            fut = self.waiters[lane].popleft()
+            if fut.cancelled():
+                continue
+            self._grant(lane)
+            fut.set_result(None)
+
+    def _next_lane(self):
+        if self.waiters[LIVE]:
+            return LIVE
+        backlogged = [lane for lane, queue in self.waiters.items() if queue]
+        if not backlogged:
+            return None
+        return min(backlogged, key=lambda lane: self.vtime[lane])
+
+    def _grant(self, lane: str):
+        self.busy += 1
+        if lane == LIVE:
+            return
+        # полоса, простаивавшая какое-то время, не копит "кредит": стартует от текущих часов
+        start = max(self.vtime[lane], self.clock)
+        self.clock = start
+        self.vtime[lane] = start + 1.0 / self.weights.get(lane, 1.0)
+
+
+scheduler = PriorityScheduler()
@@ -0,0 +1,159 @@
+# tg_ubot/app/shutdown.py
+
+"""
+Упорядоченная остановка сервиса: стадии выполняются по очереди в пределах
+общего дедлайна (SHUTDOWN_DEADLINE). Стадия, не уложившаяся в остаток
+дедлайна, прерывается, но следующие стадии всё равно выполняются —
+чекпойнт состояния и отключение важнее, чем полный дренаж.
+
+Сообщения, которые не успели уйти в Kafka, сохраняются в spool-файл
+(NDJSON: {"topic", "data"}) и отправляются при следующем старте.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+
+from app.config import settings
+
+logger = logging.getLogger("shutdown")
+
+
+class ShutdownOrchestrator:
+    def __init__(self, deadline: float = None):
+        self.deadline = settings.SHUTDOWN_DEADLINE if deadline is None else deadline
+        self.stages = []
+        self.report = {}
+        self._ends_at = None
+
+    def add_stage(self, name: str, func):
+        """
+        func — корутинная функция без аргументов; её результат (если есть) попадает в отчёт.
+        """
+        self.stages.append((name, func))
+
+    def remaining(self) -> float:
+        """
+        Сколько секунд осталось до дедлайна (для стадий, которые сами ждут задачи).
+        """
+        if self._ends_at is None:
+            return self.deadline
+        return max(self._ends_at - asyncio.get_running_loop().time(), 0.0)
+
+    async def run(self) -> dict:
+        self._ends_at = asyncio.get_running_loop().time() + self.deadline
+        for name, func in self.stages:
+            started = time.perf_counter()
+            # последние стадии (чекпойнт, отключение) получают минимум секунду даже после дедлайна
+            timeout = max(self.remaining(), 1.0)
+            try:
+                result = await asyncio.wait_for(func(), timeout)
+                status = "ok"
+            except asyncio.TimeoutError:
+                result, status = None, "timeout"
+            except Exception as e:
+                logger.exception(f"[Shutdown] stage {name} failed: {e}")
+                result, status = None, "error"
+            self.report[name] = {"status": status, "seconds": round(time.perf_counter() - started, 3)}
+            if result:
+                self.report[name]["result"] = result
+            logger.info(f"[Shutdown] stage {name}: {status} in {self.report[name]['seconds']}s {result or ''}")
+        logger.info(f"[Shutdown] report: {json.dumps(self.report, ensure_ascii=False)}")
+        return self.report
+
+
+async def drain_queue(queue: asyncio.Queue) -> dict:
+    """
+    Ждёт, пока потребитель очереди (LiveDelivery) обработает всё, что в ней лежит.
+    """
+    pending = queue.qsize()
+    await queue.join()
+    return {"drained": pending}
+
+
+def spool_items(items, path: str = None) -> int:
+    """
+    Дописывает [(topic, data), ...] в spool-файл.
+    """
+    path = settings.SPOOL_PATH if path is None else path
+    if not path or not items:
+        return 0
+    with open(path, "a", encoding="utf-8") as f:
+        for topic, data in items:
+            f.write(json.dumps({"topic": topic, "data": data}, ensure_ascii=False) + "\n")
+    return len(items)
+
+
+def spool_queue(queue: asyncio.Queue, path: str = None) -> int:
+    """
+    Сохраняет необработанные элементы (topic, data, trace) очереди в spool-файл.
+    """
+    items = []
+    while not queue.empty():
+        topic, data, _trace = queue.get_nowait()
+        items.append((topic, data))
+        queue.task_done()
+    spooled = spool_items(items, path)
+    if spooled:
+        logger.warning(f"[Shutdown] spooled {spooled} undelivered messages to {path or settings.SPOOL_PATH}")
+    return spooled
+
+
+def load_spool(path: str = None) -> list:
+    """
+    Читает spool-файл, возвращает [(topic, data), ...]. Файл переносится в
+    <path>.replay и удаляется finish_spool_replay() только после доставки
+    прочитанного: при падении во время повтора сообщения прочитаются снова.
+    """
+    path = settings.SPOOL_PATH if path is None else path
+    if not path:
+        return []
+    replay = path + ".replay"
+    if os.path.exists(path):
+        # к недоставленному с прошлого повтора (если он прервался) дописываем новое
+        with open(path, "r", encoding="utf-8") as src, open(replay, "a", encoding="utf-8") as dst:
+            dst.write(src.read())
+        os.remove(path)
+    if not os.path.exists(replay):
+        return []
+    items = []
+    with open(replay, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+                items.append((item["topic"], item["data"]))
+            except (ValueError, KeyError) as e:
+                logger.error(f"[Shutdown] bad spool line skipped: {e}")
+    logger.info(f"[Shutdown] loaded {len(items)} spooled messages from {replay}")
+    return items
+
+
+def finish_spool_replay(path: str = None):
+    """
+    Удаляет <path>.replay после того, как его сообщения доставлены (или заново заспулены).
+    """
+    path = settings.SPOOL_PATH if path is None else path
+    if path and os.path.exists(path + ".replay"):
+        os.remove(path + ".replay")
+
+
+async def wait_tasks(tasks, timeout: float) -> dict:
+    """
+    Даёт задачам завершиться самим за timeout сек., остальные отменяет.
+    """
+    tasks = [t for t in tasks if t is not None]
+    if not tasks:
+        return {"finished": [], "cancelled": []}
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    return {
+        "finished": sorted(t.get_name() for t in done),
+        "cancelled": sorted(t.get_name() for t in pending),
+    }
@@ -0,0 +1,44 @@
+# tg_ubot/app/startup.py
+
+"""
+Замер фаз старта сервиса: независимые шаги запускаются параллельно
+(gather), каждый замеряется отдельно, в конце в лог пишется разбивка
+по фазам и общее время до готовности.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+
+logger = logging.getLogger("startup")
+
+
+class StartupSequencer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    async def run(self, name: str, aw):
+        with self.phase(name):
+            return await aw
+
+    async def gather(self, *steps):
+        """
+        steps — пары (имя, awaitable); выполняются параллельно, результаты — в порядке шагов.
+        """
+        return await asyncio.gather(*(self.run(name, aw) for name, aw in steps))
+
+    def report(self) -> dict:
+        total = time.perf_counter() - self.started
+        breakdown = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in self.timings.items())
+        logger.info(f"[Startup] ready in {total:.2f}s: {breakdown}")
+        return {"total": round(total, 3), **{k: round(v, 3) for k, v in self.timings.items()}}
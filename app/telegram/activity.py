@@ -0,0 +1,78 @@
+# tg_ubot/app/telegram/activity.py
+
+"""
+Учёт активности (входящих live-сообщений) с ограниченной памятью.
+"""
+
+import math
+import time
+
+
+class RateCounter:
+    """
+    Скользящее окно на кольцевом буфере корзин фиксированного размера:
+    record() — O(1), count()/rate() — O(buckets), память не растёт с нагрузкой.
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60, clock=time.monotonic):
+        self.window = window
+        self.buckets = buckets
+        self.width = window / buckets
+        self.clock = clock
+        self.counts = [0] * buckets
+        self.stamps = [-1] * buckets
+
+    def record(self, n: int = 1):
+        idx = int(self.clock() / self.width)
+        slot = idx % self.buckets
+        if self.stamps[slot] != idx:
+            self.stamps[slot] = idx
+            self.counts[slot] = 0
+        self.counts[slot] += n
+
+    def count(self, interval: float = None) -> int:
+        """
+        Кол-во событий за последние interval сек. (с точностью до ширины корзины).
+        """
+        interval = self.window if interval is None else min(interval, self.window)
+        idx = int(self.clock() / self.width)
+        oldest = idx - max(1, math.ceil(interval / self.width)) + 1
+        return sum(c for c, s in zip(self.counts, self.stamps) if s >= oldest)
+
+    def rate(self, interval: float = None) -> float:
+        """
+        Событий в секунду за последние interval сек.
+        """
+        interval = self.window if interval is None else min(interval, self.window)
+        return self.count(interval) / interval if interval > 0 else 0.0
+
+
+class ActivityTracker:
+    """
+    Глобальный и по-чатовый счётчики live-сообщений.
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60, chat_buckets: int = 12):
+        self.window = window
+        self.chat_buckets = chat_buckets
+        self.total = RateCounter(window, buckets)
+        self.per_chat = {}
+
+    def record(self, chat_id: int = None):
+        self.total.record()
+        if chat_id is None:
+            return
+        counter = self.per_chat.get(chat_id)
+        if counter is None:
+            counter = self.per_chat[chat_id] = RateCounter(self.window, self.chat_buckets)
+        counter.record()
+
+    def count(self, interval: float = None) -> int:
+        return self.total.count(interval)
+
+    def rate(self, interval: float = None) -> float:
+        return self.total.rate(interval)
+
+    def chat_rate(self, chat_id: int, interval: float = None) -> float:
+        counter = self.per_chat.get(chat_id)
+        return counter.rate(interval) if counter else 0.0
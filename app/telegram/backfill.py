@@ -1,11 +1,20 @@
 import asyncio
 import logging
+import time
 from datetime import timedelta
 from telethon import errors
 
-from app.utils import human_like_delay, get_delay_settings, get_current_time_moscow
+from app.utils import human_like_delay, get_delay_settings, get_current_time_moscow, message_table_name
+from app.bulk_ingest import copy_sink
 from app.process_messages import serialize_message
 from app.config import settings
+from app import metrics
+from app.tracing import tracer, span
+from app.scheduler import scheduler
+from app.telegram.dedup import dedup_index
+from app.telegram.media import media_downloader
+from app.telegram.entity_cache import sender_cache
+from app.telegram.chat_info import UNKNOWN_CHAT
 
 logger = logging.getLogger("backfill_manager")
 
@@ -21,7 +30,9 @@ class BackfillManager:
         state_mgr,
         message_callback,
         chat_id_to_data,
-        new_msgs_threshold=0,
+        chat_filter=None,
+        on_flood_wait=None,
+        live_rate_limit=None,
         idle_timeout=10,
         batch_size=50,
         flood_wait_delay=60,
@@ -31,8 +42,11 @@ class BackfillManager:
         self.state_mgr = state_mgr
         self.message_callback = message_callback
         self.chat_id_to_data = chat_id_to_data
+        # multi-session: какие чаты обслуживает этот менеджер и куда сообщать о FloodWait
+        self.chat_filter = chat_filter
+        self.on_flood_wait = on_flood_wait
 
-        self.new_msgs_threshold = new_msgs_threshold
+        self.live_rate_limit = settings.BACKFILL_LIVE_RATE_LIMIT if live_rate_limit is None else live_rate_limit
         self.idle_timeout = idle_timeout
         self.batch_size = batch_size
         self.flood_wait_delay = flood_wait_delay
@@ -40,23 +54,202 @@ class BackfillManager:
 
         self._stop_event = asyncio.Event()
 
+        # Граница по дате (BACKFILL_MAX_DAYS) вычисляется один раз за проход;
+        # для каждого чата она переводится в min_id (ID последнего сообщения старше cutoff).
+        self._cutoff_date = None
+        self._cutoff_ids = {}
+
     def stop(self):
         self._stop_event.set()
 
+    def _live_load(self, chat_id: int = None) -> float:
+        """
+        Доля live-нагрузки относительно live_rate_limit (>= 1 — бэкфилл должен уступить).
+        """
+        if self.live_rate_limit <= 0:
+            return 0.0
+        return self.state_mgr.get_live_rate(self.idle_timeout, chat_id) / self.live_rate_limit
+
+    async def _pace_for_live(self):
+        """
+        Пауза между страницами, пропорциональная текущей live-нагрузке.
+        """
+        load = self._live_load()
+        if load > 0:
+            await asyncio.sleep(min(load, 1.0) * self.idle_timeout)
+
+    def _start_pass(self):
+        if settings.BACKFILL_MAX_DAYS > 0:
+            self._cutoff_date = get_current_time_moscow() - timedelta(days=settings.BACKFILL_MAX_DAYS)
+        else:
+            self._cutoff_date = None
+        self._cutoff_ids = {}
+
+    async def _get_id_before_date(self, chat_id: int, date) -> int:
+        """
+        ID самого нового сообщения, отправленного раньше date (0, если таких нет).
+        """
+        async with scheduler.slot("backfill"):
+            msgs = await self.client.get_messages(entity=chat_id, limit=1, offset_date=date)
+        return msgs[0].id if msgs else 0
+
+    async def _get_cutoff_min_id(self, chat_id: int) -> int:
+        """
+        min_id для запросов истории: всё, что <= него, старше cutoff и Telegram не отдаёт.
+        """
+        if self._cutoff_date is None:
+            return 0
+        if chat_id not in self._cutoff_ids:
+            self._cutoff_ids[chat_id] = await self._get_id_before_date(chat_id, self._cutoff_date)
+            logger.debug(f"[Backfill] Chat {chat_id}: cutoff {self._cutoff_date} => min_id={self._cutoff_ids[chat_id]}")
+        return self._cutoff_ids[chat_id]
+
+    @staticmethod
+    def _lane(event_type: str) -> str:
+        return "backfill" if event_type == "backfill_message" else "gap"
+
+    async def _fetch_page(self, chat_id: int, offset_id: int, min_id: int, lane: str = "backfill"):
+        # Слот берётся на страницу: live-работа вытесняет бэкфилл на границе страниц
+        async with scheduler.slot(lane):
+            msgs = await self.client.get_messages(
+                entity=chat_id,
+                limit=self.batch_size,
+                offset_id=offset_id,
+                min_id=min_id,
+                reverse=False
+            )
+        sender_cache.fill_from_messages(msgs)
+        return msgs
+
+    async def _emit_page(self, chat_id: int, msgs, event_type: str, upper_id: int, delay: bool = True) -> int:
+        """
+        Отправляет сообщения страницы (ID < upper_id) в callback и/или (BACKFILL_SINK)
+        одной пачкой в Postgres через COPY. Возвращает минимальный ID.
+        delay=False — без "человеческой" паузы (догон после рестарта, темп задаётся на уровне RPC).
+        При остановке страница прерывается между сообщениями: возвращённый минимум
+        покрывает только уже отправленное (страница идёт от новых к старым).
+        """
+        min_seen = upper_id
+        to_kafka = settings.BACKFILL_SINK in ("kafka", "both")
+        rows, copied = [], []
+        for m in msgs:
+            if self._stop_event.is_set():
+                logger.info(f"[Backfill] Chat {chat_id}: stopping mid-page at id<{min_seen}")
+                break
+            if m.id >= upper_id:
+                continue
+            if m.id < min_seen:
+                min_seen = m.id
+            # missing_message не подавляется: gap finder запросил диапазон, потому что строк
+            # нет в БД, даже если сообщение уже отправлялось (и потерялось ниже по потоку)
+            if settings.DEDUP_ENABLED and dedup_index.is_duplicate(m) and event_type != "missing_message":
+                metrics.DEDUP_SUPPRESSED.inc(event_type=event_type)
+                continue
+
+            trace = tracer.start(event_type, m)
+            if delay:
+                dmin, dmax = get_delay_settings("chat")
+                with span(trace, "delay"):
+                    await human_like_delay(dmin, dmax)
+
+            async with scheduler.slot(self._lane(event_type)):
+                with span(trace, "serialize"):
+                    data = serialize_message(m, event_type, self.chat_id_to_data.get(chat_id, UNKNOWN_CHAT))
+                if not data:
+                    # сериализация не удалась (ошибка уже в логе) — ни в Kafka, ни в COPY
+                    dedup_index.forget(m)
+                    tracer.release(trace)
+                    continue
+                if to_kafka:
+                    try:
+                        await self.message_callback(data, trace=trace)
+                    except Exception:
+                        dedup_index.forget(m)
+                        raise
+                else:
+                    tracer.release(trace)
+            if settings.BACKFILL_SINK in ("copy", "both"):
+                rows.append(data)
+                copied.append(m)
+            if settings.MEDIA_ENABLED and data.get("media"):
+                media_downloader.submit(m)
+        if rows:
+            await self._copy_rows(chat_id, rows, copied, event_type)
+        if min_seen < upper_id:
+            self.state_mgr.mark_chat_dirty(chat_id)
+        return min_seen
+
+    async def _copy_rows(self, chat_id: int, rows: list, msgs: list, event_type: str):
+        table_name = message_table_name(self.chat_id_to_data.get(chat_id, UNKNOWN_CHAT), chat_id)
+        started = time.perf_counter()
+        try:
+            async with scheduler.slot(self._lane(event_type)):
+                await asyncio.to_thread(copy_sink.write, table_name, rows)
+        except Exception:
+            for m in msgs:
+                dedup_index.forget(m)
+            raise
+        metrics.DB_COPY_ROWS.inc(len(rows), table=table_name)
+        metrics.DB_COPY_SECONDS.observe(time.perf_counter() - started)
+
+    async def _backfill_range(self, chat_id: int, lower_id: int, upper_id: int, event_type: str) -> int:
+        """
+        Проходит назад по ID в интервале (lower_id, upper_id). Возвращает достигнутую
+        нижнюю границу: ID из [результат, upper_id) пройдены; <= lower_id + 1 — интервал
+        пройден целиком.
+        """
+        current_off = upper_id
+        try:
+            while current_off - lower_id > 1:
+                if self._stop_event.is_set():
+                    return current_off
+                msgs = await self._fetch_page(chat_id, current_off, lower_id, self._lane(event_type))
+                if not msgs:
+                    return lower_id + 1
+                min_seen = await self._emit_page(chat_id, msgs, event_type, current_off)
+                if self._stop_event.is_set():
+                    return min_seen
+                if min_seen >= current_off:
+                    return lower_id + 1
+                current_off = min_seen
+                await self._pace_for_live()
+            return lower_id + 1
+        except asyncio.CancelledError:
+            raise
+        except errors.FloodWaitError as e:
+            metrics.FLOOD_WAIT_SECONDS.inc(e.seconds, component="backfill")
+            if self.on_flood_wait is not None:
+                self.on_flood_wait(e.seconds)
+            wait_sec = min(e.seconds + self.flood_wait_delay, self.max_total_wait)
+            logger.warning(f"[Backfill] FloodWait in range {lower_id}..{upper_id} for chat {chat_id} => wait {wait_sec}s.")
+            await asyncio.sleep(wait_sec)
+            return current_off
+        except Exception as e:
+            logger.exception(f"[Backfill] Error in range {lower_id}..{upper_id} for chat {chat_id}: {e}")
+            return current_off
+
     async def run(self):
         logger.info("BackfillManager started.")
         while not self._stop_event.is_set():
-            await asyncio.sleep(self.idle_timeout)
-            new_count = self.state_mgr.pop_new_messages_count(self.idle_timeout)
-            if new_count > self.new_msgs_threshold:
-                logger.debug("[Backfill] new messages => skip this round")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), self.idle_timeout)
+                break
+            except asyncio.TimeoutError:
+                pass
+            load = self._live_load()
+            if load >= 1:
+                logger.debug(f"[Backfill] live load {load:.2f} => skip this round")
                 continue
 
             chats_to_backfill = self.state_mgr.get_chats_needing_backfill()
+            if self.chat_filter is not None:
+                chats_to_backfill = [cid for cid in chats_to_backfill if self.chat_filter(cid)]
             if not chats_to_backfill:
                 logger.debug("[Backfill] No chats needing backfill.")
                 continue
 
+            self._start_pass()
+
             chats_to_backfill.sort(
                 key=lambda cid: self.state_mgr.get_backfill_from_id(cid) or 1,
                 reverse=True
@@ -65,6 +258,12 @@ class BackfillManager:
             for cid in chats_to_backfill:
                 if self._stop_event.is_set():
                     break
+                if self._live_load() >= 1:
+                    logger.debug("[Backfill] live load grew => yield the rest of the round")
+                    break
+                if self._live_load(cid) >= 1:
+                    logger.debug(f"[Backfill] chat {cid} is busy with live traffic => skip")
+                    continue
                 await self._fill_missing_ranges(cid)
                 await self._do_chat_backfill(cid)
 
@@ -79,58 +278,25 @@ class BackfillManager:
         missing_ranges.sort(key=lambda rng: rng[1], reverse=True)
         new_missing = []
 
+        try:
+            cutoff_id = await self._get_cutoff_min_id(chat_id)
+        except Exception as e:
+            logger.exception(f"[Backfill] Could not resolve cutoff for chat {chat_id}: {e}")
+            return
+
         for (start_id, end_id) in missing_ranges:
             if self._stop_event.is_set():
-                break
-            offset = end_id + 1
-            try:
-                logger.info(f"[Backfill] Filling gaps {start_id}..{end_id} for chat {chat_id}")
-                current_off = offset
-                stop_processing = False
-                while current_off > start_id:
-                    msgs = await self.client.get_messages(
-                        entity=chat_id,
-                        limit=self.batch_size,
-                        offset_id=current_off,
-                        reverse=False
-                    )
-                    if not msgs:
-                        break
-                    min_id = current_off
-                    for m in msgs:
-                        if m.id >= current_off:
-                            continue
-
-                        if settings.BACKFILL_MAX_DAYS > 0:
-                            cutoff_date = get_current_time_moscow() - timedelta(days=settings.BACKFILL_MAX_DAYS)
-                            message_date = m.date.astimezone(cutoff_date.tzinfo)
-                            if message_date < cutoff_date:
-                                logger.info(f"[Backfill] Message {m.id} date {message_date} is older than cutoff {cutoff_date}. Stop filling gaps for chat {chat_id}.")
-                                stop_processing = True
-                                break
-
-                        dmin, dmax = get_delay_settings("chat")
-                        await human_like_delay(dmin, dmax)
-
-                        data = serialize_message(m, "missing_message", self.chat_id_to_data.get(chat_id, {}))
-                        await self.message_callback(data)
-                        if m.id < min_id:
-                            min_id = m.id
-                    if stop_processing or min_id >= current_off:
-                        break
-                    current_off = min_id
-                    if current_off <= start_id:
-                        break
-            except asyncio.CancelledError:
-                raise
-            except errors.FloodWaitError as e:
-                wait_sec = min(e.seconds + self.flood_wait_delay, self.max_total_wait)
-                logger.warning(f"[Backfill] FloodWaitError => wait {wait_sec}s.")
-                await asyncio.sleep(wait_sec)
-            except Exception as e:
-                logger.exception(f"[Backfill] Error filling {start_id}..{end_id} for chat {chat_id}: {e}")
                 new_missing.append([start_id, end_id])
                 continue
+            if end_id <= cutoff_id:
+                logger.info(f"[Backfill] Gap {start_id}..{end_id} for chat {chat_id} is older than cutoff, dropping.")
+                continue
+            logger.info(f"[Backfill] Filling gaps {start_id}..{end_id} for chat {chat_id}")
+            lower_id = max(start_id - 1, cutoff_id)
+            reached = await self._backfill_range(chat_id, lower_id, end_id + 1, "missing_message")
+            if reached > lower_id + 1:
+                # пройденная верхняя часть пропуска закрыта
+                new_missing.append([lower_id + 1, reached - 1])
 
         if new_missing:
             logger.info(f"[Backfill] Remaining gaps for chat {chat_id}: {new_missing}")
@@ -144,50 +310,78 @@ class BackfillManager:
             logger.debug(f"[Backfill] Chat {chat_id} fully backfilled.")
             return
 
-        logger.info(f"[Backfill] Backfill from offset={offset} for chat {chat_id}")
+        logger.info("[Backfill] Backfill from offset=%s for chat %s", offset, chat_id)
         try:
-            msgs = await self.client.get_messages(
-                entity=chat_id,
-                limit=self.batch_size,
-                offset_id=offset,
-                reverse=False
-            )
-            if not msgs:
-                logger.info(f"[Backfill] No older msgs for chat {chat_id}, set backfill=1")
+            cutoff_id = await self._get_cutoff_min_id(chat_id)
+            if offset - cutoff_id <= 1:
+                logger.info(f"[Backfill] Chat {chat_id} reached cutoff {self._cutoff_date}, set backfill=1")
                 self.state_mgr.update_backfill_from_id(chat_id, 1)
                 return
 
-            min_id = offset
-            for m in msgs:
-                if m.id >= offset:
-                    continue
-
-                if settings.BACKFILL_MAX_DAYS > 0:
-                    cutoff_date = get_current_time_moscow() - timedelta(days=settings.BACKFILL_MAX_DAYS)
-                    message_date = m.date.astimezone(cutoff_date.tzinfo)
-                    if message_date < cutoff_date:
-                        logger.info(f"[Backfill] Message {m.id} date {message_date} is older than cutoff {cutoff_date}. Stop backfill for chat {chat_id}.")
-                        self.state_mgr.update_backfill_from_id(chat_id, 1)
-                        return
-
-                dmin, dmax = get_delay_settings("chat")
-                await human_like_delay(dmin, dmax)
+            shards = settings.BACKFILL_DATE_SHARDS
+            if self._cutoff_date is not None and shards > 1 and offset - cutoff_id > self.batch_size * shards:
+                await self._do_sharded_backfill(chat_id, cutoff_id, offset)
+                return
 
-                data = serialize_message(m, "backfill_message", self.chat_id_to_data.get(chat_id, {}))
-                await self.message_callback(data)
-                if m.id < min_id:
-                    min_id = m.id
+            msgs = await self._fetch_page(chat_id, offset, cutoff_id)
+            if not msgs:
+                logger.info(f"[Backfill] No older msgs for chat {chat_id}, set backfill=1")
+                self.state_mgr.update_backfill_from_id(chat_id, 1)
+                return
 
+            min_id = await self._emit_page(chat_id, msgs, "backfill_message", offset)
             if min_id < offset:
                 offset = min_id
             self.state_mgr.update_backfill_from_id(chat_id, offset)
-            logger.info(f"[Backfill] Updated chat {chat_id} => backfill_from_id={offset}")
+            logger.info("[Backfill] Updated chat %s => backfill_from_id=%s", chat_id, offset)
 
         except asyncio.CancelledError:
             raise
         except errors.FloodWaitError as e:
+            metrics.FLOOD_WAIT_SECONDS.inc(e.seconds, component="backfill")
+            if self.on_flood_wait is not None:
+                self.on_flood_wait(e.seconds)
             wait_sec = min(e.seconds + self.flood_wait_delay, self.max_total_wait)
             logger.warning(f"[Backfill] FloodWait => wait {wait_sec}s.")
             await asyncio.sleep(wait_sec)
         except Exception as e:
             logger.exception(f"[Backfill] Error in backfill for chat {chat_id}: {e}")
+
+    async def _do_sharded_backfill(self, chat_id: int, cutoff_id: int, offset: int):
+        """
+        Делит окно [cutoff, сейчас] на BACKFILL_DATE_SHARDS интервалов по дате,
+        переводит границы в ID (offset_date) и выкачивает интервалы параллельно.
+        Чекпоинт: backfill_from_id сдвигается до нижней границы непрерывного
+        (от новых к старым) префикса полностью пройденных интервалов.
+        """
+        shards = settings.BACKFILL_DATE_SHARDS
+        now = get_current_time_moscow()
+        step = (now - self._cutoff_date) / shards
+
+        bounds = [cutoff_id]
+        for i in range(1, shards):
+            bound_id = await self._get_id_before_date(chat_id, self._cutoff_date + step * i)
+            bounds.append(min(max(bound_id, bounds[-1]), offset - 1))
+
+        # Интервал i: ID в (bounds[i], upper_i); upper последнего — текущий offset
+        ranges = []
+        for i, lower_id in enumerate(bounds):
+            upper_id = bounds[i + 1] + 1 if i + 1 < len(bounds) else offset
+            if upper_id - lower_id > 1:
+                ranges.append((lower_id, upper_id))
+
+        logger.info(f"[Backfill] Chat {chat_id}: date-sharded backfill over {len(ranges)} shards {ranges}")
+        results = await asyncio.gather(
+            *(self._backfill_range(chat_id, lo, hi, "backfill_message") for lo, hi in ranges)
+        )
+
+        new_offset = offset
+        for (lower_id, _), reached in sorted(zip(ranges, results), key=lambda r: r[0][0], reverse=True):
+            # непрерывный префикс от новых к старым; первый незаконченный интервал — частично
+            new_offset = max(reached, lower_id + 1)
+            if reached > lower_id + 1:
+                break
+        if new_offset <= cutoff_id + 1:
+            new_offset = 1
+        self.state_mgr.update_backfill_from_id(chat_id, new_offset)
+        logger.info(f"[Backfill] Updated chat {chat_id} => backfill_from_id={new_offset} (sharded)")
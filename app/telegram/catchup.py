@@ -0,0 +1,155 @@
+# tg_ubot/app/telegram/catchup.py
+
+"""
+Догон после рестарта: до включения live-режима для каждого чата, где
+последнее сообщение диалога новее сохранённого last_seen_id, запрашиваются
+только сообщения с ID > last_seen_id (reverse=True, постранично).
+Чаты обрабатываются параллельно (CATCHUP_CONCURRENCY), запросы к Telegram
+ограничены по частоте (CATCHUP_RATE в секунду на весь процесс).
+
+Состояние обновлений аккаунта (pts/qts/date из updates.getState) хранится
+в пространстве состояния сессии: по разнице pts видно, сколько событий
+пришлось на простой.
+"""
+
+import asyncio
+import logging
+import time
+
+from telethon import functions
+from telethon.errors import FloodWaitError
+
+from app.config import settings
+from app.scheduler import scheduler
+from app.telegram.entity_cache import sender_cache
+
+logger = logging.getLogger("catchup")
+
+
+async def save_update_state(session) -> dict:
+    """
+    Сохраняет pts/qts/date аккаунта в state_<session>.json; возвращает предыдущее значение.
+    """
+    previous = session.state_mgr.state.get("update_state", {})
+    try:
+        state = await session.client(functions.updates.GetStateRequest())
+    except Exception as e:
+        logger.debug(f"[CatchUp] getState failed for session {session.name}: {e}")
+        return previous
+    session.state_mgr.state["update_state"] = {
+        "pts": state.pts,
+        "qts": state.qts,
+        "date": int(state.date.timestamp()),
+        "seq": state.seq,
+    }
+    session.state_mgr._save_state()
+    return previous
+
+
+class CatchUpManager:
+    def __init__(self, session_pool, state_mgr, backfill_manager_for, concurrency=None, rate=None,
+                 max_messages=None, batch_size=100):
+        self.session_pool = session_pool
+        self.state_mgr = state_mgr
+        # chat_id -> BackfillManager сессии-владельца (через него идёт отправка: dedup, трасса, медиа)
+        self.backfill_manager_for = backfill_manager_for
+        self.concurrency = concurrency or settings.CATCHUP_CONCURRENCY
+        self.rate = rate or settings.CATCHUP_RATE
+        self.max_messages = max_messages or settings.CATCHUP_MAX_MESSAGES
+        self.batch_size = batch_size
+
+        self._rate_lock = asyncio.Lock()
+        self._next_request = 0.0
+
+    def chats_to_catch_up(self, top_message_ids: dict) -> list:
+        """
+        Чаты с известным last_seen_id, в которых после него что-то появилось.
+        Чаты без last_seen_id (новые / ещё не виденные live) — забота бэкфилла.
+        """
+        result = []
+        for chat_id, top_id in top_message_ids.items():
+            if not self.session_pool.is_local(chat_id):
+                continue
+            last_seen = self.state_mgr.get_last_seen_id(chat_id)
+            if last_seen is not None and top_id > last_seen:
+                result.append(chat_id)
+        return result
+
+    async def _pace(self):
+        async with self._rate_lock:
+            now = time.monotonic()
+            wait = self._next_request - now
+            self._next_request = max(now, self._next_request) + 1.0 / self.rate
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _catch_up_chat(self, chat_id: int) -> int:
+        manager = self.backfill_manager_for(chat_id)
+        offset = self.state_mgr.get_last_seen_id(chat_id)
+        emitted = 0
+        while emitted < self.max_messages:
+            await self._pace()
+            try:
+                async with scheduler.slot("gap"):
+                    msgs = await manager.client.get_messages(
+                        chat_id, limit=self.batch_size, offset_id=offset, reverse=True
+                    )
+            except FloodWaitError as e:
+                self.session_pool.report_flood_wait(
+                    self.session_pool.owner_of(chat_id), e.seconds
+                )
+                logger.warning(f"[CatchUp] FloodWait {e.seconds}s in chat {chat_id} => left to gap finder")
+                break
+            if not msgs:
+                break
+            sender_cache.fill_from_messages(msgs)
+            top_id = msgs[-1].id
+            await manager._emit_page(chat_id, msgs, "new_message", top_id + 1, delay=False)
+            if manager._stop_event.is_set():
+                # страница могла прерваться: last_seen не двигаем, остальное — при следующем старте
+                self.state_mgr.mark_chat_dirty(chat_id)
+                break
+            self.state_mgr.mark_chat_dirty(chat_id, top_id)
+            emitted += len(msgs)
+            offset = top_id
+            if len(msgs) < self.batch_size:
+                break
+        return emitted
+
+    async def run(self, top_message_ids: dict, timeout: float = None) -> dict:
+        chat_ids = self.chats_to_catch_up(top_message_ids)
+        if not chat_ids:
+            logger.info("[CatchUp] nothing to catch up.")
+            return {"chats": 0, "messages": 0}
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        emitted = {}
+
+        async def worker(chat_id):
+            async with semaphore:
+                try:
+                    emitted[chat_id] = await self._catch_up_chat(chat_id)
+                except Exception as e:
+                    logger.exception(f"[CatchUp] chat {chat_id} failed: {e}")
+                    self.state_mgr.mark_chat_dirty(chat_id)
+
+        started = time.perf_counter()
+        tasks = [asyncio.create_task(worker(cid), name=f"catchup_{cid}") for cid in chat_ids]
+        done, pending = await asyncio.wait(tasks, timeout=timeout or settings.CATCHUP_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        # недогнанное по таймауту доберёт gap finder
+        for cid in chat_ids:
+            if cid not in emitted:
+                self.state_mgr.mark_chat_dirty(cid)
+        self.state_mgr.checkpoint_last_seen()
+
+        report = {
+            "chats": len(chat_ids),
+            "messages": sum(emitted.values()),
+            "timed_out": len(pending),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        logger.info(f"[CatchUp] done: {report}")
+        return report
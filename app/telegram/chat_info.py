@@ -1,6 +1,7 @@
 # tg_ubot/app/telegram/chat_info.py
 
 import logging
+import sys
 from telethon import TelegramClient
 from telethon.tl.types import User, Chat, Channel, ChatForbidden
 
@@ -9,12 +10,133 @@ from app.config import settings
 logger = logging.getLogger("chat_info")
 
 
-async def get_all_chats_info(client: TelegramClient):
+def _intern(value) -> str:
+    return sys.intern(value or "")
+
+
+class ChatInfo:
+    """
+    Метаданные чата: компактная запись (__slots__, строки интернированы),
+    одна на чат на весь процесс. Сериализатор читает её атрибуты напрямую,
+    так что в сообщения попадают ссылки на те же объекты строк.
+    get()/[] оставлены для кода, работающего с метаданными как со словарём.
     """
-    Возвращает dict {chat_id: {...}} с метаданными о чатах, исключая
+
+    __slots__ = ("target_id", "chat_title", "chat_username", "name_uname", "entity_type")
+
+    def __init__(self, target_id, chat_title="", chat_username="", name_uname="Unknown", entity_type=""):
+        self.target_id = target_id
+        self.chat_title = _intern(chat_title)
+        self.chat_username = _intern(chat_username)
+        self.name_uname = _intern(name_uname)
+        self.entity_type = _intern(entity_type)
+
+    def get(self, key, default=None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def as_dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+    def __repr__(self):
+        return f"ChatInfo({self.target_id}, {self.name_uname!r}, {self.entity_type})"
+
+
+# Метаданные неизвестного чата (значения по умолчанию в сериализованном сообщении)
+UNKNOWN_CHAT = ChatInfo(target_id="")
+
+
+class ChatDirectory(dict):
+    """
+    Справочник чатов: target_id -> ChatInfo плюс индекс по username
+    (без @, в нижнем регистре). Сырой ID сущности Telegram отдельного
+    индекса не требует — target_id из него вычисляется (см. _get_target_id_and_type).
+    Это dict, поэтому `chat_id in chats`, get(), items() работают как раньше.
+    """
+
+    def __init__(self, records=()):
+        super().__init__()
+        self._by_username = {}
+        for info in records:
+            self.add(info)
+
+    def add(self, info: ChatInfo) -> ChatInfo:
+        self[info.target_id] = info
+        return info
+
+    def __setitem__(self, target_id, info):
+        previous = dict.get(self, target_id)
+        if previous is not None:
+            self._unindex(previous)
+        super().__setitem__(target_id, info)
+        if info.chat_username:
+            self._by_username[sys.intern(info.chat_username.lower())] = info
+
+    def __delitem__(self, target_id):
+        self._unindex(dict.__getitem__(self, target_id))
+        super().__delitem__(target_id)
+
+    def _unindex(self, info):
+        # username мог перейти к другому чату — снимаем только свою запись
+        username = info.chat_username.lower()
+        if username and self._by_username.get(username) is info:
+            del self._by_username[username]
+
+    def setdefault(self, target_id, info):
+        if target_id not in self:
+            self[target_id] = info
+        return dict.__getitem__(self, target_id)
+
+    def update(self, other=(), **kwargs):
+        for target_id, info in dict(other, **kwargs).items():
+            self[target_id] = info
+
+    def pop(self, target_id, *default):
+        if target_id in self:
+            info = dict.__getitem__(self, target_id)
+            del self[target_id]
+            return info
+        if default:
+            return default[0]
+        raise KeyError(target_id)
+
+    def by_username(self, username: str):
+        return self._by_username.get((username or "").lstrip("@").lower())
+
+    def by_raw_id(self, raw_id: int):
+        """
+        Пользователь / группа хранятся под сырым ID, каналы — под -100<id>.
+        """
+        return dict.get(self, raw_id) or dict.get(self, int(f"-100{raw_id}"))
+
+    def resolve(self, ref):
+        """
+        ChatInfo по target_id, сырому ID или username ("@name"/"name"); None, если чат не известен.
+        """
+        if isinstance(ref, str):
+            stripped = ref.strip()
+            if stripped.lstrip("-").isdigit():
+                ref = int(stripped)
+            else:
+                return self.by_username(stripped)
+        if ref < 0:
+            return dict.get(self, ref)
+        return self.by_raw_id(ref)
+
+
+async def get_all_chats_info(client: TelegramClient, top_message_ids: dict = None):
+    """
+    Возвращает ChatDirectory {chat_id: ChatInfo} с метаданными о чатах, исключая
     те, что прописаны в EXCLUDED_CHAT_IDS/EXCLUDED_USERNAMES.
+    top_message_ids (если передан) заполняется ID последних сообщений диалогов.
     """
-    chats_info = {}
+    chats_info = ChatDirectory()
     all_dialogs = await client.get_dialogs()
 
     excluded_ids = set(settings.EXCLUDED_CHAT_IDS or [])
@@ -38,26 +160,34 @@ async def get_all_chats_info(client: TelegramClient):
             logger.info(f"Excluding by chat_id={raw_id}")
             continue
 
-        target_id, entity_type = _get_target_id_and_type(entity)
-        if target_id is None:
+        info = build_chat_info(entity)
+        if info is None:
             continue
-
-        chat_title = _get_chat_title(entity)
-        chat_username = getattr(entity, 'username', '') or ''
-        name_uname = _get_name_or_username(entity)
-
-        chats_info[target_id] = {
-            "target_id": target_id,
-            "chat_title": chat_title,
-            "chat_username": chat_username,
-            "name_uname": name_uname,
-            "entity_type": entity_type
-        }
+        chats_info.add(info)
+        if top_message_ids is not None and dialog.message is not None:
+            top_message_ids[info.target_id] = dialog.message.id
 
     logger.info(f"Total dialogs after exclusion: {len(chats_info)}")
     return chats_info
 
 
+def build_chat_info(entity):
+    """
+    Метаданные одного чата/канала/пользователя (None, если тип не поддерживается).
+    """
+    target_id, entity_type = _get_target_id_and_type(entity)
+    if target_id is None:
+        return None
+
+    return ChatInfo(
+        target_id=target_id,
+        chat_title=_get_chat_title(entity),
+        chat_username=getattr(entity, 'username', '') or '',
+        name_uname=_get_name_or_username(entity),
+        entity_type=entity_type,
+    )
+
+
 def _get_target_id_and_type(entity):
     if isinstance(entity, Channel):
         if getattr(entity, 'broadcast', False) or getattr(entity, 'megagroup', False):
@@ -0,0 +1,172 @@
+# tg_ubot/app/telegram/dedup.py
+
+"""
+Подавление повторных отправок одного и того же состояния сообщения
+(new_message -> edited_message без изменений -> backfill_message). missing_message
+(починка дыр в БД) отпечаток запоминает, но не подавляется.
+"""
+
+import hashlib
+import logging
+import math
+import os
+from collections import OrderedDict
+
+from app.config import settings
+
+logger = logging.getLogger("dedup")
+
+
+def message_fingerprint(msg) -> tuple:
+    """
+    (chat_id, message_id, edit_date, content_hash) — без полной сериализации.
+    content_hash покрывает текст и реакции.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update((msg.raw_text or "").encode("utf-8", "surrogatepass"))
+    reactions = getattr(msg, "reactions", None)
+    if reactions:
+        for rcount in reactions.results:
+            h.update(f"|{getattr(rcount.reaction, 'emoticon', 'unknown')}:{rcount.count}".encode("utf-8"))
+    edit_date = getattr(msg, "edit_date", None)
+    return (msg.chat_id, msg.id, int(edit_date.timestamp()) if edit_date else 0, h.hexdigest())
+
+
+class BloomFilter:
+    """
+    Компактный фильтр Блума (bytearray + k хешей из blake2b) с сохранением в файл.
+    """
+
+    def __init__(self, capacity: int = 1_000_000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def save(self, path: str):
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(self.size.to_bytes(8, "little"))
+            f.write(self.hashes.to_bytes(4, "little"))
+            f.write(self.bits)
+        os.replace(tmp_file, path)
+
+    def load(self, path: str) -> bool:
+        with open(path, "rb") as f:
+            size = int.from_bytes(f.read(8), "little")
+            hashes = int.from_bytes(f.read(4), "little")
+            bits = bytearray(f.read())
+        if size != self.size or hashes != self.hashes or len(bits) != len(self.bits):
+            logger.warning(f"Bloom filter {path} has different parameters, ignoring it.")
+            return False
+        self.bits = bits
+        return True
+
+
+class DedupIndex:
+    """
+    LRU (chat_id, message_id) -> (edit_date, content_hash) ограниченного размера
+    плюс (опционально) сохраняемый между перезапусками фильтр Блума по полному отпечатку.
+    Фильтр Блума даёт редкие ложные срабатывания, поэтому по умолчанию выключен.
+    """
+
+    def __init__(self, max_entries: int = 100_000, bloom_path: str = "", bloom_capacity: int = 1_000_000,
+                 bloom_error_rate: float = 0.001, save_every: int = 10_000, max_forgotten: int = 10_000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.bloom_path = bloom_path
+        self.bloom = None
+        self.save_every = save_every
+        self._unsaved = 0
+        # забытые (неудачно обработанные) сообщения: из фильтра Блума их не удалить,
+        # поэтому его срабатывание для них игнорируется (LRU: вытесненные снова подавляются)
+        self.max_forgotten = max_forgotten
+        self._forgotten = OrderedDict()
+        if bloom_path:
+            self.bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+            if os.path.exists(bloom_path):
+                try:
+                    if self.bloom.load(bloom_path):
+                        logger.info(f"Loaded dedup bloom filter from {bloom_path}")
+                except Exception as e:
+                    logger.exception(f"Could not load bloom filter {bloom_path}: {e}")
+
+    def is_duplicate(self, msg) -> bool:
+        """
+        True, если это состояние сообщения уже отправлялось; иначе запоминает его.
+        """
+        chat_id, message_id, edit_ts, content_hash = message_fingerprint(msg)
+        key = (chat_id, message_id)
+        value = (edit_ts, content_hash)
+
+        previous = self.entries.get(key)
+        if previous == value:
+            self.entries.move_to_end(key)
+            return True
+        bloom_key = f"{chat_id}:{message_id}:{edit_ts}:{content_hash}"
+        if previous is None and self.bloom is not None and bloom_key in self.bloom:
+            if key in self._forgotten:
+                del self._forgotten[key]
+            else:
+                self._remember(key, value)
+                return True
+
+        self._remember(key, value)
+        if self.bloom is not None:
+            self.bloom.add(bloom_key)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every:
+                self.save()
+        return False
+
+    def forget(self, msg):
+        """
+        Убирает сообщение из LRU (например, если его обработка не удалась).
+        """
+        self.forget_id(msg.chat_id, msg.id)
+
+    def forget_id(self, chat_id, message_id):
+        """
+        То же по ID — для мест, где есть только сериализованное сообщение.
+        """
+        key = (chat_id, message_id)
+        self.entries.pop(key, None)
+        if self.bloom is not None:
+            self._forgotten[key] = None
+            self._forgotten.move_to_end(key)
+            if len(self._forgotten) > self.max_forgotten:
+                self._forgotten.popitem(last=False)
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def save(self):
+        if self.bloom is None:
+            return
+        try:
+            self.bloom.save(self.bloom_path)
+            self._unsaved = 0
+        except Exception as e:
+            logger.exception(f"Could not save bloom filter {self.bloom_path}: {e}")
+
+
+dedup_index = DedupIndex(
+    max_entries=settings.DEDUP_MAX_ENTRIES,
+    bloom_path=settings.DEDUP_BLOOM_PATH,
+    bloom_capacity=settings.DEDUP_BLOOM_CAPACITY,
+)
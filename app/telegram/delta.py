@@ -0,0 +1,110 @@
+# tg_ubot/app/telegram/delta.py
+
+"""
+Дельта-кодирование edited_message: вместо полного payload отправляются только
+изменившиеся поля (обычно реакции) с номером версии. Полный снимок уходит
+периодически (каждые snapshot_every версий или раз в snapshot_interval сек.),
+чтобы потребители могли пересинхронизироваться.
+"""
+
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from functools import partial
+
+from app.config import settings
+
+# Поля, которые могут меняться при редактировании сообщения
+DELTA_FIELDS = ("text_plain", "text_markdown", "links", "sender", "reactions", "media")
+# Поля, которые всегда передаются в дельте (идентификация и маршрутизация)
+KEY_FIELDS = ("message_id", "chat_id", "date", "chat_title", "target_id", "name_uname", "month_part")
+
+DELTA_EVENT_TYPE = "edited_message_delta"
+
+
+def _field_hash(value) -> str:
+    raw = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class _Fingerprint:
+    __slots__ = ("version", "hashes", "since_snapshot", "snapshot_at")
+
+    def __init__(self, hashes: dict, now: float):
+        self.version = 1
+        self.hashes = hashes
+        self.since_snapshot = 0
+        self.snapshot_at = now
+
+
+class DeltaEncoder:
+    def __init__(self, max_entries: int = 100_000, snapshot_every: int = 10, snapshot_interval: float = 3600):
+        self.max_entries = max_entries
+        self.snapshot_every = snapshot_every
+        self.snapshot_interval = snapshot_interval
+        self.cache = OrderedDict()
+
+    def encode(self, data: dict):
+        """
+        Возвращает (payload, commit): payload для Kafka — полный снимок (с полем version)
+        или дельта; None, если в edited_message ничего не изменилось и снимок не нужен.
+        Отпечаток сообщения обновляется только вызовом commit() после успешной
+        отправки — иначе повтор отправки не увидит изменений и правка потеряется.
+        """
+        if not data:
+            return data, None
+        key = (data.get("chat_id"), data.get("message_id"))
+        hashes = {field: _field_hash(data.get(field)) for field in DELTA_FIELDS}
+        now = time.monotonic()
+
+        fp = self.cache.get(key)
+        if fp is None:
+            return {**data, "version": 1}, partial(self._commit_new, key, hashes, now)
+
+        self.cache.move_to_end(key)
+        changed = [field for field in DELTA_FIELDS if fp.hashes.get(field) != hashes[field]]
+        version = fp.version + 1 if changed else fp.version
+
+        snapshot_due = (
+            fp.since_snapshot + 1 >= self.snapshot_every
+            or now - fp.snapshot_at >= self.snapshot_interval
+        )
+        if data.get("event_type") != "edited_message" or snapshot_due:
+            return {**data, "version": version}, partial(self._commit, fp, version, hashes, now)
+        if not changed:
+            return None, None
+
+        delta = {field: data.get(field) for field in KEY_FIELDS}
+        delta["event_type"] = DELTA_EVENT_TYPE
+        delta["version"] = version
+        delta["changed"] = {field: data.get(field) for field in changed}
+        return delta, partial(self._commit, fp, version, hashes, None)
+
+    def _commit_new(self, key, hashes, now):
+        self._remember(key, _Fingerprint(hashes, now))
+
+    @staticmethod
+    def _commit(fp, version, hashes, snapshot_at):
+        """
+        snapshot_at — время отправленного снимка (None — отправлена дельта).
+        """
+        fp.version = max(fp.version, version)
+        fp.hashes = hashes
+        if snapshot_at is None:
+            fp.since_snapshot += 1
+        else:
+            fp.since_snapshot = 0
+            fp.snapshot_at = snapshot_at
+
+    def _remember(self, key, fp):
+        self.cache[key] = fp
+        if len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+
+
+delta_encoder = DeltaEncoder(
+    max_entries=settings.DELTA_CACHE_SIZE,
+    snapshot_every=settings.DELTA_SNAPSHOT_EVERY,
+    snapshot_interval=settings.DELTA_SNAPSHOT_INTERVAL,
+)
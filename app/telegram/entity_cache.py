@@ -0,0 +1,118 @@
+# tg_ubot/app/telegram/entity_cache.py
+
+"""
+Общий кэш отправителей (LRU + TTL, сохраняется между перезапусками), чтобы данные
+отправителя были полными без лишних get_sender()/GetUsers-запросов.
+Заполняется из msg.sender, который Telethon проставляет по векторам users/chats
+каждой страницы get_messages и каждого update.
+"""
+
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+
+from app.config import settings
+
+logger = logging.getLogger("entity_cache")
+
+
+def sender_info_from_entity(entity) -> dict:
+    return {
+        "sender_id": getattr(entity, "id", None),
+        "sender_username": getattr(entity, "username", ""),
+        "sender_first_name": getattr(entity, "first_name", ""),
+        "sender_last_name": getattr(entity, "last_name", ""),
+    }
+
+
+class SenderCache:
+    def __init__(self, max_entries: int = 50_000, ttl: float = 86400, path: str = "", save_every: int = 1000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.entries = OrderedDict()
+        self._unsaved = 0
+
+    def put(self, entity):
+        info = sender_info_from_entity(entity)
+        sender_id = info["sender_id"]
+        if sender_id is None:
+            return
+        previous = self.entries.get(sender_id)
+        self.entries[sender_id] = (time.time() + self.ttl, info)
+        self.entries.move_to_end(sender_id)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        if previous is None or previous[1] != info:
+            self._unsaved += 1
+            if self.path and self._unsaved >= self.save_every:
+                self.save()
+
+    def get(self, sender_id) -> dict:
+        item = self.entries.get(sender_id)
+        if item is None:
+            return None
+        expires_at, info = item
+        if expires_at < time.time():
+            del self.entries[sender_id]
+            return None
+        self.entries.move_to_end(sender_id)
+        return info
+
+    def fill_from_messages(self, msgs):
+        """
+        Пополняет кэш отправителями страницы сообщений (уже разрешёнными Telethon).
+        """
+        for m in msgs:
+            sender = getattr(m, "sender", None)
+            if sender is not None:
+                self.put(sender)
+
+    def sender_info(self, msg) -> dict:
+        """
+        Данные отправителя сообщения: из msg.sender (с обновлением кэша) или из кэша по sender_id.
+        """
+        sender = getattr(msg, "sender", None)
+        if sender is not None:
+            self.put(sender)
+            return sender_info_from_entity(sender)
+        sender_id = getattr(msg, "sender_id", None)
+        if sender_id is None:
+            return {}
+        return self.get(sender_id) or {}
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            now = time.time()
+            for expires_at, info in raw:
+                if expires_at > now:
+                    self.entries[info["sender_id"]] = (expires_at, info)
+            logger.info(f"Loaded {len(self.entries)} cached senders from {self.path}")
+        except Exception as e:
+            logger.exception(f"Could not load sender cache {self.path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_file = self.path + ".tmp"
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.values()), f, ensure_ascii=False)
+            os.replace(tmp_file, self.path)
+            self._unsaved = 0
+        except Exception as e:
+            logger.exception(f"Could not save sender cache {self.path}: {e}")
+
+
+sender_cache = SenderCache(
+    max_entries=settings.SENDER_CACHE_SIZE,
+    ttl=settings.SENDER_CACHE_TTL,
+    path=settings.SENDER_CACHE_PATH,
+)
@@ -4,9 +4,15 @@ import os
 import logging
 import psycopg2
 import psycopg2.extras
+from psycopg2 import sql
 from telethon.errors import FloodWaitError
+from telethon.tl.types import MessageService
 
 from mirco_services_data_management.db import get_connection
+from app.config import settings
+from app import metrics
+from app.scheduler import scheduler
+from app.utils import ids_to_ranges, subtract_id_ranges
 
 logger = logging.getLogger("gaps_manager_local")
 
@@ -17,22 +23,32 @@ class LocalGapsManager:
     Если не используете PostgreSQL — уберите этот класс или закомментируйте.
     """
 
-    def __init__(self, state_mgr, client, chat_id_to_data):
+    # Максимум ID в одном запросе messages.getMessages / channels.getMessages
+    PROBE_BATCH_SIZE = 100
+
+    def __init__(self, state_mgr, client, chat_id_to_data, verify_max_ids=None, client_for_chat=None):
         self.state_mgr = state_mgr
         self.client = client
+        # multi-session: клиент сессии-владельца чата
+        self.client_for_chat = client_for_chat
         self.chat_id_to_data = chat_id_to_data
         self.schema_name = os.getenv("TG_UBOT_SCHEMA", "public")
+        self.verify_max_ids = settings.GAP_VERIFY_MAX_IDS if verify_max_ids is None else verify_max_ids
 
     def _get_all_tables_in_schema(self):
         """
         Поиск всех таблиц в схеме, чьи имена начинаются на messages_.
+        Возвращает пары (имя, есть ли типизированные столбцы tg_chat_id/tg_message_id).
         """
         conn = get_connection()  # из mirco_services_data_management.db
         table_list = []
         try:
             with conn.cursor() as cur:
-                sql = """
-                    SELECT c.relname
+                query = """
+                    SELECT c.relname,
+                           EXISTS (SELECT 1 FROM pg_attribute a
+                                   WHERE a.attrelid = c.oid AND a.attname = 'tg_message_id'
+                                     AND NOT a.attisdropped)
                     FROM pg_class c
                     JOIN pg_namespace n ON n.oid = c.relnamespace
                     WHERE n.nspname = %s
@@ -40,9 +56,9 @@ class LocalGapsManager:
                       AND c.relname LIKE 'messages_%%'
                     ORDER BY c.relname
                 """
-                cur.execute(sql, (self.schema_name,))
+                cur.execute(query, (self.schema_name,))
                 rows = cur.fetchall()
-                table_list = [row[0] for row in rows]
+                table_list = [(row[0], bool(row[1])) for row in rows]
         except Exception as e:
             logger.debug(f"Error fetching tables in {self.schema_name}: {e}")
         finally:
@@ -58,14 +74,22 @@ class LocalGapsManager:
         conn = get_connection()
         try:
             with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-                for table_name in tables:
-                    sql = f"""
-                        SELECT (data->>'message_id')::bigint AS msgid
-                        FROM {self.schema_name}.{table_name}
-                        WHERE (data->>'chat_id')::bigint = %s
-                    """
+                for table_name, typed in tables:
+                    if typed:
+                        # index-only scan по (tg_chat_id, tg_message_id), см. app/migrations.py
+                        query = sql.SQL("""
+                            SELECT tg_message_id AS msgid
+                            FROM {}
+                            WHERE tg_chat_id = %s
+                        """)
+                    else:
+                        query = sql.SQL("""
+                            SELECT (data->>'message_id')::bigint AS msgid
+                            FROM {}
+                            WHERE (data->>'chat_id')::bigint = %s
+                        """)
                     try:
-                        cur.execute(sql, (chat_id,))
+                        cur.execute(query.format(sql.Identifier(self.schema_name, table_name)), (chat_id,))
                         rows = cur.fetchall()
                         for r in rows:
                             if r and "msgid" in r:
@@ -85,12 +109,16 @@ class LocalGapsManager:
         Для примера: получаем самый ранний ID сообщения в Telegram (offset_id=0, reverse=True).
         """
         try:
-            msgs = await self.client.get_messages(chat_id, limit=1, offset_id=0, reverse=True)
+            async with scheduler.slot("gap"):
+                msgs = await self._client(chat_id).get_messages(chat_id, limit=1, offset_id=0, reverse=True)
             return msgs[0].id if msgs else None
         except Exception as e:
             logger.debug(f"_get_earliest_in_telegram({chat_id}) error: {e}")
             return None
 
+    def _client(self, chat_id: int):
+        return self.client_for_chat(chat_id) if self.client_for_chat else self.client
+
     def _find_missing_ranges(self, sorted_ids):
         if not sorted_ids:
             return []
@@ -102,6 +130,57 @@ class LocalGapsManager:
             prev_id = current_id
         return missing
 
+    async def _verify_missing_ranges(self, chat_id: int, missing_ranges: list) -> list:
+        """
+        Проверяет дыры в Telegram пачками get_messages(ids=[...]) по PROBE_BATCH_SIZE ID.
+        ID, которых в Telegram нет (удалены или служебные), пишутся в tombstones
+        и больше никогда не запрашиваются. Возвращает диапазоны, где сообщения
+        реально есть, плюс ещё не проверенный (сверх verify_max_ids) остаток.
+        """
+        candidates = subtract_id_ranges(missing_ranges, self.state_mgr.get_tombstones(chat_id))
+        if not candidates:
+            return []
+
+        # Сначала проверяем самые свежие дыры — их и backfill заполняет первыми
+        candidates.sort(key=lambda rng: rng[1], reverse=True)
+        to_probe = []
+        for start, end in candidates:
+            for msg_id in range(end, start - 1, -1):
+                if len(to_probe) >= self.verify_max_ids:
+                    break
+                to_probe.append(msg_id)
+
+        present, absent = [], []
+        probed = []
+        for i in range(0, len(to_probe), self.PROBE_BATCH_SIZE):
+            batch = to_probe[i:i + self.PROBE_BATCH_SIZE]
+            try:
+                async with scheduler.slot("gap"):
+                    msgs = await self._client(chat_id).get_messages(chat_id, ids=batch)
+            except FloodWaitError as e:
+                metrics.FLOOD_WAIT_SECONDS.inc(e.seconds, component="gaps")
+                logger.warning(f"[LocalGapsManager] FloodWait {e.seconds}s while probing chat {chat_id}, stop verification.")
+                break
+            except Exception as e:
+                logger.debug(f"[LocalGapsManager] probe error for chat {chat_id}: {e}")
+                break
+            for msg_id, m in zip(batch, msgs):
+                if m is None or isinstance(m, MessageService):
+                    absent.append(msg_id)
+                else:
+                    present.append(msg_id)
+            probed.extend(batch)
+
+        if absent:
+            metrics.GAP_TOMBSTONED_IDS.inc(len(absent))
+            self.state_mgr.add_tombstones(chat_id, ids_to_ranges(absent))
+        unverified = subtract_id_ranges(candidates, ids_to_ranges(probed))
+        logger.info(
+            f"Chat {chat_id}: probed {len(probed)} ids => present={len(present)}, "
+            f"tombstoned={len(absent)}, unverified ranges={len(unverified)}"
+        )
+        return ids_to_ranges(present) + unverified
+
     async def find_and_fill_gaps_for_chat(self, chat_id: int):
         """
         Ищет пропущенные ID, записывает их в state_mgr.
@@ -126,6 +205,8 @@ class LocalGapsManager:
             logger.info(f"Chat {chat_id}: Backfill updated => {earliest_in_db}")
 
         missing_ranges = self._find_missing_ranges(sorted_ids)
+        missing_ranges = await self._verify_missing_ranges(chat_id, missing_ranges)
         total_missing = sum((end - start + 1) for start, end in missing_ranges)
         self.state_mgr.set_missing_ranges(chat_id, [list(r) for r in missing_ranges])
+        metrics.GAP_MISSING_MESSAGES.set(total_missing, chat_id=chat_id)
         logger.info(f"Chat {chat_id}: Total missing messages: {total_missing}")
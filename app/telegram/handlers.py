@@ -1,11 +1,20 @@
 import logging
 import asyncio
+import time
 from telethon import events
 from telethon.tl.types import Message
 
 from app.config import settings
-from app.utils import human_like_delay, get_delay_settings
+from app.utils import human_like_delay, get_delay_settings, message_table_name
 from app.process_messages import serialize_message
+from app import metrics
+from app.tracing import tracer, span
+from app.telegram.dedup import dedup_index
+from app.telegram.reactions import reaction_aggregator, format_top_k
+from app.telegram.media import media_downloader
+from app.telegram.entity_cache import sender_cache
+from app.scheduler import scheduler
+from app.migrations import ensure_typed_columns
 from mirco_services_data_management.db import ensure_partitioned_parent_table, upsert_partitioned_record
 
 logger = logging.getLogger("unified_handler")
@@ -16,19 +25,52 @@ def register_unified_handler(
     message_buffer: asyncio.Queue,
     userbot_active: asyncio.Event,
     chat_id_to_data: dict,
-    state_mgr=None
+    state_mgr=None,
+    target_ids=None,
+    owns_chat=None,
+    ready: asyncio.Event = None,
+    owner_settled=None
 ):
     """
     Регистрирует обработчики для новых и отредактированных сообщений,
     ограниченные чатами из target_ids.
-    Если получено сообщение с текстом "push" от администратора (ADMIN_USERNAME),
+    Если получено сообщение с текстом "push" от администратора (ADMIN_USER_ID или ADMIN_USERNAME),
     инициируется публикация в канал (PUBLISH_CHANNEL).
+    При нескольких сессиях target_ids — чаты, видимые этому клиенту, а owns_chat
+    отсекает события чатов, которыми сейчас владеет другая сессия.
+    Если передан ready, обработчики регистрируются до загрузки диалогов:
+    события ждут ready (буферизуются в задачах Telethon), а фильтр по чатам
+    применяется уже после, по заполненному к тому времени chat_id_to_data.
+    owner_settled (корутина -> bool) — ожидание назначения чатов реплике: события
+    держатся до него, а без назначения (таймаут) реплика считает чат своим.
+    Отброшенное событие чужого чата двигает high-water mark, чтобы его новейшие
+    сообщения нашёл gap finder, если чат перейдёт к этой реплике.
     """
-    target_ids = list(chat_id_to_data.keys())
-    logger.info(f"Registering unified_handler for chats: {target_ids}")
+    if ready is None:
+        target_ids = list(chat_id_to_data.keys()) if target_ids is None else list(target_ids)
+        logger.info(f"Registering unified_handler for chats: {target_ids}")
+    else:
+        target_ids = None
+        logger.info("Registering unified_handler before dialogs are loaded; events wait for readiness.")
+
+    async def accepts(event) -> bool:
+        if ready is not None:
+            await ready.wait()
+            if event.chat_id not in chat_id_to_data:
+                return False
+        if owns_chat is None:
+            return True
+        assume_local = owner_settled is not None and not await owner_settled()
+        if owns_chat(event.chat_id, assume_local):
+            return True
+        if state_mgr is not None:
+            state_mgr.mark_chat_dirty(event.chat_id, event.message.id)
+        return False
 
     @client.on(events.NewMessage(chats=target_ids))
     async def on_new_message(event):
+        if not await accepts(event):
+            return
         try:
             text = event.message.raw_text.strip().lower()
         except Exception as e:
@@ -37,41 +79,44 @@ def register_unified_handler(
 
         # Если текст равен "push", проверяем отправителя
         if text == "push":
-            sender = await event.get_sender()
-            sender_username = "@" + (sender.username.lower() if sender and sender.username else "")
-            logger.info(f"Received push command. Sender username: {sender_username}, expected admin: {settings.ADMIN_USERNAME.lower()}")
-            if sender_username == settings.ADMIN_USERNAME.lower():
+            # авторизация — только по ID или по отправителю из самого события,
+            # не по sender_cache (устаревший/сменившийся username)
+            if settings.ADMIN_USER_ID:
+                sender_username = f"id={event.message.sender_id}"
+                is_admin = event.message.sender_id == settings.ADMIN_USER_ID
+            else:
+                sender = await event.get_sender()
+                if sender is not None:
+                    sender_cache.put(sender)
+                username = getattr(sender, "username", None)
+                sender_username = "@" + (username.lower() if username else "")
+                is_admin = sender_username == settings.ADMIN_USERNAME.lower()
+            logger.info(f"Received push command. Sender: {sender_username}, admin: {is_admin}")
+            if is_admin:
                 logger.info(f"Admin push command triggered by {sender_username}.")
-                # Пример публикации (здесь можно заменить на реальную логику)
-                top_msg = {
-                    "message_id": 9999,
-                    "clown_count": 12,
-                    "chat_id": -10012345678,
-                    "text": "This is the best 🤡 message",
-                }
-                publish_text = (
-                    f"**Top clown-emoji message (24h)**\n\n"
-                    f"Message ID: {top_msg['message_id']}\n"
-                    f"Clown Count: {top_msg['clown_count']}\n"
-                    f"Chat ID: {top_msg['chat_id']}\n"
-                    f"Text: {top_msg['text'] or '(no text)'}"
-                )
-                await event.client.send_message(settings.PUBLISH_CHANNEL, publish_text)
+                emoticon = settings.PUSH_REACTION_EMOTICON
+                top = reaction_aggregator.top_k(emoticon, settings.PUSH_TOP_K)
+                publish_text = format_top_k(emoticon, top, settings.REACTION_WINDOW_HOURS)
+                async with scheduler.slot("post"):
+                    await event.client.send_message(settings.PUBLISH_CHANNEL, publish_text)
                 logger.info("Publication triggered by admin push command.")
                 await event.reply("Publication triggered.")
                 return
 
         # Если не команда push, обрабатываем сообщение стандартным образом
         if state_mgr is not None:
-            state_mgr.record_new_message()
+            state_mgr.record_new_message(event.chat_id)
+            state_mgr.mark_chat_dirty(event.chat_id, event.message.id)
         if not userbot_active.is_set():
             return
         await process_message_event(event, "new_message", message_buffer, chat_id_to_data)
 
     @client.on(events.MessageEdited(chats=target_ids))
     async def on_edited_message(event):
+        if not await accepts(event):
+            return
         if state_mgr is not None:
-            state_mgr.record_new_message()
+            state_mgr.record_new_message(event.chat_id)
         if not userbot_active.is_set():
             return
         await process_message_event(event, "edited_message", message_buffer, chat_id_to_data)
@@ -85,37 +130,57 @@ async def process_message_event(event, event_type, message_buffer, chat_id_to_da
       3) Помещает данные в очередь (для последующей отправки в Kafka),
       4) Выполняет upsert в базу данных.
     """
+    trace = None
+    msg: Message = event.message
     try:
-        msg: Message = event.message
         chat_info = chat_id_to_data.get(msg.chat_id)
         if not chat_info:
-            logger.warning(f"No chat_info for chat_id={msg.chat_id}, skipping.")
+            logger.warning("No chat_info for chat_id=%s, skipping.", msg.chat_id)
             return
 
-        dmin, dmax = get_delay_settings("chat")
-        await human_like_delay(dmin, dmax)
-
-        data = serialize_message(msg, event_type, chat_info)
-        if not data:
+        if settings.DEDUP_ENABLED and dedup_index.is_duplicate(msg):
+            metrics.DEDUP_SUPPRESSED.inc(event_type=event_type)
+            logger.debug("[unified_handler] Duplicate %s msg_id=%s chat_id=%s suppressed", event_type, msg.id, msg.chat_id)
             return
 
-        topic = settings.UBOT_PRODUCE_TOPIC
-        await message_buffer.put((topic, data))
+        trace = tracer.start(event_type, msg)
+
+        dmin, dmax = get_delay_settings("chat")
+        with span(trace, "delay"):
+            await human_like_delay(dmin, dmax)
+
+        # Live-полоса планировщика: вне очереди относительно бэкфилла и gap finder
+        async with scheduler.slot("live"):
+            with span(trace, "serialize"):
+                data = serialize_message(msg, event_type, chat_info)
+            if not data:
+                dedup_index.forget(msg)
+                return
+
+            if settings.MEDIA_ENABLED and data.get("media"):
+                media_downloader.submit(msg)
 
-        if chat_info.get("chat_username"):
-            table_suffix = chat_info["chat_username"].lstrip("@").lower()
-        else:
-            table_suffix = str(msg.chat_id)
-        table_name = "messages_" + table_suffix
+            topic = settings.UBOT_PRODUCE_TOPIC
+            if trace is not None:
+                trace.retain()
+            with span(trace, "enqueue"):
+                await message_buffer.put((topic, data, trace))
 
-        ensure_partitioned_parent_table(table_name)
-        inserted = upsert_partitioned_record(table_name, data)
-        if inserted:
-            logger.info(f"[unified_handler] Inserted new row for msg_id={msg.id} in {table_name}.")
-        else:
-            logger.info(f"[unified_handler] Updated existing row for msg_id={msg.id} in {table_name}.")
+            table_name = message_table_name(chat_info, msg.chat_id)
 
-        logger.info(f"[unified_handler] Processed {event_type} msg_id={msg.id} chat_id={msg.chat_id}")
+            started = time.perf_counter()
+            with span(trace, "db_commit"):
+                ensure_partitioned_parent_table(table_name)
+                ensure_typed_columns(table_name)
+                inserted = upsert_partitioned_record(table_name, data)
+            metrics.DB_UPSERT_SECONDS.observe(time.perf_counter() - started)
+        logger.info(
+            "[unified_handler] Processed %s msg_id=%s chat_id=%s (%s row in %s)",
+            event_type, msg.id, msg.chat_id, "inserted" if inserted else "updated", table_name
+        )
 
     except Exception as e:
-        logger.exception(f"[unified_handler] Error: {e}")
+        dedup_index.forget(msg)
+        logger.exception("[unified_handler] Error: %s", e)
+    finally:
+        tracer.release(trace)
@@ -0,0 +1,229 @@
+# tg_ubot/app/telegram/media.py
+
+"""
+Опциональная загрузка медиа (MEDIA_ENABLED):
+  - описание медиа (тип, mime, размер, путь) попадает в сериализованное сообщение;
+  - ссылки на медиа кладутся в ограниченную очередь, которую разбирает пул воркеров
+    (чанковая загрузка через iter_download), live-обработка при этом никогда не ждёт;
+  - файлы хранятся по идентификатору медиа в Telegram (photo/document id), поэтому
+    пересланные копии одного файла сохраняются один раз;
+  - недокачанные файлы (.part) докачиваются с места остановки, а очередь
+    незавершённых загрузок переживает перезапуск (StateManager).
+"""
+
+import asyncio
+import logging
+import mimetypes
+import os
+
+from telethon.tl.types import (
+    MessageMediaPhoto,
+    MessageMediaDocument,
+    DocumentAttributeFilename,
+    DocumentAttributeVideo,
+    DocumentAttributeAudio,
+    PhotoSize,
+    PhotoSizeProgressive,
+    PhotoCachedSize,
+)
+
+from app import metrics
+from app.config import settings
+from app.utils import ensure_dir
+
+logger = logging.getLogger("media")
+
+# Telegram отдаёт файл кусками, выровненными по 4 КБ
+_ALIGN = 4096
+
+
+def _photo_size_bytes(photo) -> int:
+    size = photo.sizes[-1] if photo.sizes else None
+    if isinstance(size, PhotoSize):
+        return size.size
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes)
+    if isinstance(size, PhotoCachedSize):
+        return len(size.bytes)
+    return 0
+
+
+def describe_media(msg):
+    """
+    Дескриптор медиа сообщения (или None): {type, media_id, mime_type, size, file_name, path}.
+    path заполняется только при включённой загрузке.
+    """
+    media = getattr(msg, "media", None)
+    if isinstance(media, MessageMediaPhoto) and media.photo and hasattr(media.photo, "sizes"):
+        photo = media.photo
+        desc = {
+            "type": "photo",
+            "media_id": photo.id,
+            "mime_type": "image/jpeg",
+            "size": _photo_size_bytes(photo),
+            "file_name": None,
+        }
+    elif isinstance(media, MessageMediaDocument) and media.document and hasattr(media.document, "mime_type"):
+        doc = media.document
+        kind = "document"
+        file_name = None
+        for attr in doc.attributes:
+            if isinstance(attr, DocumentAttributeFilename):
+                file_name = attr.file_name
+            elif isinstance(attr, DocumentAttributeVideo):
+                kind = "video"
+            elif isinstance(attr, DocumentAttributeAudio):
+                kind = "voice" if attr.voice else "audio"
+        desc = {
+            "type": kind,
+            "media_id": doc.id,
+            "mime_type": doc.mime_type,
+            "size": doc.size,
+            "file_name": file_name,
+        }
+    else:
+        return None
+    desc["path"] = media_path(desc) if settings.MEDIA_ENABLED and media_allowed(desc) else None
+    return desc
+
+
+def media_allowed(desc: dict) -> bool:
+    if desc["type"] not in settings.MEDIA_TYPES:
+        return False
+    return not settings.MEDIA_MAX_BYTES or (desc["size"] or 0) <= settings.MEDIA_MAX_BYTES
+
+
+def media_path(desc: dict) -> str:
+    ext = mimetypes.guess_extension(desc["mime_type"] or "") or ""
+    if desc["file_name"] and "." in desc["file_name"]:
+        ext = os.path.splitext(desc["file_name"])[1]
+    key = f"{desc['type']}_{desc['media_id']}"
+    return os.path.join(settings.MEDIA_DIR, str(desc["media_id"])[-2:], key + ext)
+
+
+class MediaDownloader:
+    def __init__(self, workers: int = 2, queue_size: int = 1000, pending_limit: int = 10000):
+        self.workers = workers
+        # потолок media_pending: отложенные при переполненной очереди загрузки не копятся бесконечно
+        self.pending_limit = pending_limit
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.client = None
+        # multi-session: клиент сессии-владельца чата (file_reference/access_hash — свои у каждой сессии)
+        self.client_for_chat = None
+        self.state_mgr = None
+        self.in_progress = set()
+        self._tasks = []
+
+    def submit(self, msg) -> bool:
+        """
+        Неблокирующая постановка в очередь. False, если медиа нет, оно отфильтровано,
+        уже скачано или очередь переполнена (тогда загрузка будет отложена до перезапуска).
+        """
+        if self.client is None:
+            return False
+        desc = describe_media(msg)
+        if desc is None or not desc["path"] or os.path.exists(desc["path"]):
+            return False
+        if desc["path"] in self.in_progress:
+            return False
+        key = (msg.chat_id, msg.id)
+        evicted = self.state_mgr.add_media_pending(key, self.pending_limit)
+        if evicted:
+            metrics.MEDIA_DOWNLOADS.inc(evicted, status="dropped")
+            logger.warning(f"[media] pending downloads over limit {self.pending_limit}, dropped {evicted} oldest")
+        try:
+            self.queue.put_nowait((msg, desc))
+        except asyncio.QueueFull:
+            metrics.MEDIA_DOWNLOADS.inc(status="deferred")
+            logger.warning("[media] download queue full, msg %s deferred", key)
+            return False
+        self.in_progress.add(desc["path"])
+        return True
+
+    async def start(self, client, state_mgr, client_for_chat=None):
+        self.client = client
+        self.client_for_chat = client_for_chat
+        self.state_mgr = state_mgr
+        ensure_dir(settings.MEDIA_DIR)
+        metrics.QUEUE_DEPTH.set_function(self.queue.qsize, queue="media_downloads")
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"media_worker_{i}"))
+        await self._resume_pending()
+
+    async def _resume_pending(self):
+        """
+        Перезапрашивает сообщения незавершённых загрузок (file_reference мог протухнуть).
+        """
+        by_chat = {}
+        for chat_id, message_id in self.state_mgr.get_media_pending():
+            by_chat.setdefault(chat_id, []).append(message_id)
+        for chat_id, ids in by_chat.items():
+            for i in range(0, len(ids), 100):
+                if self.queue.full():
+                    # остальное остаётся в media_pending до следующего перезапуска
+                    logger.warning("[media] download queue full, remaining pending downloads deferred")
+                    break
+                batch = ids[i:i + 100]
+                try:
+                    msgs = await self._client(chat_id).get_messages(chat_id, ids=batch)
+                except Exception as e:
+                    logger.warning(f"[media] could not resume downloads for chat {chat_id}: {e}")
+                    continue
+                for message_id, m in zip(batch, msgs):
+                    if m is None:
+                        # сообщение удалено
+                        self.state_mgr.remove_media_pending((chat_id, message_id))
+                    elif not self.submit(m) and not self.queue.full():
+                        # медиа нет, отфильтровано или уже скачано; при переполненной
+                        # очереди запись остаётся в media_pending
+                        self.state_mgr.remove_media_pending((chat_id, message_id))
+        if by_chat:
+            logger.info(f"[media] resumed {self.queue.qsize()} pending downloads")
+
+    def _client(self, chat_id):
+        if self.client_for_chat is not None:
+            return self.client_for_chat(chat_id)
+        return self.client
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            msg, desc = await self.queue.get()
+            try:
+                await self._download(msg, desc)
+                metrics.MEDIA_DOWNLOADS.inc(status="ok")
+                self.state_mgr.remove_media_pending((msg.chat_id, msg.id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.MEDIA_DOWNLOADS.inc(status="error")
+                logger.exception(f"[media] download failed for msg {msg.id} chat {msg.chat_id}: {e}")
+            finally:
+                self.in_progress.discard(desc["path"])
+                self.queue.task_done()
+
+    async def _download(self, msg, desc):
+        path = desc["path"]
+        if os.path.exists(path):
+            return
+        ensure_dir(os.path.dirname(path))
+        part = path + ".part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        offset -= offset % _ALIGN
+        # качаем тем клиентом, которым получено сообщение: его file_reference действителен именно там
+        client = getattr(msg, "client", None) or self._client(msg.chat_id)
+        with open(part, "ab") as f:
+            f.truncate(offset)
+            async for chunk in client.iter_download(msg.media, offset=offset, file_size=desc["size"] or None):
+                f.write(chunk)
+                metrics.MEDIA_BYTES.inc(len(chunk))
+        os.replace(part, path)
+        logger.debug("[media] stored %s (%s bytes, resumed at %s)", path, desc["size"], offset)
+
+
+media_downloader = MediaDownloader(settings.MEDIA_WORKERS, settings.MEDIA_QUEUE_SIZE, settings.MEDIA_PENDING_LIMIT)
@@ -0,0 +1,138 @@
+# tg_ubot/app/telegram/reactions.py
+
+"""
+Потоковая статистика реакций для команды "push": top-K сообщений по эмодзи
+за скользящее окно без обращения к БД.
+"""
+
+import heapq
+import logging
+import time
+from datetime import datetime
+
+from app.config import settings
+
+logger = logging.getLogger("reactions")
+
+
+class ReactionAggregator:
+    """
+    Сообщения раскладываются по корзинам времени (по дате сообщения), внутри корзины —
+    хеш-индекс (chat_id, message_id) -> последние счётчики реакций. Корзины старше окна
+    выбрасываются, поэтому память ограничена объёмом сообщений за окно.
+    top_k() выбирает лучшие через heapq.nlargest.
+    """
+
+    def __init__(self, window_seconds: float = 86400, bucket_seconds: float = 3600, text_limit: int = 200):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.text_limit = text_limit
+        self.buckets = {}
+        self.locations = {}
+
+    def _bucket_of(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds)
+
+    def _evict(self, now: float):
+        oldest = self._bucket_of(now - self.window_seconds)
+        for idx in [b for b in self.buckets if b < oldest]:
+            for key in self.buckets.pop(idx):
+                self.locations.pop(key, None)
+
+    def _drop(self, key):
+        idx = self.locations.pop(key, None)
+        if idx is not None:
+            self.buckets.get(idx, {}).pop(key, None)
+
+    def feed(self, data: dict, now: float = None):
+        """
+        Учитывает сериализованное сообщение (поле reactions из parse_reactions).
+        """
+        reactions = (data or {}).get("reactions") or {}
+        reaction_types = reactions.get("reaction_types")
+        if reaction_types is None:
+            return
+        if not reaction_types:
+            # все реакции сняты — старые счётчики сообщения из top-K убираются
+            self._drop((data.get("chat_id"), data.get("message_id")))
+            return
+        try:
+            ts = datetime.fromisoformat(data["date"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            return
+        now = time.time() if now is None else now
+        if ts < now - self.window_seconds:
+            return
+
+        key = (data.get("chat_id"), data.get("message_id"))
+        idx = self._bucket_of(ts)
+        prev_idx = self.locations.get(key)
+        if prev_idx is not None and prev_idx != idx:
+            self.buckets.get(prev_idx, {}).pop(key, None)
+        self.buckets.setdefault(idx, {})[key] = {
+            "counts": dict(reaction_types),
+            "ts": ts,
+            "chat_title": data.get("chat_title", ""),
+            "name_uname": data.get("name_uname", ""),
+            "text": (data.get("text_plain") or "")[: self.text_limit],
+        }
+        self.locations[key] = idx
+        self._evict(now)
+
+    def _entries(self, now: float, chat_id=None):
+        since = now - self.window_seconds
+        for bucket in self.buckets.values():
+            for (cid, mid), entry in bucket.items():
+                if entry["ts"] < since or (chat_id is not None and cid != chat_id):
+                    continue
+                yield cid, mid, entry
+
+    def top_k(self, emoticon: str, k: int = 5, chat_id: int = None, now: float = None) -> list:
+        """
+        Top-K сообщений по количеству реакций emoticon за окно (по всем чатам или одному).
+        """
+        now = time.time() if now is None else now
+        self._evict(now)
+        candidates = (
+            (entry["counts"].get(emoticon, 0), cid, mid, entry)
+            for cid, mid, entry in self._entries(now, chat_id)
+            if entry["counts"].get(emoticon, 0) > 0
+        )
+        return [
+            {
+                "chat_id": cid,
+                "message_id": mid,
+                "count": count,
+                "chat_title": entry["chat_title"],
+                "name_uname": entry["name_uname"],
+                "text": entry["text"],
+            }
+            for count, cid, mid, entry in heapq.nlargest(k, candidates, key=lambda c: c[0])
+        ]
+
+    def top_emoticons(self, chat_id: int = None, k: int = 5, now: float = None) -> list:
+        """
+        Самые частые реакции за окно: [(emoticon, total), ...].
+        """
+        now = time.time() if now is None else now
+        totals = {}
+        for _, _, entry in self._entries(now, chat_id):
+            for emoticon, count in entry["counts"].items():
+                totals[emoticon] = totals.get(emoticon, 0) + count
+        return heapq.nlargest(k, totals.items(), key=lambda item: item[1])
+
+
+def format_top_k(emoticon: str, top: list, hours: float) -> str:
+    if not top:
+        return f"No {emoticon} reactions in the last {hours:g}h."
+    lines = [f"**Top {emoticon} messages ({hours:g}h)**", ""]
+    for i, item in enumerate(top, 1):
+        lines.append(
+            f"{i}. {emoticon} {item['count']} — {item['chat_title'] or item['name_uname']} "
+            f"(chat {item['chat_id']}, msg {item['message_id']})\n"
+            f"   {item['text'] or '(no text)'}"
+        )
+    return "\n".join(lines)
+
+
+reaction_aggregator = ReactionAggregator(window_seconds=settings.REACTION_WINDOW_HOURS * 3600)
@@ -0,0 +1,120 @@
+# tg_ubot/app/telegram/sessions.py
+
+"""
+Несколько userbot-сессий в одном процессе: у каждой свой TelegramClient,
+своё пространство состояния (state_<name>.json) и свой учёт FloodWait.
+Чаты распределяются между сессиями консистентным хешированием (среди сессий,
+которым чат виден); при длинном FloodWait сессия временно выводится из
+кольца и её чаты переезжают к соседям. Прогресс по чатам (backfill_from_id,
+missing_ranges) хранится в общем StateManager, поэтому переезд ничего не теряет.
+"""
+
+import bisect
+import hashlib
+import logging
+import time
+
+from app.telegram.state_manager import StateManager
+
+logger = logging.getLogger("sessions")
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    def __init__(self, nodes, replicas: int = 100):
+        self.points = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self.keys = [p[0] for p in self.points]
+
+    def get(self, key, allowed=None):
+        """
+        Первый узел по часовой стрелке от хеша ключа, входящий в allowed (если задан).
+        """
+        if not self.points:
+            return None
+        start = bisect.bisect(self.keys, _hash(str(key)))
+        for i in range(len(self.points)):
+            node = self.points[(start + i) % len(self.points)][1]
+            if allowed is None or node in allowed:
+                return node
+        return None
+
+
+class SessionContext:
+    def __init__(self, name: str, client, state_dir: str = "/app/data"):
+        self.name = name
+        self.client = client
+        self.state_mgr = StateManager(f"{state_dir}/state_{name}.json")
+        self.chat_ids = set()
+
+    @property
+    def blocked_until(self) -> float:
+        return self.state_mgr.state.get("blocked_until", 0)
+
+    def block(self, seconds: float):
+        self.state_mgr.state["blocked_until"] = time.time() + seconds
+        self.state_mgr.state["flood_wait_total"] = self.state_mgr.state.get("flood_wait_total", 0) + seconds
+        self.state_mgr._save_state()
+
+
+class SessionPool:
+    def __init__(self, sessions, rebalance_flood_wait: float = 300):
+        self.sessions = list(sessions)
+        self.by_name = {s.name: s for s in self.sessions}
+        self.ring = HashRing([s.name for s in self.sessions])
+        self.rebalance_flood_wait = rebalance_flood_wait
+        # При координации реплик через Kafka: владеет ли чатом этот процесс
+        self.replica_filter = None
+        # ... и корутина ожидания назначения (True — назначение есть, см. KafkaCoordinator.wait_settled)
+        self.replica_settled = None
+
+    @property
+    def primary(self) -> SessionContext:
+        return self.sessions[0]
+
+    def set_chats(self, name: str, chat_ids):
+        self.by_name[name].chat_ids = set(chat_ids)
+
+    def owner_of(self, chat_id):
+        """
+        Сессия-владелец чата: среди видящих чат и не заблокированных FloodWait.
+        Если заблокированы все, владелец выбирается без учёта блокировок.
+        """
+        visible = {s.name for s in self.sessions if chat_id in s.chat_ids} or set(self.by_name)
+        now = time.time()
+        available = {name for name in visible if self.by_name[name].blocked_until <= now}
+        return self.ring.get(chat_id, available or visible)
+
+    def is_local(self, chat_id) -> bool:
+        return self.replica_filter is None or self.replica_filter(chat_id)
+
+    async def wait_replica(self) -> bool:
+        """
+        Дожидается назначения чатов этой реплике; False — назначения нет (таймаут).
+        """
+        if self.replica_settled is None:
+            return True
+        return await self.replica_settled()
+
+    def owns(self, name: str, chat_id, assume_local: bool = False) -> bool:
+        """
+        assume_local — считать чат принадлежащим реплике (пока назначение не получено).
+        """
+        return (assume_local or self.is_local(chat_id)) and self.owner_of(chat_id) == name
+
+    def client_for(self, chat_id):
+        return self.by_name[self.owner_of(chat_id)].client
+
+    def chats_of(self, name: str) -> set:
+        return self.by_name[name].chat_ids
+
+    def report_flood_wait(self, name: str, seconds: float):
+        """
+        Длинный FloodWait выводит сессию из распределения до его окончания.
+        """
+        if seconds < self.rebalance_flood_wait or len(self.sessions) < 2:
+            return
+        self.by_name[name].block(seconds)
+        logger.warning(f"[SessionPool] session {name} hit FloodWait {seconds}s => its chats are rebalanced")
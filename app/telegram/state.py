@@ -12,12 +12,14 @@ logger = logging.getLogger("state")
 class MessageCounter:
     """
     Простой счётчик обработанных сообщений:
-    каждые threshold отправляет уведомление себе (Saved Messages).
+    каждые threshold отправляет уведомление себе (Saved Messages), если notify_enabled.
+    Для дашбордов используйте /metrics (app.metrics) — уведомления тратят лимиты Telegram.
     """
 
-    def __init__(self, client: TelegramClient, threshold: int = 100):
+    def __init__(self, client: TelegramClient, threshold: int = 100, notify_enabled: bool = True):
         self.client = client
         self.threshold = threshold
+        self.notify_enabled = notify_enabled
         self.count = 0
         self.lock = asyncio.Lock()
         self.state_file = "/app/data/state.json"
@@ -48,7 +50,7 @@ class MessageCounter:
             self.count += 1
             self._save_state()
             logger.debug(f"Processed messages: {self.count}")
-            if self.count % self.threshold == 0:
+            if self.notify_enabled and self.count % self.threshold == 0:
                 await self.notify()
 
     async def notify(self):
@@ -4,6 +4,11 @@ import os
 import json
 import asyncio
 import logging
+from collections import OrderedDict
+
+from app import metrics
+from app.utils import merge_id_ranges
+from app.telegram.activity import ActivityTracker
 
 logger = logging.getLogger("state_manager")
 
@@ -12,13 +17,23 @@ class StateManager:
     Хранит:
       - backfill_from_id для каждого чата
       - missing_ranges
-      - временные метки новых сообщений (для понимания, были ли "свежие" сообщения)
+      - export_last_id: прогресс выгрузки истории (app.export)
+      - media_pending: незавершённые загрузки медиа [chat_id, message_id]
+        (в памяти — упорядоченное множество, на диск — вместе с чекпойнтом last_seen_id)
+      - tombstones: диапазоны ID, которых точно нет в Telegram (удалены / служебные)
+      - скользящее окно активности новых сообщений (для понимания, были ли "свежие" сообщения)
+      - "грязные" чаты (были записи / сдвинулся high-water mark) для gap finder
+      - last_seen_id: последний увиденный live ID чата (чекпойнт high-water mark, для догона после рестарта)
     """
 
     def __init__(self, state_file="/app/data/state.json"):
         self.state_file = state_file
         self.state = self._load_state()
-        self.new_msg_timestamps = []
+        self.activity = ActivityTracker()
+        self.dirty_chats = {}
+        self.high_water_ids = {}
+        self.media_pending = OrderedDict((tuple(key), None) for key in self.state.get("media_pending", []))
+        self.media_pending_changed = False
         self.lock = asyncio.Lock()
 
     def _load_state(self):
@@ -49,6 +64,7 @@ class StateManager:
 
     def update_backfill_from_id(self, chat_id: int, new_val: int):
         self.state[f"chat_{chat_id}_backfill_from_id"] = new_val
+        metrics.BACKFILL_FROM_ID.set(new_val, chat_id=chat_id)
         self._save_state()
 
     # --- missing_ranges ---
@@ -59,18 +75,133 @@ class StateManager:
         self.state[f"chat_{chat_id}_missing_ranges"] = missing_ranges
         self._save_state()
 
+    # --- export checkpoint ---
+    def get_export_last_id(self, chat_id: int) -> int:
+        return self.state.get(f"chat_{chat_id}_export_last_id", 0)
+
+    def update_export_last_id(self, chat_id: int, last_id: int):
+        self.state[f"chat_{chat_id}_export_last_id"] = last_id
+        self._save_state()
+
+    # --- снимок состояния чата (для чекпойнтов в Kafka, app.kafka.coordination) ---
+    def export_chat_state(self, chat_id: int) -> dict:
+        prefix = f"chat_{chat_id}_"
+        return {k[len(prefix):]: v for k, v in self.state.items() if k.startswith(prefix)}
+
+    def import_chat_state(self, chat_id: int, chat_state: dict):
+        """
+        Заменяет состояние чата снимком (например, от реплики, владевшей чатом раньше).
+        """
+        prefix = f"chat_{chat_id}_"
+        for k in [k for k in self.state if k.startswith(prefix)]:
+            del self.state[k]
+        for k, v in chat_state.items():
+            self.state[prefix + k] = v
+        self._save_state()
+
+    # --- media downloads ---
+    def get_media_pending(self) -> list:
+        return list(self.media_pending)
+
+    def add_media_pending(self, key, limit: int = 0) -> int:
+        """
+        Запоминает загрузку без записи на диск. При limit самые старые записи
+        вытесняются; возвращает число вытесненных.
+        """
+        key = tuple(key)
+        if key in self.media_pending:
+            return 0
+        self.media_pending[key] = None
+        self.media_pending_changed = True
+        evicted = 0
+        while limit and len(self.media_pending) > limit:
+            self.media_pending.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def remove_media_pending(self, key):
+        key = tuple(key)
+        if key in self.media_pending:
+            del self.media_pending[key]
+            self.media_pending_changed = True
+
+    # --- tombstones ---
+    def get_tombstones(self, chat_id: int) -> list:
+        return self.state.get(f"chat_{chat_id}_tombstones", [])
+
+    def add_tombstones(self, chat_id: int, ranges: list):
+        """
+        Добавляет диапазоны [start, end] в набор tombstones чата (хранится в сжатом виде).
+        """
+        if not ranges:
+            return
+        current = self.get_tombstones(chat_id)
+        self.state[f"chat_{chat_id}_tombstones"] = merge_id_ranges(current + [list(r) for r in ranges])
+        self._save_state()
+
     # --- new messages count ---
-    def record_new_message(self):
-        now = asyncio.get_event_loop().time()
-        self.new_msg_timestamps.append(now)
+    def record_new_message(self, chat_id: int = None):
+        self.activity.record(chat_id)
 
     def pop_new_messages_count(self, interval: float) -> int:
-        now = asyncio.get_event_loop().time()
-        cutoff = now - interval
-        valid_times = [t for t in self.new_msg_timestamps if t > cutoff]
-        count = len(valid_times)
-        self.new_msg_timestamps = valid_times
-        return count
+        return self.activity.count(interval)
+
+    def get_live_rate(self, interval: float = None, chat_id: int = None) -> float:
+        """
+        Live-сообщений в секунду за последние interval сек. (глобально или по чату).
+        """
+        if chat_id is not None:
+            return self.activity.chat_rate(chat_id, interval)
+        return self.activity.rate(interval)
+
+    # --- dirty chats (для инкрементального поиска дыр) ---
+    def mark_chat_dirty(self, chat_id: int, message_id: int = None):
+        """
+        Отмечает чат как изменившийся с прошлого прохода gap finder.
+        message_id (если передан) двигает high-water mark чата.
+        """
+        if message_id is not None:
+            prev = self.high_water_ids.get(chat_id)
+            if prev is None or message_id > prev:
+                self.high_water_ids[chat_id] = message_id
+        self.dirty_chats[chat_id] = asyncio.get_event_loop().time()
+
+    def get_high_water_id(self, chat_id: int):
+        return self.high_water_ids.get(chat_id)
+
+    # --- last seen (чекпойнт high-water mark) ---
+    def get_last_seen_id(self, chat_id: int):
+        return self.state.get(f"chat_{chat_id}_last_seen_id")
+
+    def checkpoint_last_seen(self) -> int:
+        """
+        Переносит high-water marks в сохраняемое состояние (вызывается периодически
+        и при остановке, а не на каждое сообщение). Возвращает число обновлённых чатов.
+        """
+        updated = 0
+        for chat_id, message_id in self.high_water_ids.items():
+            key = f"chat_{chat_id}_last_seen_id"
+            if message_id > self.state.get(key, 0):
+                self.state[key] = message_id
+                updated += 1
+        media_changed = self.media_pending_changed
+        if media_changed:
+            self.state["media_pending"] = [list(key) for key in self.media_pending]
+            self.media_pending_changed = False
+        if updated or media_changed:
+            self._save_state()
+        return updated
+
+    def pop_dirty_chats(self) -> list:
+        """
+        Возвращает "грязные" чаты (самые свежие по активности — первыми) и очищает набор.
+        """
+        dirty = sorted(self.dirty_chats, key=self.dirty_chats.get, reverse=True)
+        self.dirty_chats = {}
+        return dirty
+
+    def has_dirty_chats(self) -> bool:
+        return bool(self.dirty_chats)
 
     def get_chats_needing_backfill(self):
         """
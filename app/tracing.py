@@ -0,0 +1,142 @@
+# tg_ubot/app/tracing.py
+
+"""
+Лёгкая трассировка пути сообщения: receive -> delay -> serialize -> enqueue ->
+produce_ack / db_commit. Трасса выбирается с вероятностью TRACE_SAMPLE_RATE,
+её контекст уходит в Kafka как заголовок traceparent (W3C), а завершённые
+трассы пишутся JSON-строками в TRACE_FILE.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from app.config import settings
+
+logger = logging.getLogger("tracing")
+
+
+class Trace:
+    __slots__ = ("trace_id", "span_id", "attrs", "origin", "origin_wall", "spans", "refs")
+
+    def __init__(self, attrs: dict):
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attrs = attrs
+        self.origin = time.perf_counter()
+        self.origin_wall = time.time()
+        self.spans = []
+        self.refs = 1
+
+    def add_span(self, name: str, start: float, end: float):
+        self.spans.append({
+            "name": name,
+            "start_ms": round((start - self.origin) * 1000, 3),
+            "duration_ms": round((end - start) * 1000, 3),
+        })
+
+    def retain(self):
+        """
+        Ещё одна ветка конвейера (например, продюсер) завершит трассу через release().
+        """
+        self.refs += 1
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.origin_wall,
+            "total_ms": round((time.perf_counter() - self.origin) * 1000, 3),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+class FileExporter:
+    """
+    Пишет завершённые трассы JSON-строками в файл (буферизация по flush_every).
+    """
+
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self.buffer = []
+
+    def export(self, record: dict):
+        self.buffer.append(json.dumps(record, ensure_ascii=False))
+        if len(self.buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self.buffer) + "\n")
+        except Exception as e:
+            logger.exception(f"Failed to write traces to {self.path}: {e}")
+        self.buffer = []
+
+
+class Tracer:
+    def __init__(self, sample_rate: float, exporter=None):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    def start(self, event_type: str, msg) -> Trace:
+        """
+        Начинает трассу для сообщения (или None, если не попало в выборку).
+        Первый span "receive" — от msg.date (время Telegram) до получения.
+        """
+        if self.sample_rate <= 0 or self.exporter is None or random.random() >= self.sample_rate:
+            return None
+        trace = Trace({
+            "event_type": event_type,
+            "chat_id": getattr(msg, "chat_id", None),
+            "message_id": getattr(msg, "id", None),
+        })
+        msg_date = getattr(msg, "date", None)
+        if msg_date is not None:
+            lag = max(0.0, trace.origin_wall - msg_date.timestamp())
+            trace.add_span("receive", trace.origin - lag, trace.origin)
+        return trace
+
+    def release(self, trace: Trace):
+        if trace is None:
+            return
+        trace.refs -= 1
+        if trace.refs <= 0:
+            self.exporter.export(trace.to_dict())
+
+    def flush(self):
+        if self.exporter is not None:
+            self.exporter.flush()
+
+
+tracer = Tracer(
+    settings.TRACE_SAMPLE_RATE,
+    FileExporter(settings.TRACE_FILE) if settings.TRACE_SAMPLE_RATE > 0 else None
+)
+
+
+@contextmanager
+def span(trace: Trace, name: str):
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, time.perf_counter())
+
+
+def kafka_headers(trace: Trace):
+    """
+    Заголовки Kafka с контекстом трассы (W3C traceparent) или None.
+    """
+    if trace is None:
+        return None
+    return [("traceparent", f"00-{trace.trace_id}-{trace.span_id}-01".encode("ascii"))]
@@ -57,3 +57,54 @@ def get_delay_settings(delay_type: str):
             return (settings.CHANNEL_DELAY_MIN_NIGHT, settings.CHANNEL_DELAY_MAX_NIGHT)
         else:
             return (settings.CHANNEL_DELAY_MIN_DAY, settings.CHANNEL_DELAY_MAX_DAY)
+
+
+def message_table_name(chat_info, chat_id: int) -> str:
+    """
+    Таблица сообщений чата (chat_info — ChatInfo): messages_<username>
+    (без @, в нижнем регистре) или messages_<chat_id>.
+    """
+    if chat_info.chat_username:
+        return "messages_" + chat_info.chat_username.lstrip("@").lower()
+    return "messages_" + str(chat_id)
+
+
+def merge_id_ranges(ranges):
+    """
+    Склеивает пересекающиеся/соседние диапазоны ID [start, end] (включительно).
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def ids_to_ranges(ids):
+    """
+    Превращает набор ID в компактный список диапазонов [start, end].
+    """
+    return merge_id_ranges([i, i] for i in ids)
+
+
+def subtract_id_ranges(ranges, removed):
+    """
+    Вычитает из диапазонов ranges диапазоны removed (оба — списки [start, end]).
+    """
+    removed = merge_id_ranges(removed)
+    result = []
+    for start, end in merge_id_ranges(ranges):
+        cur = start
+        for r_start, r_end in removed:
+            if r_end < cur or r_start > end:
+                continue
+            if r_start > cur:
+                result.append([cur, r_start - 1])
+            cur = r_end + 1
+            if cur > end:
+                break
+        if cur <= end:
+            result.append([cur, end])
+    return result
@@ -1,11 +1,13 @@
 import asyncio
 import logging
+from functools import partial
 
 # BaseWorker из mirco_services_data_management
 from mirco_services_data_management.base_worker import BaseWorker
 
 from app.telegram.backfill import BackfillManager
 from app.telegram.gaps import LocalGapsManager
+from app.telegram.sessions import SessionContext, SessionPool
 
 logger = logging.getLogger("worker")
 
@@ -19,64 +21,154 @@ class TGUBotWorker(BaseWorker):
       - Также запускаются фоновые задачи: backfill и поиск "дыр" (gap finder).
     """
 
-    def __init__(self, config, client, chat_id_to_data, state_mgr, message_callback):
+    def __init__(self, config, client, chat_id_to_data, state_mgr, message_callback, session_pool=None):
         super().__init__(config)
         self.client = client
         self.chat_id_to_data = chat_id_to_data
         self.state_mgr = state_mgr
         self.message_callback = message_callback
+        if session_pool is None:
+            session_pool = SessionPool([SessionContext("main", client)])
+            session_pool.set_chats("main", chat_id_to_data)
+        self.session_pool = session_pool
         self.stop_event = asyncio.Event()
+        # BaseWorker запустил продюсер (или start() завершился) — можно запускать фоновые циклы
+        self.started = asyncio.Event()
+        self.background_tasks = []
         self.enable_kafka_consumer = config.ENABLE_KAFKA_CONSUMER
+        self.gap_dirty_scan_interval = config.GAP_DIRTY_SCAN_INTERVAL
+        self.gap_full_sweep_interval = config.GAP_FULL_SWEEP_INTERVAL
 
-        # Бэкфилл
-        self.backfill_manager = BackfillManager(
-            client=self.client,
-            state_mgr=self.state_mgr,
-            message_callback=self.message_callback,
-            chat_id_to_data=self.chat_id_to_data
-        )
+        # Бэкфилл: по менеджеру на сессию, каждый обслуживает только свои чаты
+        self.backfill_managers = [
+            BackfillManager(
+                client=session.client,
+                state_mgr=self.state_mgr,
+                message_callback=self.message_callback,
+                chat_id_to_data=self.chat_id_to_data,
+                chat_filter=partial(self.session_pool.owns, session.name),
+                on_flood_wait=partial(self.session_pool.report_flood_wait, session.name),
+            )
+            for session in self.session_pool.sessions
+        ]
+        self.backfill_manager = self.backfill_managers[0]
+        self.backfill_by_session = {
+            session.name: manager for session, manager in zip(self.session_pool.sessions, self.backfill_managers)
+        }
         # Локальное сканирование дыр
         self.gaps_manager = LocalGapsManager(
             state_mgr=self.state_mgr,
             client=self.client,
-            chat_id_to_data=self.chat_id_to_data
+            chat_id_to_data=self.chat_id_to_data,
+            client_for_chat=self.session_pool.client_for
         )
 
+    def backfill_manager_for(self, chat_id: int) -> BackfillManager:
+        return self.backfill_by_session[self.session_pool.owner_of(chat_id)]
+
     async def start(self):
         # Всегда запускаем BaseWorker для инициализации продюсера и фоновых задач.
-        await super().start()
+        # BaseWorker.start() может не возвращаться (цикл консьюмера), поэтому
+        # готовность продюсера отслеживается отдельно.
+        watcher = asyncio.create_task(self._watch_producer(), name="worker_producer_watch")
+        try:
+            await super().start()
+        finally:
+            watcher.cancel()
+            self.started.set()
         if not self.enable_kafka_consumer:
             logger.info("Kafka consumer disabled by configuration. Incoming messages will be ignored.")
 
+    async def _watch_producer(self, interval: float = 0.05):
+        while getattr(self, "producer", None) is None:
+            await asyncio.sleep(interval)
+        self.started.set()
+        logger.debug("[TGUBotWorker] BaseWorker producer started.")
+
+    async def wait_started(self, start_task: asyncio.Task):
+        """
+        Ждёт self.started; если start() упал раньше, поднимает его исключение.
+        """
+        ready = asyncio.create_task(self.started.wait())
+        try:
+            await asyncio.wait({ready, start_task}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            ready.cancel()
+        if start_task.done() and not start_task.cancelled() and start_task.exception() is not None:
+            raise start_task.exception()
+
     async def _after_baseworker_started(self):
         # После старта Kafka-процессов запускаем задачи бэкфилла и локального gap-сканирования
-        asyncio.create_task(self._backfill_loop(), name="backfill_loop")
-        asyncio.create_task(self._gap_finder_loop(), name="gap_finder_loop")
+        self.background_tasks = [
+            asyncio.create_task(self._backfill_loop(), name="backfill_loop"),
+            asyncio.create_task(self._gap_finder_loop(), name="gap_finder_loop"),
+        ]
 
     async def _backfill_loop(self):
-        logger.info("[TGUBotWorker] backfill_manager started.")
-        await self.backfill_manager.run()
+        logger.info(f"[TGUBotWorker] backfill_manager started ({len(self.backfill_managers)} sessions).")
+        await asyncio.gather(*(manager.run() for manager in self.backfill_managers))
         logger.info("[TGUBotWorker] backfill_manager stopped.")
 
     async def _gap_finder_loop(self):
         """
-        Периодически (примерно раз в 30 мин) вызывает LocalGapsManager, чтобы искать пропуски.
+        Поиск пропусков через LocalGapsManager:
+          - раз в gap_dirty_scan_interval сек. пересканируются только "грязные" чаты
+            (были записи или сдвинулся high-water mark), самые активные — первыми;
+          - раз в gap_full_sweep_interval сек. — полный проход по всем чатам (страховка),
+            в котором "грязные" чаты по-прежнему обрабатываются вне очереди.
         """
         logger.info("[TGUBotWorker] local gap_finder started.")
+        loop = asyncio.get_running_loop()
+        next_full_sweep = loop.time()
         try:
             while not self.stop_event.is_set():
-                for chat_id in self.chat_id_to_data:
-                    await self.gaps_manager.find_and_fill_gaps_for_chat(chat_id)
-                await asyncio.sleep(1800)
+                # чекпойнт last_seen_id для догона после рестарта
+                self.state_mgr.checkpoint_last_seen()
+                await self._scan_dirty_chats()
+                if loop.time() >= next_full_sweep:
+                    await self._full_gap_sweep()
+                    next_full_sweep = loop.time() + self.gap_full_sweep_interval
+                try:
+                    await asyncio.wait_for(self.stop_event.wait(), self.gap_dirty_scan_interval)
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             logger.info("[TGUBotWorker] local gap_finder cancelled.")
         except Exception as e:
             logger.exception(f"[TGUBotWorker] local gap_finder error: {e}")
 
+    async def _scan_dirty_chats(self) -> set:
+        scanned = set()
+        for chat_id in self.state_mgr.pop_dirty_chats():
+            if self.stop_event.is_set():
+                break
+            if chat_id not in self.chat_id_to_data or not self.session_pool.is_local(chat_id):
+                continue
+            await self.gaps_manager.find_and_fill_gaps_for_chat(chat_id)
+            scanned.add(chat_id)
+        if scanned:
+            logger.debug(f"[TGUBotWorker] gap scan for dirty chats: {len(scanned)}")
+        return scanned
+
+    async def _full_gap_sweep(self):
+        logger.info(f"[TGUBotWorker] full gap sweep over {len(self.chat_id_to_data)} chats.")
+        done = set()
+        for chat_id in list(self.chat_id_to_data):
+            if self.stop_event.is_set():
+                break
+            # Полный проход низкоприоритетный: активные чаты обслуживаются первыми
+            if self.state_mgr.has_dirty_chats():
+                done |= await self._scan_dirty_chats()
+            if chat_id in done or not self.session_pool.is_local(chat_id):
+                continue
+            await self.gaps_manager.find_and_fill_gaps_for_chat(chat_id)
+            done.add(chat_id)
+
     async def shutdown(self):
         logger.info("[TGUBotWorker] shutdown() called.")
         self.stop_event.set()
-        self.backfill_manager.stop()
+        for manager in self.backfill_managers:
+            manager.stop()
         await super().shutdown()
 
     async def handle_message(self, message: dict):
@@ -97,4 +189,7 @@ class TGUBotWorker(BaseWorker):
 
     def stop(self):
         self.stop_event.set()
+        # бэкфилл останавливается на границе страницы, прогресс уже сохранён
+        for manager in self.backfill_managers:
+            manager.stop()
         super().stop()
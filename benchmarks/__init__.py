@@ -0,0 +1,5 @@
+# tg_ubot/benchmarks/__init__.py
+
+"""
+Офлайн-бенчмарки tg_ubot (фейковый Telegram, Kafka и БД в памяти).
+"""
@@ -0,0 +1,437 @@
+# tg_ubot/benchmarks/fakes.py
+
+"""
+Детерминированные фейки для офлайн-бенчмарков:
+  - FakeTelegramClient: синтетическая история чатов (сущности, реакции, удалённые ID,
+    FloodWait с заданной вероятностью) с интерфейсом get_messages / iter_messages;
+  - InMemoryKafkaProducer: заменитель AIOKafkaProducer;
+  - FakeDB + install_fake_services(): in-process замена mirco_services_data_management.
+
+install_fake_services() нужно вызывать до импорта модулей app.*.
+"""
+
+import asyncio
+import bisect
+import os
+import random
+import re
+import sys
+import time
+import types
+from datetime import datetime, timedelta, timezone
+
+from psycopg2 import sql as pg_sql
+from telethon import errors
+from telethon.tl.custom.message import Message
+from telethon.tl.types import (
+    MessageEntityUrl,
+    MessageEntityTextUrl,
+    MessageEntityBold,
+    MessageReactions,
+    ReactionCount,
+    ReactionEmoji,
+    PeerChannel,
+    PeerUser,
+    User,
+    MessageMediaPhoto,
+    Photo,
+    PhotoSize,
+)
+
+EMOTICONS = ("👍", "❤", "🔥", "🤡", "😁", "👎")
+WORDS = ("alpha", "beta", "gamma", "delta", "omega", "tg", "ubot", "kafka", "backfill", "gap")
+
+
+class FakeTelegramClient:
+    """
+    История каждого чата: ID 1..messages_per_chat, часть ID "удалена" (deleted_ratio),
+    сообщения идут с шагом message_interval сек. до момента now.
+    """
+
+    def __init__(
+        self,
+        chat_ids,
+        messages_per_chat=10000,
+        deleted_ratio=0.05,
+        flood_rate=0.0,
+        flood_seconds=1,
+        rpc_latency=0.0,
+        message_interval=60.0,
+        seed=42,
+        now=None,
+    ):
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.rpc_latency = rpc_latency
+        self.message_interval = message_interval
+        self.now = now or datetime.now(timezone.utc)
+        self.history = {}
+        for chat_id in chat_ids:
+            self.history[chat_id] = [
+                mid for mid in range(1, messages_per_chat + 1)
+                if mid == messages_per_chat or self.rng.random() >= deleted_ratio
+            ]
+        self.last_id = messages_per_chat
+        self.users = [
+            User(id=1000 + i, username=f"user{i}", first_name=f"First{i}", last_name=f"Last{i}")
+            for i in range(50)
+        ]
+        self.stats = {"requests": 0, "flood_waits": 0, "messages_returned": 0}
+        self.sent = []
+
+    # --- синтетические сообщения ---
+    def _date_for(self, msg_id: int):
+        return self.now - timedelta(seconds=(self.last_id - msg_id) * self.message_interval)
+
+    def build_message(self, chat_id: int, msg_id: int, edit_date=None, with_photo=False) -> Message:
+        rng = random.Random(self.seed * 1_000_003 + abs(chat_id) * 7919 + msg_id)
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 40))]
+        text = " ".join(words)
+        entities = []
+        if rng.random() < 0.3:
+            url = f"https://example.com/{msg_id}"
+            text += " " + url
+            entities.append(MessageEntityUrl(offset=len(text) - len(url), length=len(url)))
+        if rng.random() < 0.2:
+            entities.append(MessageEntityTextUrl(offset=0, length=len(words[0]), url="https://t.me/x"))
+        if rng.random() < 0.2 and len(words) > 1:
+            entities.append(MessageEntityBold(offset=len(words[0]) + 1, length=len(words[1])))
+        reactions = None
+        if rng.random() < 0.5:
+            reactions = MessageReactions(results=[
+                ReactionCount(reaction=ReactionEmoji(emoticon=e), count=rng.randint(1, 500))
+                for e in rng.sample(EMOTICONS, rng.randint(1, 3))
+            ])
+        sender = rng.choice(self.users)
+        m = Message(
+            id=msg_id,
+            peer_id=PeerChannel(int(str(chat_id)[4:]) if str(chat_id).startswith("-100") else abs(chat_id)),
+            date=self._date_for(msg_id),
+            message=text,
+            from_id=PeerUser(sender.id),
+            entities=entities or None,
+            reactions=reactions,
+            edit_date=edit_date,
+            media=self._photo(msg_id) if with_photo else None,
+        )
+        m._sender = sender
+        return m
+
+    def _photo(self, msg_id: int) -> MessageMediaPhoto:
+        photo = Photo(
+            id=msg_id, access_hash=0, file_reference=b"", date=self._date_for(msg_id),
+            sizes=[PhotoSize(type="x", w=1280, h=720, size=50_000 + msg_id)], dc_id=2,
+        )
+        return MessageMediaPhoto(photo=photo)
+
+    # --- Telethon-подобный API ---
+    async def _rpc(self):
+        self.stats["requests"] += 1
+        if self.rpc_latency:
+            await asyncio.sleep(self.rpc_latency)
+        if self.flood_rate and self.rng.random() < self.flood_rate:
+            self.stats["flood_waits"] += 1
+            raise errors.FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def get_messages(self, entity=None, limit=None, offset_id=0, min_id=0, max_id=0,
+                           offset_date=None, reverse=False, ids=None, **kwargs):
+        chat_id = entity
+        await self._rpc()
+        history = self.history.get(chat_id, [])
+        if ids is not None:
+            single = isinstance(ids, int)
+            id_list = [ids] if single else list(ids)
+            result = []
+            for mid in id_list:
+                pos = bisect.bisect_left(history, mid)
+                exists = pos < len(history) and history[pos] == mid
+                result.append(self.build_message(chat_id, mid) if exists else None)
+            self.stats["messages_returned"] += sum(1 for m in result if m is not None)
+            return result[0] if single else result
+
+        limit = 1 if limit is None else limit
+        if reverse:
+            lo = max(offset_id, min_id)
+            if offset_date is not None and not offset_id:
+                lo = max(lo, self._id_at_or_before(history, offset_date))
+            start = bisect.bisect_right(history, lo)
+            selected = [mid for mid in history[start:start + limit] if not max_id or mid < max_id]
+        else:
+            hi = offset_id or (max_id or self.last_id + 1)
+            if offset_date is not None and not offset_id:
+                hi = self._id_at_or_before(history, offset_date - timedelta(microseconds=1)) + 1
+            end = bisect.bisect_left(history, hi)
+            selected = [mid for mid in reversed(history[max(0, end - limit):end]) if mid > min_id]
+        self.stats["messages_returned"] += len(selected)
+        return [self.build_message(chat_id, mid) for mid in selected]
+
+    def _id_at_or_before(self, history, date) -> int:
+        """
+        ID самого нового сообщения с датой <= date (0, если таких нет).
+        """
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=timezone.utc)
+        seconds_back = (self.now - date).total_seconds()
+        boundary = self.last_id - int(seconds_back // self.message_interval) if seconds_back > 0 else self.last_id
+        pos = bisect.bisect_right(history, boundary)
+        return history[pos - 1] if pos else 0
+
+    async def iter_messages(self, entity, limit=None, reverse=False, min_id=0, offset_date=None,
+                            wait_time=None, **kwargs):
+        offset_id = min_id if reverse else 0
+        returned = 0
+        first = True
+        while limit is None or returned < limit:
+            page = await self.get_messages(
+                entity,
+                limit=100,
+                offset_id=offset_id,
+                offset_date=offset_date if first else None,
+                reverse=reverse,
+            )
+            first = False
+            if not page:
+                return
+            for m in page:
+                yield m
+                returned += 1
+            offset_id = page[-1].id
+            if wait_time:
+                await asyncio.sleep(wait_time)
+
+    async def get_entity(self, entity):
+        return entity
+
+    async def send_message(self, entity, text):
+        self.sent.append((entity, text))
+
+    async def is_user_authorized(self):
+        return True
+
+
+class FakeEvent:
+    """
+    Минимальная замена telethon.events.NewMessage.Event / MessageEdited.Event.
+    """
+
+    def __init__(self, message: Message, client=None):
+        self.message = message
+        self.chat_id = message.chat_id
+        self.client = client
+
+    async def get_sender(self):
+        return self.message.sender
+
+
+class InMemoryKafkaProducer:
+    """
+    Заменитель AIOKafkaProducer: хранит отправленные записи по топикам.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, seed=7):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.topics = {}
+        self.sent_bytes = 0
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def send(self, topic, value=None, key=None, headers=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.rng.random() < self.error_rate:
+            raise RuntimeError("fake kafka produce error")
+        self.topics.setdefault(topic, []).append((key, value, headers))
+        fut = asyncio.get_running_loop().create_future()
+        fut.set_result(None)
+        return fut
+
+    async def send_and_wait(self, topic, value=None, key=None, headers=None, **kwargs):
+        fut = await self.send(topic, value, key=key, headers=headers, **kwargs)
+        return await fut
+
+    def count(self, topic=None) -> int:
+        if topic is not None:
+            return len(self.topics.get(topic, []))
+        return sum(len(v) for v in self.topics.values())
+
+
+def _render(query) -> str:
+    """
+    psycopg2.sql.Composable -> строка без соединения (для сопоставления запросов в фейке).
+    """
+    if isinstance(query, str):
+        return query
+    if isinstance(query, pg_sql.Composed):
+        return "".join(_render(part) for part in query.seq)
+    if isinstance(query, pg_sql.Identifier):
+        return ".".join(query.strings)
+    if isinstance(query, pg_sql.SQL):
+        return query.string
+    return repr(query.wrapped)
+
+
+class _FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        sql = _render(sql)
+        if self.db.query_latency:
+            time.sleep(self.db.query_latency)
+        if "SELECT a.attname" in sql:
+            self.rows = [("data",), ("tg_chat_id",), ("tg_message_id",)]
+            return
+        if "pg_class" in sql:
+            self.rows = [(name, True) for name in sorted(self.db.tables)]
+            return
+        match = re.search(r"FROM\s+\w+\.(\w+)", sql)
+        table = self.db.tables.get(match.group(1), {}) if match else {}
+        chat_id = params[0] if params else None
+        self.rows = [{"msgid": mid} for (cid, mid) in table if cid == chat_id]
+
+    def fetchall(self):
+        return self.rows
+
+
+class _FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, cursor_factory=None):
+        return _FakeCursor(self.db)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    """
+    Таблицы messages_* в памяти: {table: {(chat_id, message_id): data}}.
+    """
+
+    def __init__(self, upsert_latency=0.0, query_latency=0.0):
+        self.upsert_latency = upsert_latency
+        self.query_latency = query_latency
+        self.tables = {}
+        self.upserts = 0
+
+    def ensure_partitioned_parent_table(self, table_name):
+        self.tables.setdefault(table_name, {})
+
+    def upsert_partitioned_record(self, table_name, data):
+        if self.upsert_latency:
+            time.sleep(self.upsert_latency)
+        self.upserts += 1
+        table = self.tables.setdefault(table_name, {})
+        key = (data.get("chat_id"), data.get("message_id"))
+        inserted = key not in table
+        table[key] = data
+        return inserted
+
+    def get_connection(self):
+        return _FakeConnection(self)
+
+
+class _FakeBaseWorker:
+    def __init__(self, config):
+        self.config = config
+        self.producer = None
+
+    async def start(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class _FakeBaseConfig:
+    KAFKA_BROKER = "kafka:9092"
+
+
+BENCH_ENV = {
+    "TELEGRAM_API_ID": "1",
+    "TELEGRAM_API_HASH": "bench",
+    "PUBLISH_CHANNEL": "@bench",
+    "ADMIN_USERNAME": "@admin",
+    "METRICS_ENABLED": "false",
+    "CHAT_DELAY_MIN_DAY": "0",
+    "CHAT_DELAY_MAX_DAY": "0",
+    "CHAT_DELAY_MIN_NIGHT": "0",
+    "CHAT_DELAY_MAX_NIGHT": "0",
+    "CHANNEL_DELAY_MIN_DAY": "0",
+    "CHANNEL_DELAY_MAX_DAY": "0",
+    "CHANNEL_DELAY_MIN_NIGHT": "0",
+    "CHANNEL_DELAY_MAX_NIGHT": "0",
+    "LOOP_LAG_MONITOR_ENABLED": "false",
+    "SENDER_CACHE_PATH": "",
+}
+
+
+def install_fake_services(db: FakeDB = None) -> FakeDB:
+    """
+    Регистрирует in-process mirco_services_data_management (db, config, base_worker,
+    kafka_io) в sys.modules и выставляет окружение без задержек "human-like".
+    """
+    db = db or FakeDB()
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+
+    pkg = types.ModuleType("mirco_services_data_management")
+    pkg.__path__ = []
+
+    db_mod = types.ModuleType("mirco_services_data_management.db")
+    db_mod.get_connection = lambda: db.get_connection()
+    db_mod.ensure_partitioned_parent_table = lambda name: db.ensure_partitioned_parent_table(name)
+    db_mod.upsert_partitioned_record = lambda name, data: db.upsert_partitioned_record(name, data)
+
+    config_mod = types.ModuleType("mirco_services_data_management.config")
+    config_mod.BaseConfig = _FakeBaseConfig
+
+    worker_mod = types.ModuleType("mirco_services_data_management.base_worker")
+    worker_mod.BaseWorker = _FakeBaseWorker
+
+    kafka_mod = types.ModuleType("mirco_services_data_management.kafka_io")
+
+    async def send_message(producer, topic, data):
+        await producer.send_and_wait(topic, data)
+
+    kafka_mod.send_message = send_message
+
+    for name, mod in (
+        ("mirco_services_data_management", pkg),
+        ("mirco_services_data_management.db", db_mod),
+        ("mirco_services_data_management.config", config_mod),
+        ("mirco_services_data_management.base_worker", worker_mod),
+        ("mirco_services_data_management.kafka_io", kafka_mod),
+    ):
+        sys.modules[name] = mod
+        if name != "mirco_services_data_management":
+            setattr(pkg, name.rsplit(".", 1)[1], mod)
+    return db
@@ -0,0 +1,555 @@
+# tg_ubot/benchmarks/run.py
+
+"""
+Офлайн-бенчмарки путей live / backfill / gaps / catchup, serialize_message и
+дельта-кодирования правок (delta: неизменённые правки подавляются, правки только медиа — нет);
+mixed — live-поток на фоне бэкфилла (задержки live при конкуренции за слоты планировщика);
+db_sink — построчный upsert против COPY-синка в реальный Postgres (нужен --pg-dsn);
+chats — память справочника чатов (ChatDirectory против словарей) на --chats диалогов.
+
+    python -m benchmarks.run --messages 5000 --output bench.json
+    python -m benchmarks.run --scenario backfill --flood-rate 0.02
+
+Результат — JSON (msgs/sec, перцентили задержек, пик памяти по tracemalloc),
+пригодный для отслеживания трендов между коммитами.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.fakes import FakeDB, FakeEvent, FakeTelegramClient, InMemoryKafkaProducer, install_fake_services
+
+FAKE_DB = install_fake_services()
+
+from app.config import settings  # noqa: E402
+from app.process_messages import serialize_message  # noqa: E402
+from app.telegram.backfill import BackfillManager  # noqa: E402
+from app.telegram.catchup import CatchUpManager  # noqa: E402
+from app.telegram.chat_info import ChatDirectory, ChatInfo  # noqa: E402
+from app.telegram.dedup import dedup_index  # noqa: E402
+from app.telegram.delta import DELTA_EVENT_TYPE, DeltaEncoder  # noqa: E402
+from app.telegram.gaps import LocalGapsManager  # noqa: E402
+from app.telegram.handlers import process_message_event  # noqa: E402
+from app.telegram.sessions import SessionContext, SessionPool  # noqa: E402
+from app.telegram.state_manager import StateManager  # noqa: E402
+
+CHAT_ID = -1001000000001
+
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 4)
+
+    return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 4)}
+
+
+def chat_map():
+    return ChatDirectory([
+        ChatInfo(
+            target_id=CHAT_ID,
+            chat_title="Bench channel",
+            chat_username="bench_channel",
+            name_uname="@bench_channel",
+            entity_type="ChannelOrSupergroup",
+        )
+    ])
+
+
+def make_client(args, messages=None):
+    return FakeTelegramClient(
+        [CHAT_ID],
+        messages_per_chat=messages or args.messages,
+        deleted_ratio=args.deleted_ratio,
+        flood_rate=args.flood_rate,
+        flood_seconds=0,
+        rpc_latency=args.rpc_latency,
+        seed=args.seed,
+    )
+
+
+def make_state(tmp_dir: str, name: str) -> StateManager:
+    return StateManager(os.path.join(tmp_dir, f"{name}_state.json"))
+
+
+def result(n, seconds, latencies=None, **extra) -> dict:
+    out = {
+        "messages": n,
+        "seconds": round(seconds, 4),
+        "msgs_per_sec": round(n / seconds, 2) if seconds > 0 else None,
+    }
+    if latencies is not None:
+        out["latency_ms"] = percentiles(latencies)
+    out.update(extra)
+    return out
+
+
+async def bench_serialize(args, tmp_dir):
+    client = make_client(args)
+    msgs = [client.build_message(CHAT_ID, mid) for mid in client.history[CHAT_ID][: args.messages]]
+    info = chat_map()[CHAT_ID]
+    latencies = []
+    started = time.perf_counter()
+    for m in msgs:
+        t0 = time.perf_counter()
+        serialize_message(m, "new_message", info)
+        latencies.append(time.perf_counter() - t0)
+    return result(len(msgs), time.perf_counter() - started, latencies)
+
+
+async def bench_delta(args, tmp_dir):
+    """
+    Каждое сообщение отправляется и затем правится: нечётные правки ничего не меняют
+    (должны подавляться), чётные только добавляют фото (должны уйти дельтой).
+    """
+    client = make_client(args)
+    ids = client.history[CHAT_ID][: args.messages]
+    info = chat_map()[CHAT_ID]
+    encoder = DeltaEncoder(max_entries=len(ids) + 1)
+    for mid in ids:
+        _payload, commit = encoder.encode(serialize_message(client.build_message(CHAT_ID, mid), "new_message", info))
+        commit()
+
+    latencies = []
+    suppressed = media_edits = media_delivered = 0
+    started = time.perf_counter()
+    for i, mid in enumerate(ids):
+        media_only = i % 2 == 0
+        msg = client.build_message(CHAT_ID, mid, edit_date=client.now, with_photo=media_only)
+        t0 = time.perf_counter()
+        payload, commit = encoder.encode(serialize_message(msg, "edited_message", info))
+        latencies.append(time.perf_counter() - t0)
+        if payload is None:
+            suppressed += 1
+            continue
+        commit()
+        if media_only:
+            media_edits += 1
+            if payload.get("event_type") != DELTA_EVENT_TYPE or "media" in payload.get("changed", {}):
+                media_delivered += 1
+    return result(
+        len(ids), time.perf_counter() - started, latencies,
+        suppressed=suppressed,
+        media_only_edits=(len(ids) + 1) // 2,
+        media_only_produced=media_edits,
+        media_only_delivered=media_delivered,
+    )
+
+
+async def bench_live(args, tmp_dir):
+    client = make_client(args)
+    producer = InMemoryKafkaProducer(latency=args.kafka_latency)
+    FAKE_DB.upsert_latency = args.db_latency
+    queue = asyncio.Queue()
+    chats = chat_map()
+
+    async def drain():
+        while True:
+            topic, data, _trace = await queue.get()
+            await producer.send_and_wait(topic, data)
+            queue.task_done()
+
+    drain_task = asyncio.create_task(drain())
+    events = [FakeEvent(client.build_message(CHAT_ID, mid), client) for mid in client.history[CHAT_ID][: args.messages]]
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def handle(event):
+        async with sem:
+            t0 = time.perf_counter()
+            await process_message_event(event, "new_message", queue, chats)
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(e) for e in events))
+    await queue.join()
+    elapsed = time.perf_counter() - started
+    drain_task.cancel()
+    return result(len(events), elapsed, latencies, produced=producer.count(), db_upserts=FAKE_DB.upserts)
+
+
+async def bench_backfill(args, tmp_dir):
+    client = make_client(args)
+    producer = InMemoryKafkaProducer(latency=args.kafka_latency)
+    state_mgr = make_state(tmp_dir, "backfill")
+
+    async def callback(data, trace=None):
+        await producer.send_and_wait(settings.UBOT_PRODUCE_TOPIC, data)
+
+    manager = BackfillManager(
+        client=client,
+        state_mgr=state_mgr,
+        message_callback=callback,
+        chat_id_to_data=chat_map(),
+        idle_timeout=0,
+        flood_wait_delay=0,
+        max_total_wait=0,
+    )
+    state_mgr.update_backfill_from_id(CHAT_ID, client.last_id + 1)
+    manager._start_pass()
+    page_latencies = []
+    started = time.perf_counter()
+    while (state_mgr.get_backfill_from_id(CHAT_ID) or 1) > 1:
+        t0 = time.perf_counter()
+        await manager._do_chat_backfill(CHAT_ID)
+        page_latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return result(
+        producer.count(), elapsed, page_latencies,
+        pages=len(page_latencies), rpc=dict(client.stats)
+    )
+
+
+async def bench_gaps(args, tmp_dir):
+    client = make_client(args)
+    producer = InMemoryKafkaProducer(latency=args.kafka_latency)
+    state_mgr = make_state(tmp_dir, "gaps")
+    table = "messages_bench_channel"
+    # В БД лежит каждое сообщение, кроме каждого gap_every-го: часть дыр — реальные
+    # пропуски, часть — удалённые в Telegram ID (deleted_ratio в фейковом клиенте).
+    FAKE_DB.tables[table] = {
+        (CHAT_ID, mid): {"chat_id": CHAT_ID, "message_id": mid}
+        for mid in range(1, client.last_id + 1)
+        if mid % args.gap_every
+    }
+
+    async def callback(data, trace=None):
+        await producer.send_and_wait(settings.UBOT_PRODUCE_TOPIC, data)
+
+    gaps = LocalGapsManager(state_mgr=state_mgr, client=client, chat_id_to_data=chat_map(),
+                            verify_max_ids=args.messages)
+    backfill = BackfillManager(
+        client=client,
+        state_mgr=state_mgr,
+        message_callback=callback,
+        chat_id_to_data=chat_map(),
+        idle_timeout=0,
+        flood_wait_delay=0,
+        max_total_wait=0,
+    )
+    started = time.perf_counter()
+    await gaps.find_and_fill_gaps_for_chat(CHAT_ID)
+    scan_seconds = time.perf_counter() - started
+    ranges = state_mgr.get_missing_ranges(CHAT_ID)
+    backfill._start_pass()
+    await backfill._fill_missing_ranges(CHAT_ID)
+    elapsed = time.perf_counter() - started
+    return result(
+        producer.count(), elapsed, None,
+        scan_seconds=round(scan_seconds, 4),
+        scanned_ids=client.last_id,
+        missing_ranges=len(ranges),
+        missing_ids=sum(end - start + 1 for start, end in ranges),
+        tombstone_ranges=len(state_mgr.get_tombstones(CHAT_ID)),
+        remaining_ranges=len(state_mgr.get_missing_ranges(CHAT_ID)),
+        rpc=dict(client.stats),
+    )
+
+
+async def bench_mixed(args, tmp_dir):
+    """
+    Live-события обрабатываются, пока в фоне идёт бэкфилл того же клиента.
+    Сравнивать latency_ms с --scenario live: live-полоса не должна ждать бэкфилл.
+    """
+    client = make_client(args)
+    producer = InMemoryKafkaProducer(latency=args.kafka_latency)
+    FAKE_DB.upsert_latency = args.db_latency
+    state_mgr = make_state(tmp_dir, "mixed")
+    queue = asyncio.Queue()
+    chats = chat_map()
+    backfilled = []
+
+    async def drain():
+        while True:
+            topic, data, _trace = await queue.get()
+            await producer.send_and_wait(topic, data)
+            queue.task_done()
+
+    async def backfill_callback(data, trace=None):
+        backfilled.append(data["message_id"])
+
+    backfill = BackfillManager(
+        client=client,
+        state_mgr=state_mgr,
+        message_callback=backfill_callback,
+        chat_id_to_data=chats,
+        live_rate_limit=0,
+        flood_wait_delay=0,
+        max_total_wait=0,
+    )
+    state_mgr.update_backfill_from_id(CHAT_ID, client.last_id + 1)
+    backfill._start_pass()
+
+    async def backfill_loop():
+        while (state_mgr.get_backfill_from_id(CHAT_ID) or 1) > 1:
+            await backfill._do_chat_backfill(CHAT_ID)
+
+    drain_task = asyncio.create_task(drain())
+    backfill_task = asyncio.create_task(backfill_loop())
+    # live-сообщения — "новые", с ID выше истории, чтобы не пересекаться с бэкфиллом
+    events = [
+        FakeEvent(client.build_message(CHAT_ID, client.last_id + i), client)
+        for i in range(1, args.messages // 2 + 1)
+    ]
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def handle(event):
+        async with sem:
+            t0 = time.perf_counter()
+            await process_message_event(event, "new_message", queue, chats)
+            latencies.append(time.perf_counter() - t0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handle(e) for e in events))
+    await queue.join()
+    elapsed = time.perf_counter() - started
+    backfilled_during_live = len(backfilled)
+    backfill.stop()
+    backfill_task.cancel()
+    drain_task.cancel()
+    await asyncio.gather(backfill_task, drain_task, return_exceptions=True)
+    return result(
+        len(events), elapsed, latencies,
+        backfilled_during_live=backfilled_during_live,
+        rpc=dict(client.stats),
+    )
+
+
+async def bench_catchup(args, tmp_dir):
+    """
+    Догон после простоя: last_seen_id отстаёт на outage-ratio истории чата.
+    """
+    client = make_client(args)
+    producer = InMemoryKafkaProducer(latency=args.kafka_latency)
+    state_mgr = make_state(tmp_dir, "catchup")
+    last_seen = client.last_id - max(1, int(client.last_id * args.outage_ratio))
+    state_mgr.state[f"chat_{CHAT_ID}_last_seen_id"] = last_seen
+
+    async def callback(data, trace=None):
+        await producer.send_and_wait(settings.UBOT_PRODUCE_TOPIC, data)
+
+    session = SessionContext("bench", client, state_dir=tmp_dir)
+    pool = SessionPool([session])
+    pool.set_chats("bench", [CHAT_ID])
+    backfill = BackfillManager(
+        client=client,
+        state_mgr=state_mgr,
+        message_callback=callback,
+        chat_id_to_data=chat_map(),
+    )
+    catchup = CatchUpManager(pool, state_mgr, lambda chat_id: backfill, rate=1000, max_messages=args.messages)
+    started = time.perf_counter()
+    report = await catchup.run({CHAT_ID: client.last_id})
+    elapsed = time.perf_counter() - started
+    return result(
+        producer.count(), elapsed, None,
+        outage_ids=client.last_id - last_seen,
+        last_seen_after=state_mgr.get_last_seen_id(CHAT_ID),
+        timed_out=report.get("timed_out", 0),
+        rpc=dict(client.stats),
+    )
+
+
+BENCH_SCHEMA = "tg_ubot_bench"
+
+
+def _pg_setup(conn, table: str):
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE SCHEMA IF NOT EXISTS {BENCH_SCHEMA}")
+        cur.execute(f"DROP TABLE IF EXISTS {BENCH_SCHEMA}.{table} CASCADE")
+        cur.execute(
+            f"CREATE TABLE {BENCH_SCHEMA}.{table} ("
+            f"chat_id bigint NOT NULL, message_id bigint NOT NULL, month_part text NOT NULL, data jsonb NOT NULL, "
+            f"PRIMARY KEY (chat_id, message_id, month_part)) PARTITION BY LIST (month_part)"
+        )
+    conn.commit()
+
+
+def _pg_upsert(conn, table: str, data: dict):
+    """
+    Аналог upsert_partitioned_record: партиция месяца + INSERT ... ON CONFLICT, коммит на строку.
+    """
+    month = data["month_part"]
+    with conn.cursor() as cur:
+        cur.execute(
+            f"CREATE TABLE IF NOT EXISTS {BENCH_SCHEMA}.{table}_{month.replace('-', '_')} "
+            f"PARTITION OF {BENCH_SCHEMA}.{table} FOR VALUES IN (%s)",
+            (month,),
+        )
+        cur.execute(
+            f"INSERT INTO {BENCH_SCHEMA}.{table} (chat_id, message_id, month_part, data) VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT (chat_id, message_id, month_part) DO UPDATE SET data = EXCLUDED.data",
+            (data["chat_id"], data["message_id"], month, json.dumps(data, ensure_ascii=False, default=str)),
+        )
+    conn.commit()
+
+
+async def bench_db_sink(args, tmp_dir):
+    if not args.pg_dsn:
+        return {"skipped": "pass --pg-dsn (or BENCH_PG_DSN) to run against a real Postgres"}
+    import psycopg2
+    from app.bulk_ingest import CopyBackfillSink
+
+    client = make_client(args)
+    info = chat_map()[CHAT_ID]
+    rows = [serialize_message(client.build_message(CHAT_ID, mid), "backfill_message", info)
+            for mid in client.history[CHAT_ID]]
+    conn = psycopg2.connect(args.pg_dsn)
+    try:
+        _pg_setup(conn, "messages_rowwise")
+        started = time.perf_counter()
+        for data in rows:
+            _pg_upsert(conn, "messages_rowwise", data)
+        rowwise = time.perf_counter() - started
+
+        _pg_setup(conn, "messages_copy")
+        sink = CopyBackfillSink(
+            schema=BENCH_SCHEMA,
+            connect=lambda: psycopg2.connect(args.pg_dsn),
+            upsert_record=lambda table, data: _pg_upsert(conn, table, data),
+            ensure_table=lambda table: None,
+        )
+        started = time.perf_counter()
+        for i in range(0, len(rows), args.copy_batch):
+            await asyncio.to_thread(sink.write, "messages_copy", rows[i:i + args.copy_batch])
+        copy = time.perf_counter() - started
+        sink.close()
+    finally:
+        conn.close()
+    return {
+        "rows": len(rows),
+        "batch": args.copy_batch,
+        "rowwise": {"seconds": round(rowwise, 4), "rows_per_sec": round(len(rows) / rowwise, 1)},
+        "copy": {"seconds": round(copy, 4), "rows_per_sec": round(len(rows) / copy, 1)},
+        "speedup": round(rowwise / copy, 2) if copy > 0 else None,
+    }
+
+
+async def bench_chats(args, tmp_dir):
+    def fields(i):
+        # строки собираются заново, как при разборе диалогов Telethon
+        return {
+            "target_id": -1002000000000 - i,
+            "chat_title": f"Channel {i}",
+            "chat_username": f"channel_{i}",
+            "name_uname": f"@channel_{i}",
+            "entity_type": "".join(["Channel", "OrSupergroup"]),
+        }
+
+    def measure(build):
+        before = tracemalloc.take_snapshot()
+        store = build()
+        after = tracemalloc.take_snapshot()
+        size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        return store, round(size / 1024, 1)
+
+    _dicts, dict_kb = measure(lambda: {f["target_id"]: f for f in map(fields, range(args.chats))})
+    directory, store_kb = measure(lambda: ChatDirectory(
+        ChatInfo(**fields(i)) for i in range(args.chats)
+    ))
+    del _dicts
+
+    started = time.perf_counter()
+    for i in range(args.chats):
+        directory.resolve(f"@channel_{i}")
+    lookup = time.perf_counter() - started
+    return {
+        "chats": args.chats,
+        "dicts_kb": dict_kb,
+        "directory_kb": store_kb,
+        "saved_ratio": round(1 - store_kb / dict_kb, 3) if dict_kb else None,
+        "username_lookups_per_sec": round(args.chats / lookup, 1) if lookup > 0 else None,
+    }
+
+
+SCENARIOS = {
+    "serialize": bench_serialize,
+    "delta": bench_delta,
+    "live": bench_live,
+    "backfill": bench_backfill,
+    "gaps": bench_gaps,
+    "catchup": bench_catchup,
+    "mixed": bench_mixed,
+    "db_sink": bench_db_sink,
+    "chats": bench_chats,
+}
+
+
+async def run_scenario(name, args, tmp_dir):
+    # Сценарии независимы: сообщения одного не должны считаться дублями в другом
+    dedup_index.entries.clear()
+    tracemalloc.start()
+    try:
+        out = await SCENARIOS[name](args, tmp_dir)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    out["peak_memory_kb"] = round(peak / 1024, 1)
+    return out
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--deleted-ratio", type=float, default=0.05)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="seconds per fake Telegram request")
+    parser.add_argument("--kafka-latency", type=float, default=0.0)
+    parser.add_argument("--db-latency", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16, help="parallel live handlers")
+    parser.add_argument("--gap-every", type=int, default=50)
+    parser.add_argument("--pg-dsn", default=os.getenv("BENCH_PG_DSN"), help="Postgres DSN for db_sink")
+    parser.add_argument("--copy-batch", type=int, default=50, help="rows per COPY batch (backfill page)")
+    parser.add_argument("--outage-ratio", type=float, default=0.1, help="share of history missed during downtime")
+    parser.add_argument("--chats", type=int, default=20000, help="dialogs for the chats scenario")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="write JSON results to this file")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    results = {
+        "timestamp": time.time(),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "params": {k: v for k, v in vars(args).items() if k != "output"},
+        "scenarios": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.scenario or list(SCENARIOS):
+            results["scenarios"][name] = await run_scenario(name, args, tmp_dir)
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(run(args))
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
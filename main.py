@@ -2,25 +2,43 @@ import asyncio
 import signal
 import logging
 import os
+import time
 import base64
 import json
+from functools import partial
 from telethon import TelegramClient
 from aiokafka import AIOKafkaConsumer
 
 from app.config import settings
-from app.logger import setup_logging
+from app import metrics
+from app.tracing import tracer, span, kafka_headers
+from app.kafka.producer import KafkaMessageProducer
+from app.kafka.delivery import LiveDelivery
+from app.kafka.coordination import KafkaCoordinator
+from app.kafka.admin import ensure_topics
+from app.startup import StartupSequencer
+from app.scheduler import scheduler
+from app.shutdown import ShutdownOrchestrator, drain_queue, load_spool, spool_queue, wait_tasks
+from app.profiling import lag_monitor, handle_profile_command
+from app.telegram.dedup import dedup_index
+from app.telegram.delta import delta_encoder
+from app.telegram.reactions import reaction_aggregator
+from app.telegram.media import media_downloader
+from app.telegram.entity_cache import sender_cache
+from app.logger import setup_logging, set_log_level, stop_logging
 from app.utils import ensure_dir
-from app.telegram.chat_info import get_all_chats_info
+from app.telegram.chat_info import ChatDirectory, get_all_chats_info
 from app.telegram.state_manager import StateManager
+from app.telegram.sessions import SessionContext, SessionPool
 from app.telegram.state import MessageCounter
+from app.telegram.catchup import CatchUpManager, save_update_state
 from app.worker import TGUBotWorker
-from mirco_services_data_management.kafka_io import send_message
 
 logger = logging.getLogger("main")
 
-def decode_session_file():
-    session_b64 = os.getenv("SESSION_FILE_BASE64", "")
-    session_path = settings.SESSION_FILE  # по умолчанию "userbot.session"
+def decode_session_file(session_path=None, env_name="SESSION_FILE_BASE64"):
+    session_b64 = os.getenv(env_name, "")
+    session_path = session_path or settings.SESSION_FILE  # по умолчанию "userbot.session"
     if session_b64.strip():
         try:
             data = base64.b64decode(session_b64)
@@ -28,11 +46,55 @@ def decode_session_file():
                 f.write(data)
             logger.info(f"Decoded Telegram session into '{session_path}'")
         except Exception as e:
-            logger.exception(f"Failed to decode SESSION_FILE_BASE64: {e}")
+            logger.exception(f"Failed to decode {env_name}: {e}")
     else:
-        logger.warning("SESSION_FILE_BASE64 is empty; no preloaded session will be used.")
+        logger.warning(f"{env_name} is empty; no preloaded session will be used.")
 
-async def run_post_message_consumer(client):
+async def _start_session(i: int, session_path: str):
+    decode_session_file(session_path, "SESSION_FILE_BASE64" if i == 0 else f"SESSION_FILE_BASE64_{i}")
+    client = TelegramClient(session_path, settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH)
+    await client.start()
+    if not await client.is_user_authorized():
+        logger.error(f"Telegram client '{session_path}' not authorized (session invalid or expired).")
+        await client.disconnect()
+        return None
+    name = os.path.splitext(os.path.basename(session_path))[0]
+    return SessionContext(name, client)
+
+async def start_sessions():
+    """
+    Параллельно поднимает основную и дополнительные сессии (EXTRA_SESSION_FILES).
+    Неавторизованная дополнительная сессия пропускается, основная — обязательна.
+    """
+    session_files = [settings.SESSION_FILE] + list(settings.EXTRA_SESSION_FILES)
+    sessions = await asyncio.gather(*(_start_session(i, path) for i, path in enumerate(session_files)))
+    if sessions[0] is None:
+        for session in sessions[1:]:
+            if session is not None:
+                await session.client.disconnect()
+        return None
+    sessions = [s for s in sessions if s is not None]
+    return SessionPool(sessions, rebalance_flood_wait=settings.SESSION_REBALANCE_FLOOD_WAIT)
+
+async def load_dialogs(session_pool, chat_id_to_data: ChatDirectory, top_message_ids: dict):
+    """
+    Загружает диалоги всех сессий параллельно; chat_id_to_data заполняется на месте
+    (на него уже ссылаются зарегистрированные обработчики), top_message_ids — ID
+    последних сообщений диалогов (для догона после рестарта).
+    """
+    results = await asyncio.gather(
+        *(get_all_chats_info(s.client, top_message_ids) for s in session_pool.sessions)
+    )
+    for session, session_chats in zip(session_pool.sessions, results):
+        session_pool.set_chats(session.name, session_chats)
+        for chat_id, chat_data in session_chats.items():
+            chat_id_to_data.setdefault(chat_id, chat_data)
+    logger.info(
+        f"[main] Discovered {len(chat_id_to_data)} chats/channels after exclusions "
+        f"({len(session_pool.sessions)} sessions)."
+    )
+
+async def run_post_message_consumer(client, chat_id_to_data: ChatDirectory, session_pool: SessionPool = None):
     consumer = AIOKafkaConsumer(
         "tg_post_message",
         bootstrap_servers=settings.kafka_broker,
@@ -45,12 +107,28 @@ async def run_post_message_consumer(client):
     try:
         async for msg in consumer:
             data = msg.value
+            if data.get("command") == "set_log_level":
+                set_log_level(data.get("level", "INFO"), data.get("logger"))
+                continue
+            if data.get("command") == "profile":
+                if handle_profile_command(data):
+                    logger.info(f"Profiling started via Kafka command: {data}")
+                continue
             if data.get("command") == "post_message":
                 text = data.get("text", "")
                 channel = data.get("channel") or settings.PUBLISH_CHANNEL
+                # известный чат — по target_id из справочника (без resolveUsername) и через
+                # сессию, которая его видит: у основной сессии может не быть его entity
+                known = chat_id_to_data.resolve(channel) if channel else None
+                sender = client
+                if known is not None:
+                    channel = known.target_id
+                    if session_pool is not None:
+                        sender = session_pool.client_for(channel)
                 if channel and text:
                     try:
-                        await client.send_message(channel, text)
+                        async with scheduler.slot("post"):
+                            await sender.send_message(channel, text)
                         logger.info(f"Posted message to channel {channel} via Kafka command.")
                     except Exception as e:
                         logger.exception(f"Failed to post message: {e}")
@@ -60,60 +138,182 @@ async def run_post_message_consumer(client):
         await consumer.stop()
 
 async def run_tg_ubot():
-    setup_logging()
-    ensure_dir("/app/data")
-    ensure_dir("/app/logs")
+    startup = StartupSequencer()
+    with startup.phase("bootstrap"):
+        setup_logging()
+        ensure_dir("/app/data")
+        ensure_dir("/app/logs")
+        if settings.LOOP_LAG_MONITOR_ENABLED:
+            lag_monitor.start()
+        state_mgr = StateManager("/app/data/state.json")
+
+    # Всё, на что ссылаются live-обработчики, создаётся до подключения клиентов:
+    # обработчики регистрируются сразу после client.start(), а события,
+    # пришедшие во время старта, ждут handlers_ready
+    chat_id_to_data = ChatDirectory()
+    message_buffer = asyncio.Queue()
+    metrics.QUEUE_DEPTH.set_function(message_buffer.qsize, queue="message_buffer")
+    userbot_active = asyncio.Event()
+    userbot_active.set()
+    handlers_ready = asyncio.Event()
 
-    decode_session_file()
+    from app.telegram.handlers import register_unified_handler
 
-    client = TelegramClient(settings.SESSION_FILE, settings.TELEGRAM_API_ID, settings.TELEGRAM_API_HASH)
-    await client.start()
+    async def start_clients():
+        pool = await start_sessions()
+        if pool is None:
+            return None
+        for session in pool.sessions:
+            register_unified_handler(
+                client=session.client,
+                message_buffer=message_buffer,
+                userbot_active=userbot_active,
+                chat_id_to_data=chat_id_to_data,
+                state_mgr=state_mgr,
+                owns_chat=partial(pool.owns, session.name),
+                ready=handlers_ready,
+                owner_settled=pool.wait_replica
+            )
+        return pool
 
-    if not await client.is_user_authorized():
+    async def start_metrics():
+        if not settings.METRICS_ENABLED:
+            return None
+        try:
+            return await metrics.start_metrics_server(settings.METRICS_HOST, settings.METRICS_PORT)
+        except OSError as e:
+            logger.error(f"[main] Could not start metrics endpoint: {e}")
+            return None
+
+    # Собственный продюсер, чтобы передавать контекст трассы в заголовках Kafka
+    producer = KafkaMessageProducer()
+
+    async def start_producer():
+        await producer.initialize()
+        if settings.KAFKA_LATEST_STATE_TOPIC:
+            await ensure_topics([(
+                settings.KAFKA_LATEST_STATE_TOPIC,
+                settings.KAFKA_LATEST_STATE_PARTITIONS,
+                {"cleanup.policy": "compact"},
+            )])
+
+    session_pool, _, metrics_server, _ = await startup.gather(
+        ("telegram_sessions", start_clients()),
+        ("kafka_producer", start_producer()),
+        ("metrics_server", start_metrics()),
+        ("sender_cache", asyncio.to_thread(sender_cache.load)),
+    )
+    if session_pool is None:
         logger.error("Telegram client not authorized (session invalid or expired). Exiting.")
+        await producer.close()
+        if metrics_server is not None:
+            metrics_server.close()
         return
+    client = session_pool.primary.client
 
-    chat_id_to_data = await get_all_chats_info(client)
-    logger.info(f"[main] Discovered {len(chat_id_to_data)} chats/channels after exclusions.")
+    # Общий справочник чатов — объединение диалогов всех сессий
+    top_message_ids = {}
+    await startup.run("dialogs", load_dialogs(session_pool, chat_id_to_data, top_message_ids))
 
-    state_mgr = StateManager("/app/data/state.json")
-    msg_counter = MessageCounter(client, threshold=100)
+    coordinator = None
+    if settings.COORDINATION_ENABLED:
+        coordinator = KafkaCoordinator(state_mgr, chat_id_to_data)
+        session_pool.replica_filter = coordinator.owns
+        session_pool.replica_settled = coordinator.wait_settled
+        await startup.run("coordination", coordinator.start())
+    msg_counter = MessageCounter(client, threshold=100, notify_enabled=settings.SAVED_MESSAGES_NOTIFY)
 
-    async def message_callback(data: dict):
+    async def message_callback(data: dict, trace=None):
         topic = settings.UBOT_PRODUCE_TOPIC
-        if worker.producer:
-            await send_message(worker.producer, topic, data)
+        reaction_aggregator.feed(data)
+        if producer.producer:
+            payload, commit_delta = delta_encoder.encode(data) if settings.DELTA_EDITS_ENABLED else (data, None)
+            if payload is None:
+                # правка без изменений отслеживаемых полей — пустую дельту не отправляем
+                tracer.release(trace)
+                return
+            started = time.perf_counter()
+            latest = None
+            if settings.KAFKA_LATEST_STATE_TOPIC:
+                # полная последняя версия сообщения (не дельта) под тем же ключом — для компакции;
+                # подтверждение ждём вместе с основным топиком, но его ошибка доставку не проваливает
+                latest = await producer.enqueue(settings.KAFKA_LATEST_STATE_TOPIC, data)
+            try:
+                with span(trace, "produce_ack"):
+                    await producer.send_message(topic, payload, headers=kafka_headers(trace))
+            except Exception:
+                metrics.KAFKA_PRODUCE_ERRORS.inc(topic=topic)
+                if latest is not None:
+                    await asyncio.gather(latest, return_exceptions=True)
+                raise
+            finally:
+                tracer.release(trace)
+            metrics.KAFKA_PRODUCE_SECONDS.observe(time.perf_counter() - started, topic=topic)
+            if latest is not None:
+                try:
+                    await latest
+                except Exception as e:
+                    # основной топик уже подтвердил запись: повтор всего callback его бы задублировал,
+                    # а компактный топик догонит следующая версия сообщения
+                    metrics.KAFKA_PRODUCE_ERRORS.inc(topic=settings.KAFKA_LATEST_STATE_TOPIC)
+                    logger.warning(
+                        f"Latest-state produce failed for chat_id={data.get('chat_id')} "
+                        f"msg_id={data.get('message_id')}: {e}"
+                    )
+            if commit_delta is not None:
+                commit_delta()
             await msg_counter.increment()
-            message_id = data.get("message_id", "unknown")
-            name_uname = data.get("name_uname", "unknown")
-            month_part = data.get("month_part", "unknown")
-            logger.debug(f"Message processed: id={message_id}, name_uname={name_uname}, month_part={month_part}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "Message processed: id=%s, name_uname=%s, month_part=%s",
+                    data.get("message_id", "unknown"), data.get("name_uname", "unknown"), data.get("month_part", "unknown")
+                )
         else:
-            logger.warning("[message_callback] Producer not ready yet!")
+            tracer.release(trace)
+            # не молча: live-доставка повторит/заспулит, бэкфилл повторит страницу
+            raise RuntimeError("Kafka producer not ready")
 
     worker = TGUBotWorker(
         config=settings,
         client=client,
         chat_id_to_data=chat_id_to_data,
         state_mgr=state_mgr,
-        message_callback=message_callback
+        message_callback=message_callback,
+        session_pool=session_pool
     )
 
-    message_buffer = asyncio.Queue()
-    userbot_active = asyncio.Event()
-    userbot_active.set()
+    # Live-сообщения из обработчиков отправляются в Kafka отсюда
+    delivery = LiveDelivery(message_buffer, message_callback)
+    buffer_task = asyncio.create_task(delivery.run(), name="message_buffer_drain")
+    # Недоставленное при прошлой остановке уходит до включения live-режима
+    # (live-события ждут handlers_ready); spool-файл удаляется после доставки
+    spooled = load_spool()
+    replay_task = None
+    if spooled:
+        replay_task = asyncio.create_task(delivery.replay(spooled), name="spool_replay")
 
-    from app.telegram.handlers import register_unified_handler
-    register_unified_handler(
-        client=client,
-        message_buffer=message_buffer,
-        userbot_active=userbot_active,
-        chat_id_to_data=chat_id_to_data,
-        state_mgr=state_mgr
-    )
+    if settings.MEDIA_ENABLED:
+        await startup.run("media", media_downloader.start(client, state_mgr, session_pool.client_for))
+
+    # Догон простоя до включения live-режима (live-события ждут handlers_ready)
+    if settings.CATCHUP_ENABLED:
+        for session in session_pool.sessions:
+            previous = await save_update_state(session)
+            if previous:
+                current = session.state_mgr.state.get("update_state", {})
+                logger.info(
+                    f"[main] session {session.name}: pts {previous.get('pts')} -> {current.get('pts')} "
+                    f"since {previous.get('date')}"
+                )
+        catchup = CatchUpManager(session_pool, state_mgr, worker.backfill_manager_for)
+        await startup.run("catch_up", catchup.run(top_message_ids))
+
+    # Продюсер, диалоги и обработчики готовы: события, пришедшие во время старта, обрабатываются
+    handlers_ready.set()
+    startup.report()
 
     # Запускаем отдельную задачу для обработки команд на постинг из Kafka
-    post_message_task = asyncio.create_task(run_post_message_consumer(client), name="post_message_consumer")
+    post_message_task = asyncio.create_task(run_post_message_consumer(client, chat_id_to_data, session_pool), name="post_message_consumer")
 
     stop_event = asyncio.Event()
 
@@ -131,7 +331,8 @@ async def run_tg_ubot():
 
     async def worker_main():
         start_task = asyncio.create_task(worker.start(), name="worker_start")
-        await asyncio.sleep(1)
+        # Фоновые циклы стартуют, когда BaseWorker поднял продюсер, а не по фиксированной паузе
+        await worker.wait_started(start_task)
         await worker._after_baseworker_started()
         await start_task
 
@@ -139,13 +340,65 @@ async def run_tg_ubot():
     await stop_event.wait()
 
     logger.info("[main] Shutting down worker...")
-    worker.stop()
-    worker_task.cancel()
-    post_message_task.cancel()
-    await asyncio.gather(worker_task, post_message_task, return_exceptions=True)
+    orchestrator = ShutdownOrchestrator()
+
+    async def stop_intake():
+        # новые события не принимаются; бэкфилл останавливается на ближайшем сообщении
+        # и сохраняет пройденный offset
+        userbot_active.clear()
+        worker.stop()
+        post_message_task.cancel()
+        await media_downloader.stop()
+        tasks = await wait_tasks(worker.background_tasks, orchestrator.remaining() / 2)
+        worker_task.cancel()
+        await asyncio.gather(worker_task, post_message_task, return_exceptions=True)
+        return tasks
+
+    async def drain_buffer():
+        if replay_task is not None:
+            await asyncio.gather(replay_task, return_exceptions=True)
+        return await drain_queue(message_buffer)
+
+    async def spool_rest():
+        # отменённая посреди отправки доставка сама спулит свой элемент
+        tasks = [t for t in (buffer_task, replay_task) if t is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {"spooled": spool_queue(message_buffer)}
+
+    async def flush_producer():
+        await producer.flush()
+        await producer.close()
+
+    async def checkpoint_state():
+        state_mgr.checkpoint_last_seen()
+        state_mgr._save_state()
+        for session in session_pool.sessions:
+            await save_update_state(session)
+        if coordinator is not None:
+            await coordinator.stop()
+        tracer.flush()
+        dedup_index.save()
+        sender_cache.save()
+
+    async def disconnect():
+        lag_monitor.stop()
+        if metrics_server is not None:
+            metrics_server.close()
+        for session in session_pool.sessions:
+            await session.client.disconnect()
+
+    orchestrator.add_stage("stop_intake", stop_intake)
+    orchestrator.add_stage("drain_queues", drain_buffer)
+    orchestrator.add_stage("spool", spool_rest)
+    orchestrator.add_stage("flush_producer", flush_producer)
+    orchestrator.add_stage("checkpoint", checkpoint_state)
+    orchestrator.add_stage("disconnect", disconnect)
+    await orchestrator.run()
 
-    await client.disconnect()
     logger.info("tg_ubot service terminated.")
+    stop_logging()
 
 def main():
     asyncio.run(run_tg_ubot())